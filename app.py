@@ -1,10 +1,16 @@
+import uuid
 import streamlit as st
 import folium
+import pandas as pd
+import polyline
 from streamlit_folium import st_folium
-import requests
+from src.geocode import Geocoder
+from src.matrix import MATRIX_BACKENDS
+from src.trip import TripPlanner
 
 st.set_page_config(page_title="Optimized Route - LATAM/US/CA", layout="wide")
 DEFAULT_OSRM = "https://router.project-osrm.org"
+MAX_DESTINATIONS = 200
 
 # ============ Utils ============
 def safe_get(addr, keys, default=""):
@@ -35,51 +41,25 @@ def minutes_fmt(seconds):
     return f"{h}h {mm}m" if h else f"{mm}m"
 
 # ============ Geocoding ============
+@st.cache_resource
+def geocoder():
+    # uno por proceso: caché en disco compartido y cola a 1 req/s para todas las sesiones
+    return Geocoder()
+
 def search_place(query, country_code=""):
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {"q": query, "format": "json", "addressdetails": 1, "limit": 7}
-    if country_code:
-        params["countrycodes"] = country_code
-    headers = {"User-Agent": "streamlit-route-optimizer/1.0"}
-    r = requests.get(url, params=params, headers=headers, timeout=25)
-    r.raise_for_status()
-    data = r.json()
-    out = []
-    for d in data:
-        out.append({
-            "display_name": d.get("display_name", ""),
-            "lat": float(d.get("lat")),
-            "lon": float(d.get("lon")),
-            "address": d.get("address", {}),
-        })
-    return out
+    return geocoder().search(query, country_code)
 
-# ============ OSRM Trip ============
-def get_trip(points, osrm_url=DEFAULT_OSRM, roundtrip=True):
-    coords = ";".join([f"{lon},{lat}" for lat, lon in points])
-    url = f"{osrm_url}/trip/v1/driving/{coords}"
-    params = {
-        "roundtrip": str(roundtrip).lower(),
-        "source": "first",
-        "destination": "last" if not roundtrip else "any",
-        "overview": "full",
-        "geometries": "geojson",
-        "steps": "false",
-    }
-    r = requests.get(url, params=params, timeout=35)
-    r.raise_for_status()
-    data = r.json()
-    trips = data.get("trips") or []
-    return trips[0] if trips else None
+# ============ Route (local solver) ============
+@st.cache_resource
+def trip_planner(osrm_url, backend):
+    # uno por servidor/backend: matrices por sesión y geometrías compartidas, ambos LRU
+    return TripPlanner(osrm_url, backend)
 
-def geometry_bounds(geojson):
+def points_bounds(latlons):
     """Return [[min_lat, min_lon], [max_lat, max_lon]] for fit bounds."""
-    coords = geojson.get("coordinates") or []
-    lats, lons = [], []
-    for lon, lat in coords:
-        lats.append(lat); lons.append(lon)
-    if not lats or not lons:
+    if not latlons:
         return None
+    lats, lons = zip(*latlons)
     return [[min(lats), min(lons)], [max(lats), max(lons)]]
 
 # ============ Sidebar ============
@@ -104,6 +84,8 @@ with st.sidebar:
     country_code = country_map[country_label]
 
     roundtrip = st.checkbox("Round trip (end at start)", value=True)
+    matrix_backend = st.selectbox("Travel times", MATRIX_BACKENDS, index=MATRIX_BACKENDS.index("auto"),
+                                  help="auto: OSRM, or a local estimate if the server does not answer")
 
 # ============ State ============
 if "start_point" not in st.session_state:
@@ -116,6 +98,8 @@ if "trip_result" not in st.session_state:
     st.session_state.trip_result = None
 if "fit_all" not in st.session_state:
     st.session_state.fit_all = False
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # clave de la matriz de esta sesión
 
 st.title("🚚 Optimized Route — LATAM / US / CA")
 
@@ -158,7 +142,7 @@ if st.session_state.start_point:
     st.info(f"Start: **{st.session_state.start_name}**\n\n({st.session_state.start_point[0]:.6f}, {st.session_state.start_point[1]:.6f})")
 
 # ============ 2) Destinations ============
-st.subheader("2️⃣ Destinations (max 5)")
+st.subheader(f"2️⃣ Destinations (max {MAX_DESTINATIONS})")
 col_d1, col_d2, col_d3 = st.columns([2,1,1])
 with col_d1:
     dest_query = st.text_input("Search destination (e.g., 'BCRP Lima' or 'Golden Gate Bridge')")
@@ -185,8 +169,8 @@ if dest_results:
     dline1, ddetail = format_address_detail(dest_results[didx])
     st.caption(f"**Confirmation:**\n\n{dline1}\n\n{ddetail}")
     if st.button("➕ Add destination"):
-        if len(st.session_state.destinations) >= 5:
-            st.warning("Maximum 5 destinations.")
+        if len(st.session_state.destinations) >= MAX_DESTINATIONS:
+            st.warning(f"Maximum {MAX_DESTINATIONS} destinations.")
         else:
             sel = dest_results[didx]
             st.session_state.destinations.append({
@@ -195,6 +179,16 @@ if dest_results:
             st.session_state.trip_result = None
             st.success("Destination added.")
 
+# Bulk load: CSV with name, lat, lon (e.g. data/centros.csv)
+uploaded = st.file_uploader("…or upload destinations (CSV with name, lat, lon)", type="csv")
+if uploaded is not None and st.button("📥 Add destinations from CSV"):
+    rows = pd.read_csv(uploaded).dropna(subset=["lat", "lon"])
+    room = MAX_DESTINATIONS - len(st.session_state.destinations)
+    for r in rows.head(room).itertuples(index=False):
+        st.session_state.destinations.append({"lat": float(r.lat), "lon": float(r.lon), "name": str(getattr(r, "name", ""))})
+    st.session_state.trip_result = None
+    st.success(f"{min(len(rows), room)} destinations added.")
+
 # Show list with individual delete
 if st.session_state.destinations:
     st.write("📍 **Current destinations:**")
@@ -211,38 +205,42 @@ if st.session_state.destinations:
         st.session_state.trip_result = None
         st.experimental_rerun()
 else:
-    st.info("Add 1 to 5 destinations.")
+    st.info(f"Add 1 to {MAX_DESTINATIONS} destinations.")
 
 # ============ 3) Compute ============
 st.subheader("3️⃣ Compute optimized route")
-if st.button("🚀 Compute route"):
+# Tras el primer cálculo, agregar o quitar una parada re-optimiza solo (desde el orden previo)
+replan = st.session_state.get("auto_plan") and st.session_state.trip_result is None
+if st.button("🚀 Compute route") or replan:
     if not st.session_state.start_point:
         st.error("Please set a start point first.")
     elif not st.session_state.destinations:
         st.error("Please add at least one destination.")
     else:
         try:
-            points = [st.session_state.start_point] + [(d["lat"], d["lon"]) for d in st.session_state.destinations]
-            trip = get_trip(points, osrm_url=osrm_url, roundtrip=roundtrip)
-            if not trip:
-                st.error("OSRM could not compute a route. Try different points.")
-            else:
-                st.session_state.trip_result = {
-                    "trip": trip,
-                    "names": [st.session_state.start_name] + [d["name"] for d in st.session_state.destinations]
-                }
+            latlons = [st.session_state.start_point] + [(d["lat"], d["lon"]) for d in st.session_state.destinations]
+            points = pd.DataFrame(latlons, columns=["lat", "lon"])
+            plan = trip_planner(osrm_url, matrix_backend).plan(st.session_state.session_id, points, roundtrip)
+            st.session_state.trip_result = {
+                "plan": plan,
+                "latlons": latlons,
+                "names": [st.session_state.start_name] + [d["name"] for d in st.session_state.destinations]
+            }
+            st.session_state.auto_plan = True
+            if not replan:
                 st.session_state.fit_all = False  # default: center on start
-                st.success("Route ready ✅")
+            st.success("Route ready ✅")
         except Exception as e:
             st.error(f"Route error: {e}")
 
 # ============ 4) Map + segments ============
 if st.session_state.trip_result:
-    trip = st.session_state.trip_result["trip"]
+    plan = st.session_state.trip_result["plan"]
+    latlons = st.session_state.trip_result["latlons"]
     names_input = st.session_state.trip_result["names"]
 
-    total_km = (trip.get("distance") or 0) / 1000.0
-    total_min = minutes_fmt(trip.get("duration") or 0)
+    total_km = (plan.get("distance") or 0) / 1000.0
+    total_min = minutes_fmt(plan.get("duration") or 0)
     st.info(f"**Total:** {total_km:.2f} km · {total_min}")
 
     # Fit-to-route button
@@ -257,41 +255,30 @@ if st.session_state.trip_result:
     start_lat, start_lon = st.session_state.start_point
     m = folium.Map(location=[start_lat, start_lon], zoom_start=14, control_scale=True)
 
-    # Main route layer
-    gj = folium.GeoJson(trip["geometry"], name="Route")
-    gj.add_to(m)
+    # Route legs (A→B) with real geometry and tooltips
+    order = plan["order"]
+    for a, b, leg in zip(order[:-1], order[1:], plan["legs"]):
+        coords = polyline.decode(leg["geometry"]) if leg.get("geometry") else [latlons[a], latlons[b]]
+        km = (leg.get("distance") or 0) / 1000.0
+        mins = minutes_fmt(leg.get("duration") or 0)
+        folium.PolyLine(coords, weight=5, opacity=0.8,
+                        tooltip=f"{names_input[a]} → {names_input[b]}: {km:.2f} km · {mins}").add_to(m)
 
     # Fit bounds if requested
     if st.session_state.fit_all:
-        bounds = geometry_bounds(trip["geometry"])
+        bounds = points_bounds(latlons)
         if bounds:
             m.fit_bounds(bounds)
 
-    # Waypoints and names (waypoint_index -> original input order)
-    wp = trip.get("waypoints") or []
-    for i, w in enumerate(wp):
-        idx_in = (w.get("waypoint_index") or 0)
-        name = names_input[idx_in] if 0 <= idx_in < len(names_input) else (w.get("name") or f"Point {i+1}")
+    # Stops in visiting order
+    for i, idx_in in enumerate(order[:-1] if order[-1] == order[0] else order):
         folium.Marker(
-            location=[w["location"][1], w["location"][0]],
-            popup=f"{i+1}. {name}",
+            location=list(latlons[idx_in]),
+            popup=f"{i+1}. {names_input[idx_in]}",
             icon=folium.Icon(color="red" if i > 0 else "blue", icon="flag" if i > 0 else "play")
         ).add_to(m)
 
-    # Per-leg tooltips (A→B)
-    legs = trip.get("legs") or []
-    for i, leg in enumerate(legs):
-        if i + 1 >= len(wp):
-            continue
-        a, b = wp[i], wp[i+1]
-        ai = (a.get("waypoint_index") or 0); bi = (b.get("waypoint_index") or 0)
-        an = names_input[ai] if 0 <= ai < len(names_input) else (a.get("name") or f"A{i+1}")
-        bn = names_input[bi] if 0 <= bi < len(names_input) else (b.get("name") or f"B{i+2}")
-        km = (leg.get("distance") or 0) / 1000.0
-        mins = minutes_fmt(leg.get("duration") or 0)
-        folium.PolyLine(
-            [[a["location"][1], a["location"][0]], [b["location"][1], b["location"][0]]],
-            weight=6, opacity=0.0001, tooltip=f"{an} → {bn}: {km:.2f} km · {mins}"
-        ).add_to(m)
-
     st_folium(m, width=1000, height=600)
+
+    st.write("🧭 **Visiting order:**")
+    st.markdown("\n".join(f"{i+1}. {names_input[j]}" for i, j in enumerate(order)))
@@ -0,0 +1,77 @@
+# bench/osrm_stub.py
+from __future__ import annotations
+import json, threading
+import numpy as np, pandas as pd, polyline
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from src.matrix import offline_table
+
+class _Handler(BaseHTTPRequestHandler):
+    """Responde /table y /route como OSRM con la matriz offline (determinista).
+    Cada tramo de /route trae un paso cuya geometría pasa por el punto medio."""
+    counters: dict
+
+    def log_message(self, *args):
+        pass
+
+    def _points(self, coords: str) -> pd.DataFrame:
+        lonlat = np.array([c.split(",") for c in coords.split(";")], dtype=float)
+        return pd.DataFrame({"lon": lonlat[:, 0], "lat": lonlat[:, 1]})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")  # servicio, v1, perfil, coordenadas
+        if len(parts) != 4 or parts[0] not in ("table", "route"):
+            return self._send(400, {"code": "InvalidUrl"})
+        points = self._points(parts[3])
+        distances, durations = offline_table(points)
+        if parts[0] == "table":
+            src = [int(i) for i in query["sources"][0].split(";")] if "sources" in query else slice(None)
+            dst = [int(i) for i in query["destinations"][0].split(";")] if "destinations" in query else slice(None)
+            body = {"code": "Ok",
+                    "distances": np.round(distances[src][:, dst], 1).tolist(),
+                    "durations": np.round(durations[src][:, dst], 1).tolist()}
+        else:
+            lat, lon = points["lat"].to_numpy(), points["lon"].to_numpy()
+            legs = []
+            for a in range(len(points) - 1):
+                b = a + 1
+                path = [(lat[a], lon[a]), ((lat[a] + lat[b]) / 2, (lon[a] + lon[b]) / 2), (lat[b], lon[b])]
+                d, t = round(float(distances[a, b]), 1), round(float(durations[a, b]), 1)
+                legs.append({"distance": d, "duration": t,
+                             "steps": [{"distance": d, "duration": t, "geometry": polyline.encode(path)}]})
+            route = {"distance": sum(l["distance"] for l in legs), "duration": sum(l["duration"] for l in legs),
+                     "legs": legs}
+            if query.get("overview", ["simplified"])[0] != "false":
+                route["geometry"] = polyline.encode(list(zip(lat, lon)))
+            body = {"code": "Ok", "routes": [route]}
+        self._send(200, body)
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.counters[self.path.split("/")[1]] = self.counters.get(self.path.split("/")[1], 0) + 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_stub(host: str = "127.0.0.1", port: int = 0):
+    """Levanta el servidor en un hilo; devuelve (server, url, contadores por servicio).
+    port=0 elige un puerto libre. Detener con server.shutdown()."""
+    counters = {}
+    handler = type("Handler", (_Handler,), {"counters": counters})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}", counters
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="OSRM de prueba (table/route) para benchmarks")
+    ap.add_argument("--port", type=int, default=5000)
+    args = ap.parse_args()
+    _, url, _ = start_stub(port=args.port)
+    print(f"OSRM de prueba en {url}")
+    threading.Event().wait()
@@ -0,0 +1,128 @@
+# bench/run_bench.py
+from __future__ import annotations
+import argparse, os, resource, tempfile, time, tracemalloc
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from bench.synthetic import write_instance
+from bench.osrm_stub import start_stub
+
+STAGES = ("build_data", "matrix", "solve", "legs", "plot")
+
+@contextmanager
+def _stage(row: dict, name: str, trace: bool = False):
+    """Tiempo de pared y RSS máximo del proceso; con trace, el pico de memoria
+    Python/NumPy (tracemalloc) en lugar del tiempo: tracemalloc frena varias veces las
+    etapas en Python (build_data, legs, plot), así que se mide en una pasada aparte."""
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace:
+            row[f"{name}_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+        else:
+            row[f"{name}_s"] = round(time.perf_counter() - t0, 3)
+        row["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def run_size(n_centers: int, osrm_url: str, time_limit: int = 5, decompose: str | None = "auto",
+             cluster_size: int = 100, n_depots: int = 1, tw_tightness: float = 0.3,
+             cold_share: float = 0.25, seed: int = 0, tile_size: int = 50, workers: int = 4,
+             trace: bool = False) -> dict:
+    """Mide cada etapa de run.py sobre una instancia sintética de n_centers centros.
+    decompose='auto' usa clusters desde 300 centros (un solo modelo no escala).
+    trace: pasada de memoria (columnas *_peak_mb) en vez de la de tiempos (ver _stage)."""
+    from src.solve_vrp_osrm_apu import build_data, solve_model
+    from src.matrix import get_matrix
+    from src.legs import fetch_legs
+    from src.plot_map_multi import plot_multi
+
+    if decompose == "auto":
+        decompose = "cluster" if n_centers >= 300 else None
+    row = {"centers": n_centers, "decompose": decompose or "-"}
+    with tempfile.TemporaryDirectory() as tmp:
+        centros_csv, demandas_csv, vehiculos_csv = write_instance(
+            tmp, n_centers, n_depots, tw_tightness, cold_share, seed=seed)
+        centros, demandas, vehiculos = (pd.read_csv(p) for p in (centros_csv, demandas_csv, vehiculos_csv))
+        row["orders"], row["vehicles"] = len(demandas), len(vehiculos)
+
+        with _stage(row, "build_data", trace):
+            data = build_data(centros, demandas, vehiculos)
+        with _stage(row, "matrix", trace):
+            distances, durations = get_matrix(data[0], osrm_url, "osrm", tile_size=tile_size, max_workers=workers)
+        with _stage(row, "solve", trace):
+            if decompose == "cluster":
+                from src.decompose import solve_by_clusters
+                routes = solve_by_clusters(data, distances, durations, time_limit=time_limit, workers=workers,
+                                           cluster_size=cluster_size)
+            elif decompose:
+                from src.decompose import solve_by_depot
+                routes = solve_by_depot(data, distances, durations, time_limit=time_limit, workers=workers)
+            else:
+                routes, _ = solve_model(data, distances, durations, time_limit=time_limit)
+        row["solved"] = routes is not None
+        routes = routes or []
+        used = [r for r in routes if len(r["order"]) > 2]
+        row["routes"] = len(used)
+        row["cost_km"] = round(sum(r["meters"] for r in used) / 1000, 1)
+        with _stage(row, "legs", trace):
+            legs = fetch_legs(osrm_url, used, data[0], max_workers=workers)
+        with _stage(row, "plot", trace):
+            plot_multi(centros_csv, used, legs, os.path.join(tmp, "mapa.html"))
+    return row
+
+def main(sizes, time_limit=5, decompose="auto", cluster_size=100, n_depots=1, tw_tightness=0.3,
+         cold_share=0.25, seed=0, tile_size=50, workers=4, osrm_url=None, out_csv="outputs/bench.csv",
+         trace_memory=False):
+    server = None
+    if not osrm_url:
+        server, osrm_url, _ = start_stub()
+    rows = []
+    try:
+        for n in sizes:
+            # un proceso por tamaño y pasada: el RSS máximo no arrastra el de tamaños anteriores
+            with ProcessPoolExecutor(max_workers=1) as ex:
+                row = ex.submit(run_size, n, osrm_url, time_limit, decompose, cluster_size, n_depots,
+                                tw_tightness, cold_share, seed, tile_size, workers).result()
+            if trace_memory:
+                with ProcessPoolExecutor(max_workers=1) as ex:
+                    traced = ex.submit(run_size, n, osrm_url, time_limit, decompose, cluster_size, n_depots,
+                                       tw_tightness, cold_share, seed, tile_size, workers, True).result()
+                row.update({k: v for k, v in traced.items() if k.endswith("_peak_mb")})
+            rows.append(row)
+            print(", ".join(f"{k}={v}" for k, v in row.items()), flush=True)
+    finally:
+        if server:
+            server.shutdown()
+    df = pd.DataFrame(rows)
+    os.makedirs(os.path.dirname(out_csv) or ".", exist_ok=True)
+    df.to_csv(out_csv, index=False)
+    cols = ["centers", "solved", "cost_km"] + [f"{s}_s" for s in STAGES] + ["max_rss_mb"]
+    print(df[cols].to_string(index=False))
+    print(f"Resultados: {out_csv}")
+    return df
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark por etapas con instancias sintéticas y OSRM local")
+    ap.add_argument("--sizes", default="5,50,500,5000", help="número de centros, separados por comas")
+    ap.add_argument("--time-limit", type=int, default=5, help="segundos de búsqueda por modelo")
+    ap.add_argument("--decompose", choices=("auto", "none", "depot", "cluster"), default="auto",
+                    help="auto: cluster desde 300 centros")
+    ap.add_argument("--cluster-size", type=int, default=100)
+    ap.add_argument("--depots", type=int, default=1)
+    ap.add_argument("--tw-tightness", type=float, default=0.3, help="0 = turno completo, 1 = ventanas de 1 h")
+    ap.add_argument("--cold-share", type=float, default=0.25, help="fracción de centros con cadena de frío")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--tile-size", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=4, help="peticiones OSRM y procesos de solver")
+    ap.add_argument("--osrm", default=None, help="OSRM real a medir (por defecto, el servidor de prueba local)")
+    ap.add_argument("--out", default="outputs/bench.csv")
+    ap.add_argument("--trace-memory", action="store_true",
+                    help="segunda pasada con tracemalloc para el pico de memoria por etapa (*_peak_mb)")
+    args = ap.parse_args()
+    main([int(s) for s in args.sizes.split(",")], args.time_limit,
+         None if args.decompose == "none" else args.decompose, args.cluster_size, args.depots,
+         args.tw_tightness, args.cold_share, args.seed, args.tile_size, args.workers, args.osrm, args.out,
+         args.trace_memory)
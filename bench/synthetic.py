@@ -0,0 +1,104 @@
+# bench/synthetic.py
+from __future__ import annotations
+import math, os
+import numpy as np, pandas as pd
+
+# Capitales de provincia de Apurímac (lat, lon): los centros se dispersan alrededor
+PROVINCES = {
+    "Abancay":      (-13.6351, -72.8811),
+    "Andahuaylas":  (-13.6556, -73.3872),
+    "Chincheros":   (-13.5180, -73.7280),
+    "Aymaraes":     (-14.2950, -73.2440),
+    "Antabamba":    (-14.3650, -72.8780),
+    "Grau":         (-14.1060, -72.7080),
+    "Cotabambas":   (-13.9450, -72.1760),
+}
+ITEMS = [("Antibióticos", False), ("Analgésicos", False), ("Suero", False),
+         ("Vacunas X", True), ("Insulina", True)]
+
+def _hm(sec) -> list[str]:
+    sec = np.asarray(sec, dtype=int)
+    return [f"{s // 3600:02d}:{s % 3600 // 60:02d}" for s in sec]
+
+def synthetic_instance(n_centers: int, n_depots: int = 1, tw_tightness: float = 0.3,
+                       cold_share: float = 0.25, n_vehicles: int | None = None, seed: int = 0):
+    """(centros, demandas, vehiculos) con el mismo formato que data/*.csv.
+
+    tw_tightness: 0 = ventanas de todo el turno (08:00-17:00), 1 = ventanas de 1 h.
+    cold_share: fracción de centros con al menos un pedido de cadena de frío.
+    n_vehicles: por defecto, la flota para ~80 % de ocupación en volumen y no más de
+    5 centros por vehículo (las provincias están a horas entre sí); los refrigerados
+    siguen la misma regla con la demanda fría.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(PROVINCES)
+    n_depots = max(1, min(n_depots, len(names)))
+
+    depots = pd.DataFrame({
+        "id": [f"D{k + 1}" for k in range(n_depots)],
+        "name": [f"Almacén {names[k]}" for k in range(n_depots)],
+        "address": [f"Av. Principal, {names[k]}, Apurímac" for k in range(n_depots)],
+        "lat": [PROVINCES[names[k]][0] for k in range(n_depots)],
+        "lon": [PROVINCES[names[k]][1] for k in range(n_depots)],
+        "type": "DEPO", "open_from": "07:00", "open_to": "19:00",
+    })
+    prov = rng.integers(0, len(names), n_centers)
+    base = np.array([PROVINCES[names[p]] for p in prov]).reshape(-1, 2)
+    latlon = base + rng.normal(0, 0.12, (n_centers, 2))  # ~13 km alrededor de la capital
+    day, shift_start = 9 * 3600, 8 * 3600
+    width = np.round((1 - tw_tightness) * day + tw_tightness * 3600, -2).astype(int)
+    open_from = shift_start + (rng.random(n_centers) * (day - width) // 1800 * 1800).astype(int)
+    centros = pd.DataFrame({
+        "id": [f"C{i + 1:05d}" for i in range(n_centers)],
+        "name": [f"Posta {names[p]} {i + 1}" for i, p in enumerate(prov)],
+        "address": [f"Centro {i + 1}, {names[p]}, Apurímac" for i, p in enumerate(prov)],
+        "lat": latlon[:, 0].round(5), "lon": latlon[:, 1].round(5),
+        "type": "DEST", "open_from": _hm(open_from), "open_to": _hm(open_from + width),
+    })
+
+    # 1-3 pedidos por centro; los centros fríos llevan al menos un ítem refrigerado
+    n_orders = rng.integers(1, 4, n_centers)
+    center = np.repeat(np.arange(n_centers), n_orders)
+    cold_center = rng.random(n_centers) < cold_share
+    first = np.r_[True, center[1:] != center[:-1]]
+    cold = first & cold_center[center]
+    item = np.where(cold, rng.choice([i for i, (_, c) in enumerate(ITEMS) if c], len(center)),
+                    rng.choice([i for i, (_, c) in enumerate(ITEMS) if not c], len(center)))
+    vol = rng.uniform(2, 12, len(center)).round(1)
+    demandas = pd.DataFrame({
+        "order_id": [f"O{i + 1}" for i in range(len(center))],
+        "center_id": centros["id"].to_numpy()[center],
+        "item": [ITEMS[i][0] for i in item],
+        "qty": rng.integers(5, 30, len(center)),
+        "vol_l": vol, "kg": (vol * rng.uniform(0.3, 0.6, len(center))).round(1),
+        "priority": rng.integers(1, 4, len(center)),
+        "cold_chain": cold,
+        "tw_start": centros["open_from"].to_numpy()[center],
+        "tw_end": centros["open_to"].to_numpy()[center],
+        "service_min": rng.integers(5, 11, len(center)),
+    })
+
+    cap_vol, cap_kg = 130.0, 70.0
+    if n_vehicles is None:
+        n_vehicles = max(n_depots, math.ceil(demandas["vol_l"].sum() / (0.8 * cap_vol)),
+                         math.ceil(n_centers / 5), min(n_centers, len(np.unique(prov))))
+    cold_vol = demandas.loc[demandas["center_id"].isin(centros["id"][cold_center]), "vol_l"].sum()
+    n_refrig = min(n_vehicles, max(1 if cold_vol else 0, math.ceil(cold_vol / (0.8 * cap_vol)),
+                                   math.ceil(cold_center.sum() / 5)))
+    vehiculos = pd.DataFrame({
+        "veh_id": [f"V{v + 1}" for v in range(n_vehicles)],
+        "plate": [f"BEN-{v + 1:03d}" for v in range(n_vehicles)],
+        "capacity_vol_l": cap_vol, "capacity_kg": cap_kg,
+        "refrigerated": np.arange(n_vehicles) < n_refrig,
+        "shift_start": "08:00", "shift_end": "17:00",
+        "depot_id": [f"D{v % n_depots + 1}" for v in range(n_vehicles)],
+    })
+    return pd.concat([depots, centros], ignore_index=True), demandas, vehiculos
+
+def write_instance(out_dir: str, *args, **kwargs) -> tuple[str, str, str]:
+    """Escribe centros.csv, demandas.csv y vehiculos.csv en out_dir y devuelve sus rutas."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = tuple(os.path.join(out_dir, f"{name}.csv") for name in ("centros", "demandas", "vehiculos"))
+    for df, path in zip(synthetic_instance(*args, **kwargs), paths):
+        df.to_csv(path, index=False)
+    return paths
@@ -1,58 +1,100 @@
-import os, argparse, pandas as pd
-from src.solve_vrp_osrm_apu import solve_vrp
-from src.osrm import osrm_leg
-from src.plot_map_multi import plot_multi
+import argparse, logging
+from src.matrix import MATRIX_BACKENDS
+from src.metrics import metrics
+from src.osrm_client import configure as configure_osrm
+from src.pipeline import Pipeline, STAGES
+from src.tables import OUTPUT_FORMATS
 
-def main(centros_csv, demandas_csv, vehiculos_csv, osrm_url):
-    os.makedirs("outputs", exist_ok=True)
-    centros   = pd.read_csv(centros_csv)
-    demandas  = pd.read_csv(demandas_csv)
-    vehiculos = pd.read_csv(vehiculos_csv)
+log = logging.getLogger("run")
 
-    routes, manager, points = solve_vrp(centros, demandas, vehiculos, osrm_url)
-    if routes is None:
-        print("No se encontró solución.")
+def main(centros_csv, demandas_csv, vehiculos_csv, osrm_url, cache_dir="cache", tile_size=50, osrm_workers=4,
+         matrix_backend="auto", profiles_json=None, decompose=None, workers=None, time_limit=20,
+         cluster_size=100, cluster_method="sweep", improve_time=0, warm_start=None,
+         portfolio=None, plateau=None, matrix_store=None, sparse_k=None, map_tolerance=10.0, geojson=None,
+         stage="render", force=(), artifacts="outputs/stages", output_format="csv"):
+    """Corre las etapas hasta stage (ver src.pipeline): las que ya tienen artefacto para
+    las mismas entradas se saltan."""
+    solve_options = {"decompose": decompose, "workers": workers, "time_limit": time_limit,
+                     "cluster_size": cluster_size, "cluster_method": cluster_method,
+                     "improve_time": improve_time, "portfolio": portfolio, "plateau": plateau}
+    pipeline = Pipeline(centros_csv, demandas_csv, vehiculos_csv, osrm_url, artifacts=artifacts, force=force,
+                        matrix_backend=matrix_backend, profiles_json=profiles_json, sparse_k=sparse_k,
+                        cache_dir=cache_dir, tile_size=tile_size, osrm_workers=osrm_workers,
+                        matrix_store=matrix_store, solve_options=solve_options, warm_start=warm_start,
+                        map_tolerance=map_tolerance, geojson=geojson, output_format=output_format)
+    out = getattr(pipeline, stage)()
+    if out is None:
+        log.error("No se encontró solución.")
         return
-
-    out_plan = []
-    for r in routes:
-        v = r["vehicle"]; order = r["order"]
-        for seq, node in enumerate(order):
-            out_plan.append({"vehicle": v, "seq": seq, "node_index": node, "id": points.iloc[node]["id"], "name": points.iloc[node]["name"]})
-    pd.DataFrame(out_plan).to_csv("outputs/plan_entregas.csv", index=False)
-
-    legs_by_vehicle = {}
-    for r in routes:
-        v = r["vehicle"]; order = r["order"]
-        legs = []
-        for a, b in zip(order[:-1], order[1:]):
-            a_row = points.iloc[a]; b_row = points.iloc[b]
-            # llamar OSRM por tramo para distancia real y geometría
-            leg = osrm_leg(osrm_url, (a_row.lon, a_row.lat), (b_row.lon, b_row.lat), overview="full")
-            if leg:
-                legs.append({
-                    "from": a, "to": b,
-                    "from_id": a_row["id"], "to_id": b_row["id"],
-                    "from_name": a_row["name"], "to_name": b_row["name"],
-                    "meters": leg["distance"], "seconds": leg["duration"],
-                    "geometry": leg["geometry"]
-                })
-        legs_by_vehicle[v] = legs
-
-    rows = []
-    for v, legs in legs_by_vehicle.items():
-        for leg in legs:
-            rows.append({"vehicle": v, **{k:leg[k] for k in ["from_id","to_id","from_name","to_name","meters","seconds"]}})
-    pd.DataFrame(rows).to_csv("outputs/leg_distances.csv", index=False)
-
-    out_html = plot_multi("data/centros.csv", routes, legs_by_vehicle, "outputs/mapa.html")
-    print(f"Mapa: {out_html}")
+    log.info("%s: %s", "Mapa" if stage == "render" else f"Etapa {stage}", out)
+    return out
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("--centros", default="./data/centros.csv")
+    ap.add_argument("stage", nargs="?", choices=STAGES, default="render",
+                    help="última etapa a correr (matrix, solve, legs o render = todo); "
+                         "las que no cambiaron se leen de --artifacts")
+    ap.add_argument("--centros", default="./data/centros.csv", help="CSV, Parquet (.parquet) o Arrow (.feather)")
     ap.add_argument("--demandas", default="./data/demandas.csv")
     ap.add_argument("--vehiculos", default="./data/vehiculos.csv")
     ap.add_argument("--osrm", default="https://router.project-osrm.org")
+    ap.add_argument("--cache-dir", default="cache", help="caché de matrices OSRM ('' para desactivar)")
+    ap.add_argument("--tile-size", type=int, default=50, help="nodos por bloque de /table (origen y destino)")
+    ap.add_argument("--osrm-workers", type=int, default=4, help="peticiones /table concurrentes")
+    ap.add_argument("--osrm-rate", type=float, default=None,
+                    help="peticiones/s máximas a OSRM (por defecto sin límite; 1 con router.project-osrm.org)")
+    ap.add_argument("--osrm-retries", type=int, default=4, help="reintentos con backoff ante 429/5xx/red")
+    ap.add_argument("--osrm-fallback", default=None,
+                    help="OSRM de respaldo si el circuito del principal se abre (p. ej. http://localhost:5000)")
+    ap.add_argument("--matrix", choices=MATRIX_BACKENDS, default="auto",
+                    help="osrm | offline (haversine x sinuosidad) | auto (offline si OSRM no responde)")
+    ap.add_argument("--matrix-store", default=None,
+                    help="directorio de matrices float32 mapeadas en memoria (python -m src.matrix_store)")
+    ap.add_argument("--sparse", type=int, default=None, metavar="K",
+                    help="sólo arcos a los K centros más cercanos (matriz y modelo ~lineales en nodos)")
+    ap.add_argument("--offline-profiles", default=None, help="JSON {region: {sinuosity, speed_kmh}}")
+    ap.add_argument("--time-limit", type=int, default=20, help="segundos de búsqueda")
+    ap.add_argument("--decompose", nargs="?", const="depot", choices=("depot", "cluster"), default=None,
+                    help="depot: un proceso por depósito; cluster: grupos de centros por depósito en paralelo")
+    ap.add_argument("--workers", type=int, default=None, help="procesos para --decompose y --portfolio (por defecto, núcleos)")
+    ap.add_argument("--cluster-size", type=int, default=100, help="centros por grupo con --decompose cluster")
+    ap.add_argument("--cluster-method", choices=("sweep", "kmeans"), default="sweep", help="barrido angular o k-means")
+    ap.add_argument("--improve", type=int, default=0, help="segundos de mejora global tras --decompose cluster")
+    ap.add_argument("--warm-start", default=None,
+                    help="plan previo (outputs/plan_entregas.csv o outputs/plan_snapshot.json) como punto de partida")
+    ap.add_argument("--portfolio", nargs="?", const="default", default=None,
+                    help="estrategias en paralelo, p. ej. SAVINGS/TABU_SEARCH,PATH_CHEAPEST_ARC "
+                         "(sin valor: el portafolio por defecto); gana la de menor costo")
+    ap.add_argument("--plateau", default=None, metavar="UMBRAL:VENTANA",
+                    help="corta la búsqueda si el costo mejora menos de UMBRAL (relativo) en VENTANA s, p. ej. 0.001:5")
+    ap.add_argument("--map-tolerance", type=float, default=10.0,
+                    help="simplificación de las geometrías del mapa en metros (0 = resolución completa)")
+    ap.add_argument("--geojson", default=None, help="escribe las rutas como GeoJSON (p. ej. outputs/rutas.geojson)")
+    ap.add_argument("--output-format", choices=OUTPUT_FORMATS, default="csv",
+                    help="plan_entregas, schedule y leg_distances en CSV o Parquet (requiere pyarrow)")
+    ap.add_argument("--artifacts", default="outputs/stages", help="directorio de artefactos por etapa y hash")
+    ap.add_argument("--force", action="append", choices=STAGES, default=[],
+                    help="recalcula esta etapa aunque sus entradas no cambien (repetible)")
+    ap.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                    help="DEBUG muestra además las ventanas/servicio por nodo")
+    ap.add_argument("--metrics", default=None,
+                    help="exporta tiempos por etapa, OSRM y solver (.json, o .prom para Prometheus)")
     args = ap.parse_args()
-    main(args.centros, args.demandas, args.vehiculos, args.osrm)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    portfolio = None
+    if args.portfolio:
+        portfolio = True if args.portfolio == "default" else args.portfolio.split(",")
+    plateau = tuple(float(x) for x in args.plateau.split(":")) if args.plateau else None
+    configure_osrm(pool_size=max(16, args.osrm_workers), rate=args.osrm_rate, retries=args.osrm_retries,
+                   fallback_url=args.osrm_fallback)
+    try:
+        main(args.centros, args.demandas, args.vehiculos, args.osrm, args.cache_dir, args.tile_size,
+             args.osrm_workers, args.matrix, args.offline_profiles, args.decompose, args.workers,
+             args.time_limit, args.cluster_size, args.cluster_method, args.improve, args.warm_start,
+             portfolio, plateau, args.matrix_store, args.sparse, args.map_tolerance, args.geojson,
+             args.stage, args.force, args.artifacts, args.output_format)
+    finally:
+        # también si la corrida falla: es cuando más interesa saber dónde se fue el tiempo
+        if args.metrics:
+            metrics.save(args.metrics)
+            log.info("Métricas: %s", args.metrics)
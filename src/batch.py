@@ -0,0 +1,195 @@
+# src/batch.py
+from __future__ import annotations
+import json, logging, os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from src.matrix import get_matrix, load_profiles, matrix_source
+from src.matrix_store import save_store, store_lookup, store_source
+from src.pipeline import Pipeline
+from src.tables import OUTPUT_FORMATS, TABLE_DTYPES, apply_dtypes, read_table, write_table
+
+log = logging.getLogger(__name__)
+
+TABLES = ("centros", "demandas", "vehiculos")
+# Opciones de búsqueda por escenario (kwargs de solve_vrp vía Pipeline.solve_options).
+SCENARIO_OPTIONS = {"time_limit": int, "decompose": str, "workers": int, "cluster_size": int,
+                    "cluster_method": str, "improve_time": int}
+SCENARIO_KEYS = {"name", "options", "demand_scale", "drop_vehicles", "add_vehicles", *TABLES}
+
+def _solve_options(options: dict) -> tuple[dict, int | None]:
+    """Opciones del manifiesto -> (solve_options, sparse_k)."""
+    kwargs, sparse_k = {}, None
+    for name, value in options.items():
+        if name in SCENARIO_OPTIONS:
+            kwargs[name] = SCENARIO_OPTIONS[name](value)
+        elif name == "portfolio":
+            kwargs[name] = value if isinstance(value, list) else bool(value)
+        elif name == "plateau":
+            kwargs[name] = tuple(float(x) for x in value)
+        elif name == "sparse_k":
+            sparse_k = int(value)
+        else:
+            raise ValueError(f"opción desconocida: {name!r}")
+    return kwargs, sparse_k
+
+def load_manifest(path: str) -> list[dict]:
+    """Escenarios de un manifiesto JSON. Las claves de primer nivel (centros, demandas,
+    vehiculos, options, ...) son los valores por defecto de cada escenario:
+    {"centros": "data/centros.csv", "demandas": "data/demandas.csv",
+     "vehiculos": "data/vehiculos.csv", "options": {"time_limit": 20},
+     "scenarios": [{"name": "base"}, {"name": "martes", "demandas": "data/dem_martes.csv"},
+                   {"name": "demanda+20", "demand_scale": 1.2},
+                   {"name": "sin-V2", "drop_vehicles": ["V2"]},
+                   {"name": "flota+1", "add_vehicles": [{"veh_id": "V9", ...}]}]}"""
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    defaults = {k: v for k, v in manifest.items() if k != "scenarios"}
+    scenarios = []
+    for i, sc in enumerate(manifest.get("scenarios") or [{}]):
+        merged = {**defaults, **sc, "options": {**defaults.get("options", {}), **sc.get("options", {})}}
+        merged.setdefault("name", f"escenario{i + 1}")
+        unknown = set(merged) - SCENARIO_KEYS
+        if unknown:
+            raise ValueError(f"{merged['name']}: claves desconocidas {sorted(unknown)}")
+        missing = [t for t in TABLES if not merged.get(t)]
+        if missing:
+            raise ValueError(f"{merged['name']}: faltan {missing}")
+        _solve_options(merged["options"])  # opción inválida -> error antes de lanzar procesos
+        scenarios.append(merged)
+    names = [sc["name"] for sc in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("nombres de escenario repetidos")
+    return scenarios
+
+def scenario_tables(sc: dict) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Tablas del escenario con sus cambios: demand_scale (vol_l y kg), drop_vehicles
+    (veh_id) y add_vehicles (registros con las columnas de vehiculos.csv)."""
+    centros, demandas, vehiculos = (read_table(sc[t], t) for t in TABLES)
+    if sc.get("demand_scale") is not None:
+        demandas[["vol_l", "kg"]] = demandas[["vol_l", "kg"]].astype(float) * float(sc["demand_scale"])
+    if sc.get("drop_vehicles"):
+        drop = {str(v) for v in sc["drop_vehicles"]}
+        vehiculos = vehiculos[~vehiculos["veh_id"].astype(str).isin(drop)].reset_index(drop=True)
+    if sc.get("add_vehicles"):
+        added = apply_dtypes(pd.DataFrame.from_records(sc["add_vehicles"]), TABLE_DTYPES["vehiculos"])
+        vehiculos = pd.concat([vehiculos, added], ignore_index=True)
+    return centros, demandas, vehiculos
+
+def shared_store(scenarios: list[dict], store: str, osrm_url: str, matrix_backend: str = "auto",
+                 cache_dir: str | None = "cache", tile_size: int = 50, osrm_workers: int = 4,
+                 profiles: dict | None = None) -> str | None:
+    """Almacén de matrices (src.matrix_store) con la unión de los centros de todos los
+    escenarios: se pide una sola vez, antes de lanzar los procesos, y cada uno lo abre
+    mapeado en memoria (sin peticiones ni copias). Si ya los cubre con el mismo origen
+    no se toca. None si OSRM no respondió con 'auto' (la estimación no se guarda) o si
+    un almacén de OSRM no sirve para 'offline' (no se pisa): cada escenario pide la suya."""
+    points = pd.concat([read_table(p, "centros") for p in dict.fromkeys(sc["centros"] for sc in scenarios)],
+                       ignore_index=True)
+    points = points.drop_duplicates("id").drop_duplicates(["lat", "lon"]).reset_index(drop=True)
+    wanted = matrix_source(matrix_backend, profiles)
+    current = store_source(store) if os.path.exists(os.path.join(store, "index.csv")) else None
+    if current == wanted and store_lookup(store, points) is not None:
+        log.info("almacén %s: ya cubre los %d centros", store, len(points))
+        return store
+    if current and current.get("backend") == "osrm" and wanted["backend"] != "osrm":
+        log.warning("almacén %s: es de OSRM y se pidió %s; se deja intacto y sin almacén común",
+                    store, matrix_backend)
+        return None
+    report = {}
+    distances, durations = get_matrix(points, osrm_url, matrix_backend, cache_dir=cache_dir, tile_size=tile_size,
+                                      max_workers=osrm_workers, profiles=profiles, report=report)
+    if durations is None:
+        raise RuntimeError("el backend no devolvió duraciones; no se puede armar el almacén")
+    if report["backend"] != wanted["backend"]:
+        log.warning("almacén %s: OSRM no respondió; la estimación offline no se guarda y cada "
+                    "escenario pide su matriz", store)
+        return None
+    save_store(store, points, distances, durations, source=wanted)
+    log.info("almacén %s: %d centros", store, len(points))
+    return store
+
+def run_scenario(sc: dict, out_dir: str, osrm_url: str, matrix_backend: str = "auto",
+                 matrix_store: str | None = None, cache_dir: str | None = "cache",
+                 profiles_json: str | None = None, artifacts: str = "outputs/stages",
+                 output_format: str = "csv") -> dict:
+    """Resuelve un escenario (etapas matrix y solve de src.pipeline) en out_dir/<name> y
+    devuelve su fila de la comparación."""
+    t0 = time.perf_counter()
+    row = {"scenario": sc["name"], "status": "ok"}
+    try:
+        folder = os.path.join(out_dir, sc["name"])
+        os.makedirs(os.path.join(folder, "inputs"), exist_ok=True)
+        paths = {}
+        for name, table in zip(TABLES, scenario_tables(sc)):
+            # mismo formato que la tabla de origen (CSV, Parquet o Arrow)
+            paths[name] = os.path.join(folder, "inputs", name + os.path.splitext(sc[name])[1])
+            write_table(table, paths[name])
+        solve_options, sparse_k = _solve_options(sc["options"])
+        pipeline = Pipeline(paths["centros"], paths["demandas"], paths["vehiculos"], osrm_url,
+                            artifacts=artifacts, out_dir=folder, matrix_backend=matrix_backend,
+                            profiles_json=profiles_json, sparse_k=sparse_k, cache_dir=cache_dir,
+                            matrix_store=matrix_store, solve_options=solve_options, output_format=output_format)
+        if pipeline.solve() is None:
+            row["status"] = "sin solución"
+        else:
+            used = [r for r in pipeline.routes if len(r["order"]) > 2]
+            late = [s["late"] for r in used for s in r["stops"] if s["late"] > 0]
+            row.update({"km": round(sum(r["meters"] for r in pipeline.routes) / 1000.0, 1),
+                        "vehicles_used": len(used), "vehicles": len(pipeline.routes),
+                        "stops": sum(len(r["order"]) - 2 for r in used),
+                        "route_hours": round(sum(r["duration"] for r in used) / 3600.0, 2),
+                        "late_stops": len(late), "late_min": round(sum(late) / 60.0, 1),
+                        "max_late_min": round(max(late, default=0) / 60.0, 1)})
+    except Exception as e:
+        log.exception("escenario %s falló", sc["name"])
+        row["status"] = f"error: {type(e).__name__}: {e}"
+    row["runtime_s"] = round(time.perf_counter() - t0, 2)
+    return row
+
+def run_batch(scenarios: list[dict], out_dir: str, osrm_url: str, workers: int | None = None,
+              matrix_backend: str = "auto", store: str | None = "cache/batch_store",
+              cache_dir: str | None = "cache", tile_size: int = 50, osrm_workers: int = 4,
+              profiles_json: str | None = None, artifacts: str = "outputs/stages",
+              output_format: str = "csv") -> pd.DataFrame:
+    """Escenarios en procesos paralelos (workers, por defecto los núcleos) sobre un
+    almacén de matrices común; cada uno deja su plan en out_dir/<name>. Devuelve la
+    tabla comparativa (también en out_dir/comparison.csv), en el orden del manifiesto."""
+    if store:
+        store = shared_store(scenarios, store, osrm_url, matrix_backend, cache_dir, tile_size, osrm_workers,
+                     load_profiles(profiles_json))
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as ex:
+        futures = {ex.submit(run_scenario, sc, out_dir, osrm_url, matrix_backend, store, cache_dir,
+                             profiles_json, artifacts, output_format): sc["name"] for sc in scenarios}
+        for future in as_completed(futures):
+            row = future.result()
+            log.info("%s: %s en %.1f s", row["scenario"], row["status"], row["runtime_s"])
+            rows[futures[future]] = row
+    table = pd.DataFrame([rows[sc["name"]] for sc in scenarios])
+    os.makedirs(out_dir, exist_ok=True)
+    table.to_csv(os.path.join(out_dir, "comparison.csv"), index=False)
+    return table
+
+if __name__ == "__main__":
+    import argparse
+    from src.matrix import MATRIX_BACKENDS
+    ap = argparse.ArgumentParser(description="Planifica en paralelo los días o escenarios de un manifiesto JSON")
+    ap.add_argument("manifest", help="JSON con valores por defecto y una lista scenarios (ver load_manifest)")
+    ap.add_argument("--out", default="outputs/batch", help="un directorio por escenario + comparison.csv")
+    ap.add_argument("--workers", type=int, default=None, help="escenarios a la vez (por defecto, núcleos)")
+    ap.add_argument("--osrm", default="https://router.project-osrm.org")
+    ap.add_argument("--matrix", choices=MATRIX_BACKENDS, default="auto")
+    ap.add_argument("--store", default="cache/batch_store",
+                    help="almacén de matrices común a los escenarios ('' = cada uno pide la suya)")
+    ap.add_argument("--cache-dir", default="cache", help="caché de matrices OSRM ('' para desactivar)")
+    ap.add_argument("--tile-size", type=int, default=50)
+    ap.add_argument("--osrm-workers", type=int, default=4)
+    ap.add_argument("--offline-profiles", default=None)
+    ap.add_argument("--artifacts", default="outputs/stages", help="artefactos por etapa (compartidos con run.py)")
+    ap.add_argument("--output-format", choices=OUTPUT_FORMATS, default="csv", help="planes, horarios y tramos por escenario")
+    args = ap.parse_args()
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s")
+    table = run_batch(load_manifest(args.manifest), args.out, args.osrm, args.workers, args.matrix,
+                      args.store or None, args.cache_dir or None, args.tile_size, args.osrm_workers,
+                      args.offline_profiles, args.artifacts, args.output_format)
+    print(table.to_string(index=False))
@@ -0,0 +1,275 @@
+# src/decompose.py
+from __future__ import annotations
+import logging, math
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from src.solve_vrp_osrm_apu import HORIZON_SEC, subset_data, solve_model, solve_from_routes
+from src.feasibility import round_trips
+from src.matrix_store import shared_files, open_shared
+
+log = logging.getLogger(__name__)
+
+def _fill_ratio(demand, capacity) -> float:
+    total = float(np.sum(capacity))
+    return min(1.0, 1.1 * float(np.sum(demand)) / total) if total > 0 else 1.0
+
+def assign_to_depots(data: tuple, distances, durations=None) -> list[int]:
+    """Depósito de cada centro: el de menor ida+vuelta cuya flota pueda atenderlo
+    (refrigerado si el centro es de cadena de frío) y con capacidad restante.
+    Los centros se asignan de más cercano a más lejano a su mejor depósito.
+    Con durations sólo se consideran los depósitos desde los que la ida, el servicio
+    y la vuelta entran en HORIZON_SEC (la prueba de feasibility.check_time); si
+    ninguno entra, todos."""
+    (
+        points, dem_vol, dem_kg, service_sec, tw_start, tw_end,
+        cap_vol, cap_kg, veh_is_refrig, cold_centers,
+        fleet_start, fleet_end, veh_depot
+    ) = data
+    n_depots = max(veh_depot) + 1
+    dist = np.asarray(distances, dtype=float)
+    round_trip = dist[:n_depots, n_depots:] + dist[n_depots:, :n_depots].T  # depósito x centro
+    if durations is None:
+        reach = np.ones_like(round_trip, dtype=bool)
+    else:
+        reach = round_trips(durations, service_sec, n_depots)[:, n_depots:] <= HORIZON_SEC
+
+    left_vol = np.zeros(n_depots); left_kg = np.zeros(n_depots)
+    cold_vol = np.zeros(n_depots); cold_kg = np.zeros(n_depots)  # capacidad refrigerada libre
+    for v, d in enumerate(veh_depot):
+        left_vol[d] += cap_vol[v]; left_kg[d] += cap_kg[v]
+        if veh_is_refrig[v]:
+            cold_vol[d] += cap_vol[v]; cold_kg[d] += cap_kg[v]
+    has_refrig = cold_vol > 0
+    # llenar cada depósito sólo hasta la utilización media de la flota (+10%), para no
+    # dejar subproblemas al 100% de capacidad (bin packing casi siempre infactible)
+    limit_vol = left_vol * _fill_ratio(dem_vol[n_depots:], left_vol)
+    limit_kg = left_kg * _fill_ratio(dem_kg[n_depots:], left_kg)
+
+    assigned = [0] * len(points)
+    for c in np.argsort(round_trip.min(axis=0), kind="stable"):
+        node = n_depots + int(c)
+        cold = points.iloc[node]["id"] in cold_centers
+        ranked = [int(d) for d in np.argsort(round_trip[:, c], kind="stable")]
+        ranked = [d for d in ranked if reach[d, c]] or ranked
+        compatible = [d for d in ranked if has_refrig[d] or not cold] or ranked
+        cold_ok = [d for d in compatible
+                   if not cold or (cold_vol[d] >= dem_vol[node] and cold_kg[d] >= dem_kg[node])]
+        balanced = [d for d in cold_ok if limit_vol[d] >= dem_vol[node] and limit_kg[d] >= dem_kg[node]]
+        fits = [d for d in cold_ok if left_vol[d] >= dem_vol[node] and left_kg[d] >= dem_kg[node]]
+        d = (balanced or fits or compatible)[0]
+        assigned[node] = d
+        left_vol[d] -= dem_vol[node]; left_kg[d] -= dem_kg[node]
+        limit_vol[d] -= dem_vol[node]; limit_kg[d] -= dem_kg[node]
+        if cold:
+            cold_vol[d] -= dem_vol[node]; cold_kg[d] -= dem_kg[node]
+    return assigned
+
+def _solve_part(args):
+    data, (dist_file, dur_file), nodes, use_matrix, time_limit = args
+    distances, durations = open_shared(dist_file, nodes), open_shared(dur_file, nodes)
+    routes, _ = solve_model(data, distances, durations, use_matrix, time_limit)
+    return routes
+
+def _merge_failed(data: tuple, distances, parts: list, results: list) -> tuple[list, list]:
+    """Une cada parte sin solución con la más cercana (distancia media de sus centros
+    al nodo más próximo de la otra), de preferencia una resuelta; la unión queda
+    pendiente (None) con los depósitos de ambas primero."""
+    n_depots = max(data[-1]) + 1
+    dist = np.asarray(distances)
+    merged, new_parts, new_results = set(), [], []
+    for k in [k for k, r in enumerate(results) if r is None]:
+        if k in merged:
+            continue
+        others = [j for j in range(len(parts)) if j != k and j not in merged]
+        if not others:
+            continue
+        stops = [i for i in parts[k][0] if i >= n_depots] or parts[k][0]
+        gap = lambda j: float(dist[np.ix_(stops, parts[j][0])].min(axis=1).mean())
+        j = min(others, key=lambda j: (results[j] is None, gap(j)))
+        nodes = parts[k][0] + parts[j][0]
+        depots = sorted({i for i in nodes if i < n_depots})
+        new_parts.append((depots + [i for i in nodes if i >= n_depots], sorted(parts[k][1] + parts[j][1])))
+        new_results.append(None)
+        merged |= {k, j}
+        ids = data[0]["id"]
+        log.warning("subproblema sin solución (%d centros, depósito %s): se vuelve a resolver junto al "
+                    "vecino (%d centros, depósito %s)", len(stops), ids.iloc[parts[k][0][0]],
+                    len(parts[j][0]) - 1, ids.iloc[parts[j][0][0]])
+    for k, (part, result) in enumerate(zip(parts, results)):
+        if k not in merged:
+            new_parts.append(part); new_results.append(result)
+    return new_parts, new_results
+
+def solve_parts(data: tuple, distances, durations, parts: list[tuple[list[int], list[int]]],
+                use_matrix: bool = True, time_limit: int = 20, workers: int | None = None):
+    """Resuelve cada (nodos, vehículos) como VRP independiente en procesos paralelos y
+    une las rutas con índices globales de nodo y vehículo. Una parte sin solución se
+    une con su vecina más cercana y se vuelve a resolver (las demás se conservan),
+    hasta que todas tengan plan; None sólo si falla la unión de todas.
+    Las matrices no viajan a los workers: cada uno mapea el archivo compartido y copia
+    sólo su submatriz."""
+    parts = [(list(nodes), list(vehicles)) for nodes, vehicles in parts]
+    results = [None] * len(parts)
+    with shared_files(distances, durations) as files, ProcessPoolExecutor(max_workers=workers) as ex:
+        while True:
+            pending = [k for k, r in enumerate(results) if r is None]
+            jobs = [(subset_data(data, *parts[k]), files, parts[k][0], use_matrix, time_limit) for k in pending]
+            for k, part_routes in zip(pending, ex.map(_solve_part, jobs)):
+                results[k] = part_routes
+            if all(r is not None for r in results):
+                break
+            if len(parts) == 1:
+                return None
+            parts, results = _merge_failed(data, distances, parts, results)
+
+    routes = []
+    for (nodes, vehicles), part_routes in zip(parts, results):
+        for r in part_routes:
+            routes.append({"vehicle": vehicles[r["vehicle"]], "order": [nodes[i] for i in r["order"]],
+                           "meters": r["meters"]})
+    return sorted(routes, key=lambda r: r["vehicle"])
+
+def solve_by_depot(data: tuple, distances, durations, use_matrix: bool = True, time_limit: int = 20,
+                   workers: int | None = None):
+    """Multi-depósito por descomposición: cada depósito con sus centros y vehículos."""
+    veh_depot = data[-1]
+    assigned = assign_to_depots(data, distances, durations)
+    n_depots = max(veh_depot) + 1
+    parts = []
+    for d in range(n_depots):
+        nodes = [d] + [i for i in range(n_depots, len(assigned)) if assigned[i] == d]
+        vehicles = [v for v, vd in enumerate(veh_depot) if vd == d]
+        parts.append((nodes, vehicles))
+    return solve_parts(data, distances, durations, parts, use_matrix, time_limit, workers)
+
+CLUSTER_METHODS = ("sweep", "kmeans")
+
+def _vehicle_groups(vehicles: list[int], veh_is_refrig, k: int) -> list[list[int]]:
+    """Reparte los vehículos en k grupos; los refrigerados primero y en rueda, para que
+    cada grupo tenga uno mientras alcancen."""
+    ordered = sorted(vehicles, key=lambda v: not veh_is_refrig[v])
+    groups = [[] for _ in range(max(1, min(k, len(vehicles))))]
+    for i, v in enumerate(ordered):
+        groups[i % len(groups)].append(v)
+    return groups
+
+def _capacitated_assign(data: tuple, ordered, groups, prefer):
+    """Asigna centros (en el orden dado) a grupos de vehículos respetando capacidad
+    total del grupo y cadena de frío. prefer(node, used_vol) devuelve los grupos candidatos
+    en orden de preferencia; se elige el primero compatible con cupo."""
+    points, dem_vol, dem_kg = data[0], data[1], data[2]
+    cap_vol, cap_kg, veh_is_refrig, cold_centers = data[6], data[7], data[8], data[9]
+    g_vol = np.array([sum(cap_vol[v] for v in g) for g in groups])
+    g_kg = np.array([sum(cap_kg[v] for v in g) for g in groups])
+    r_vol = np.array([sum(cap_vol[v] for v in g if veh_is_refrig[v]) for g in groups])
+    r_kg = np.array([sum(cap_kg[v] for v in g if veh_is_refrig[v]) for g in groups])
+    nodes = [int(i) for i in ordered]
+    # cupo balanceado: utilización media del conjunto (+10%), como en assign_to_depots
+    b_vol = g_vol * _fill_ratio([dem_vol[i] for i in nodes], g_vol)
+    b_kg = g_kg * _fill_ratio([dem_kg[i] for i in nodes], g_kg)
+    used_vol = np.zeros(len(groups)); used_kg = np.zeros(len(groups))
+    cold_vol = np.zeros(len(groups)); cold_kg = np.zeros(len(groups))  # carga de frío asignada
+    clusters = [[] for _ in groups]
+    for node in nodes:
+        cold = points.iloc[node]["id"] in cold_centers
+        candidates = prefer(node, used_vol)
+        compatible = [g for g in candidates if r_vol[g] > 0 or not cold] or candidates
+        cold_ok = [g for g in compatible
+                   if not cold or (cold_vol[g] + dem_vol[node] <= r_vol[g] and cold_kg[g] + dem_kg[node] <= r_kg[g])]
+        balanced = [g for g in cold_ok
+                    if used_vol[g] + dem_vol[node] <= b_vol[g] and used_kg[g] + dem_kg[node] <= b_kg[g]]
+        fits = [g for g in cold_ok
+                if used_vol[g] + dem_vol[node] <= g_vol[g] and used_kg[g] + dem_kg[node] <= g_kg[g]]
+        # sin cupo en ninguno: el compatible con más capacidad libre (el solver decidirá)
+        g = (balanced or fits or [max(compatible, key=lambda g: g_vol[g] - used_vol[g])])[0]
+        clusters[g].append(int(node))
+        used_vol[g] += dem_vol[node]; used_kg[g] += dem_kg[node]
+        if cold:
+            cold_vol[g] += dem_vol[node]; cold_kg[g] += dem_kg[node]
+    return clusters
+
+def sweep_clusters(data: tuple, depot: int, centers: list[int], groups: list[list[int]]) -> list[list[int]]:
+    """Barrido angular alrededor del depósito: se llena cada grupo hasta su cuota
+    (proporcional a su capacidad) y se pasa al siguiente sector."""
+    points, dem_vol, cap_vol = data[0], data[1], data[6]
+    if not centers:
+        return [[] for _ in groups]
+    lat, lon = points["lat"].to_numpy(dtype=float), points["lon"].to_numpy(dtype=float)
+    c = np.asarray(centers)
+    ang = np.arctan2(lat[c] - lat[depot], (lon[c] - lon[depot]) * math.cos(math.radians(lat[depot])))
+    order = np.argsort(ang, kind="stable")
+    # empezar tras el mayor hueco angular para no partir un grupo compacto
+    sa = ang[order]
+    gaps = np.diff(np.r_[sa, sa[0] + 2 * np.pi])
+    order = np.roll(order, -((int(np.argmax(gaps)) + 1) % len(sa)))
+
+    g_vol = np.array([sum(cap_vol[v] for v in g) for g in groups])
+    quota = g_vol / g_vol.sum() * sum(dem_vol[i] for i in centers) if g_vol.sum() > 0 else g_vol
+    state = {"cur": 0}
+
+    def prefer(node, used):
+        cur = state["cur"]
+        if used[cur] > 0 and used[cur] + dem_vol[node] > quota[cur] and cur < len(groups) - 1:
+            state["cur"] = cur = cur + 1  # cuota cumplida: siguiente sector
+        return list(range(cur, len(groups))) + list(range(cur - 1, -1, -1))
+
+    ordered = c[order]
+    if len(groups) == 1:
+        return [[int(i) for i in ordered]]
+    return _capacitated_assign(data, ordered, groups, prefer)
+
+def kmeans_clusters(data: tuple, depot: int, centers: list[int], groups: list[list[int]],
+                    iters: int = 20) -> list[list[int]]:
+    """Agrupamiento geográfico: k-means (iniciado con el barrido, así el centroide k
+    queda ligado al grupo de vehículos k) y asignación con capacidad por arrepentimiento."""
+    points = data[0]
+    init = sweep_clusters(data, depot, centers, groups)
+    if len(groups) == 1 or not centers:
+        return init
+    lat, lon = points["lat"].to_numpy(dtype=float), points["lon"].to_numpy(dtype=float)
+    xy = np.c_[lon * math.cos(math.radians(lat[depot])), lat]
+    c = np.asarray(centers)
+    cent = np.array([xy[cl].mean(axis=0) if cl else xy[depot] for cl in init])
+    for _ in range(iters):
+        label = ((xy[c, None, :] - cent[None]) ** 2).sum(axis=2).argmin(axis=1)
+        new = np.array([xy[c[label == k]].mean(axis=0) if (label == k).any() else cent[k]
+                        for k in range(len(cent))])
+        if np.allclose(new, cent):
+            break
+        cent = new
+    d2 = ((xy[c, None, :] - cent[None]) ** 2).sum(axis=2)
+    rank = np.argsort(d2, axis=1)
+    # primero los centros con mayor diferencia entre su mejor y segundo mejor grupo
+    srt = np.sort(d2, axis=1)
+    regret = srt[:, 1] - srt[:, 0]
+    pos = {int(node): i for i, node in enumerate(c)}
+    ordered = c[np.argsort(-regret, kind="stable")]
+    return _capacitated_assign(data, ordered, groups, lambda node, used: [int(g) for g in rank[pos[int(node)]]])
+
+def solve_by_clusters(data: tuple, distances, durations, use_matrix: bool = True, time_limit: int = 20,
+                      workers: int | None = None, cluster_size: int = 100, method: str = "sweep",
+                      improve_time: int = 0):
+    """Cluster-first, route-second: por depósito, ~cluster_size centros por grupo de
+    vehículos, cada grupo resuelto en paralelo; con improve_time > 0, una pasada corta
+    sobre el modelo completo partiendo del plan unido (corrige las fronteras). Un grupo
+    sin solución se resuelve de nuevo junto al grupo vecino (ver solve_parts)."""
+    if method not in CLUSTER_METHODS:
+        raise ValueError(f"método de agrupamiento desconocido: {method!r} (use {CLUSTER_METHODS})")
+    veh_depot, veh_is_refrig = data[-1], data[8]
+    assigned = assign_to_depots(data, distances, durations)
+    n_depots = max(veh_depot) + 1
+    cluster = sweep_clusters if method == "sweep" else kmeans_clusters
+    parts = []
+    for d in range(n_depots):
+        centers = [i for i in range(n_depots, len(assigned)) if assigned[i] == d]
+        vehicles = [v for v, vd in enumerate(veh_depot) if vd == d]
+        groups = _vehicle_groups(vehicles, veh_is_refrig, math.ceil(len(centers) / cluster_size))
+        for g, cl in zip(groups, cluster(data, d, centers, groups)):
+            parts.append(([d] + cl, g))
+
+    routes = solve_parts(data, distances, durations, parts, use_matrix, time_limit, workers)
+    if routes is not None and improve_time > 0:
+        orders = [r["order"][1:-1] for r in routes]
+        improved, _ = solve_from_routes(data, distances, durations, orders, use_matrix, improve_time)
+        routes = improved or routes
+    return routes
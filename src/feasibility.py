@@ -0,0 +1,123 @@
+# src/feasibility.py
+from __future__ import annotations
+import logging
+import numpy as np
+from src.solve_vrp_osrm_apu import capacity_ints, HORIZON_SEC
+
+log = logging.getLogger(__name__)
+
+def _fmt_hm(sec) -> str:
+    sec = int(sec)
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}"
+
+def _issue(severity: str, check: str, message: str, node: int | None = None, center_id=None) -> dict:
+    return {"severity": severity, "check": check, "node": node, "id": center_id, "message": message}
+
+def _fits(data: tuple) -> np.ndarray:
+    """fits[i, v]: el vehículo v puede llevar solo la demanda del nodo i (volumen, peso
+    y cadena de frío), con los mismos enteros x10 que el modelo."""
+    points, dem_vol, dem_kg, _, _, _, cap_vol, cap_kg, veh_is_refrig, cold_centers, *_ = data
+    dem_vol, cap_vol = (np.array(x) for x in capacity_ints(dem_vol, cap_vol))
+    dem_kg, cap_kg = (np.array(x) for x in capacity_ints(dem_kg, cap_kg))
+    cold = points["id"].isin(cold_centers).to_numpy()
+    refrig = np.asarray(veh_is_refrig, dtype=bool)
+    return ((dem_vol[:, None] <= cap_vol[None, :]) & (dem_kg[:, None] <= cap_kg[None, :])
+            & (~cold[:, None] | refrig[None, :]))
+
+def check_capacity(data: tuple) -> list[dict]:
+    """Chequeos que no necesitan matriz: demanda por centro vs. vehículos compatibles,
+    cadena de frío sin refrigerados y demanda total (fría y global) vs. la flota."""
+    points, dem_vol, dem_kg, _, _, _, cap_vol, cap_kg, veh_is_refrig, cold_centers, *_, veh_depot = data
+    n_depots = max(veh_depot) + 1
+    ids = points["id"].astype(str).to_numpy()
+    cold = points["id"].isin(cold_centers).to_numpy()
+    cold[:n_depots] = False
+    refrig = np.asarray(veh_is_refrig, dtype=bool)
+    dem_vol, dem_kg = np.asarray(dem_vol), np.asarray(dem_kg)
+    cap_vol, cap_kg = np.asarray(cap_vol), np.asarray(cap_kg)
+    issues = []
+
+    if cold.any() and not refrig.any():
+        issues.append(_issue("error", "cold_chain",
+                             f"{int(cold.sum())} centros con cadena de frío ({', '.join(ids[cold][:10])}) "
+                             "y ningún vehículo refrigerado: agregar un refrigerado a vehiculos.csv."))
+    else:
+        fits = _fits(data)
+        for i in np.flatnonzero(~fits.any(axis=1)[n_depots:]) + n_depots:
+            compat = refrig if cold[i] else np.ones(len(refrig), dtype=bool)
+            issues.append(_issue(
+                "error", "capacity",
+                f"{ids[i]}: {dem_vol[i]:.1f} l / {dem_kg[i]:.1f} kg no caben en ningún vehículo "
+                f"{'refrigerado ' if cold[i] else ''}(máx. {cap_vol[compat].max():.1f} l / "
+                f"{cap_kg[compat].max():.1f} kg): dividir el pedido o usar un vehículo mayor.", int(i), ids[i]))
+
+    for label, dem, cap in (("volumen", dem_vol, cap_vol), ("peso", dem_kg, cap_kg)):
+        unit = "l" if label == "volumen" else "kg"
+        if refrig.any() and dem[cold].sum() > cap[refrig].sum():
+            issues.append(_issue("error", "cold_capacity",
+                                 f"Demanda fría {dem[cold].sum():.1f} {unit} > capacidad refrigerada "
+                                 f"{cap[refrig].sum():.1f} {unit} ({label}): faltan refrigerados."))
+        if dem[n_depots:].sum() > cap.sum():
+            issues.append(_issue("error", "fleet_capacity",
+                                 f"Demanda total {dem[n_depots:].sum():.1f} {unit} > capacidad de la flota "
+                                 f"{cap.sum():.1f} {unit} ({label})."))
+    return issues
+
+def round_trips(durations, service_sec, n_depots: int) -> np.ndarray:
+    """s de ida directa, servicio y vuelta de cada nodo desde cada depósito (depósitos x nodos)."""
+    dur = np.asarray(durations, dtype=float)
+    depots = np.arange(n_depots)
+    return dur[depots, :] + np.asarray(service_sec, dtype=float)[None, :] + dur[:, depots].T
+
+def check_time(data: tuple, durations) -> list[dict]:
+    """Chequeos con la matriz de duraciones, usando el mejor depósito con un vehículo
+    compatible: ida y vuelta directa más larga que el horizonte del modelo (error) y
+    ventanas que cierran antes de la llegada directa desde el turno (aviso: las
+    ventanas son blandas, el plan existe pero con penalización)."""
+    points, _, _, service_sec, tw_start, tw_end, *_, fleet_start, _, veh_depot = data
+    n_depots = max(veh_depot) + 1
+    ids = points["id"].astype(str).to_numpy()
+    dur = np.asarray(durations, dtype=float)
+    depots = np.arange(n_depots)
+
+    # depósitos con algún vehículo que pueda atender cada nodo
+    fits = _fits(data)
+    depot_of = np.asarray(veh_depot)
+    usable = np.stack([fits[:, depot_of == d].any(axis=1) for d in depots], axis=1)  # (n, depósitos)
+    usable[~usable.any(axis=1)] = True  # sin vehículo compatible: ya informado por check_capacity
+
+    round_trip = np.where(usable.T, round_trips(dur, service_sec, n_depots), np.inf).min(axis=0)
+    depart = np.maximum(fleet_start, np.asarray(tw_start)[depots])
+    arrival = np.where(usable.T, depart[:, None] + dur[depots, :], np.inf).min(axis=0)
+
+    issues = []
+    for i in np.flatnonzero(round_trip[n_depots:] > HORIZON_SEC) + n_depots:
+        issues.append(_issue("error", "horizon",
+                             f"{ids[i]}: ida y vuelta directa de {round_trip[i] / 3600:.1f} h supera el "
+                             f"horizonte de {HORIZON_SEC // 3600} h por ruta.", int(i), ids[i]))
+    late = np.flatnonzero(arrival[n_depots:] > np.asarray(tw_end)[n_depots:]) + n_depots
+    for i in late:
+        issues.append(_issue("warning", "time_window",
+                             f"{ids[i]}: ventana hasta {_fmt_hm(tw_end[i])} pero la llegada directa más "
+                             f"temprana es {_fmt_hm(arrival[i])}: ampliar la ventana o adelantar el turno.",
+                             int(i), ids[i]))
+    return issues
+
+def check_feasibility(data: tuple, durations=None) -> list[dict]:
+    """Diagnóstico previo a la búsqueda (sin matriz sólo los chequeos de capacidad).
+    Cada problema: {severity: 'error'|'warning', check, node, id, message}; con algún
+    'error' el modelo no tiene solución."""
+    issues = check_capacity(data)
+    if durations is not None:
+        issues += check_time(data, durations)
+    return issues
+
+def log_issues(issues: list[dict], limit: int = 20) -> bool:
+    """Registra los problemas (errores primero, hasta limit por severidad); True si hay errores."""
+    for severity, level in (("error", logging.ERROR), ("warning", logging.WARNING)):
+        found = [x for x in issues if x["severity"] == severity]
+        for x in found[:limit]:
+            log.log(level, "%s: %s", x["check"], x["message"])
+        if len(found) > limit:
+            log.log(level, "... y %d más del mismo tipo", len(found) - limit)
+    return any(x["severity"] == "error" for x in issues)
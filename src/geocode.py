@@ -0,0 +1,159 @@
+# src/geocode.py
+from __future__ import annotations
+import json, logging, os, re, threading, unicodedata
+from concurrent.futures import Future
+from queue import Queue
+import pandas as pd, requests
+from src.metrics import metrics
+from src.osrm_client import TokenBucket
+
+log = logging.getLogger(__name__)
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT = "streamlit-route-optimizer/1.0"
+# Política de uso de Nominatim: como mucho 1 petición/s, User-Agent propio y caché local.
+NOMINATIM_RATE = 1.0
+DEFAULT_CACHE = "cache/geocode.jsonl"
+# Siempre se piden (y guardan) hasta SEARCH_LIMIT resultados: la clave no depende del límite.
+SEARCH_LIMIT = 7
+
+def normalize_query(query: str, country_code: str = "") -> str:
+    """Clave de caché: minúsculas, sin tildes, sin puntuación y espacios simples, más
+    el país ("Av. Principal,  Abancay" y "av principal abancay" comparten clave)."""
+    text = unicodedata.normalize("NFKD", str(query)).encode("ascii", "ignore").decode().lower()
+    text = " ".join(re.sub(r"[^\w]+", " ", text).split())
+    return f"{country_code.lower()}|{text}"
+
+class Geocoder:
+    """Búsquedas en Nominatim con caché persistente (JSON lines, una línea por clave,
+    se agrega al final: sobrevive a cortes y permite reanudar lotes) y una cola servida
+    por un solo hilo que respeta NOMINATIM_RATE. Los aciertos de caché no esperan la
+    cola; las búsquedas sin resultado también se guardan, los errores de red no."""
+
+    def __init__(self, cache_path: str | None = DEFAULT_CACHE, url: str = NOMINATIM_URL,
+                 rate: float = NOMINATIM_RATE, user_agent: str = USER_AGENT, timeout: float = 25):
+        self.cache_path, self.url, self.timeout = cache_path, url, timeout
+        self.cache: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, 1)
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = user_agent
+        self._queue: Queue = Queue()
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # última línea cortada por una interrupción
+                    self.cache[entry["key"]] = entry["results"]
+        threading.Thread(target=self._worker, daemon=True, name="nominatim").start()
+
+    def _worker(self):
+        while True:
+            query, country_code, future = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._fetch(query, country_code))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def _fetch(self, query: str, country_code: str) -> list[dict]:
+        key = normalize_query(query, country_code)
+        if key in self.cache:  # otra petición igual ya pasó por la cola
+            return self.cache[key]
+        waited = self._bucket.acquire()
+        if waited:
+            metrics.observe("geocode_throttle_seconds", waited)
+        params = {"q": query, "format": "json", "addressdetails": 1, "limit": SEARCH_LIMIT}
+        if country_code:
+            params["countrycodes"] = country_code
+        metrics.inc("geocode_requests_total")
+        r = self._session.get(self.url, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        results = [{"display_name": d.get("display_name", ""), "lat": float(d["lat"]), "lon": float(d["lon"]),
+                    "address": d.get("address", {})} for d in r.json()]
+        self._store(key, results)
+        return results
+
+    def _store(self, key: str, results: list[dict]):
+        with self._lock:
+            self.cache[key] = results
+            if self.cache_path:
+                os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+                with open(self.cache_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "results": results}, ensure_ascii=False) + "\n")
+
+    def submit(self, query: str, country_code: str = "") -> Future:
+        """Búsqueda asíncrona: Future ya resuelto si está en caché, si no encolado."""
+        key = normalize_query(query, country_code)
+        future = Future()
+        if key in self.cache:
+            metrics.inc("geocode_cache_total", result="hit")
+            future.set_result(self.cache[key])
+        else:
+            metrics.inc("geocode_cache_total", result="miss")
+            self._queue.put((query, country_code, future))
+        return future
+
+    def search(self, query: str, country_code: str = "", limit: int = SEARCH_LIMIT) -> list[dict]:
+        """[{display_name, lat, lon, address}] como la búsqueda de app.py."""
+        return self.submit(query, country_code).result()[:limit]
+
+    def geocode(self, address: str, country_code: str = "pe") -> tuple[dict | None, str]:
+        """(mejor resultado, estado) para una dirección: 'ok' con la dirección completa,
+        'approx' si hubo que quitar el primer tramo ("Av. Principal, Abancay, ..." ->
+        "Abancay, ...") y 'not_found' si ninguno respondió. Sin dirección (vacía o NaN de
+        una celda en blanco del CSV) devuelve 'no_address' sin hacer peticiones."""
+        if address is None or pd.isna(address):
+            return None, "no_address"
+        parts = [p.strip() for p in str(address).split(",") if p.strip()]
+        if not parts:
+            return None, "no_address"
+        for i in range(max(1, len(parts) - 1)):
+            results = self.search(", ".join(parts[i:]), country_code, limit=1)
+            if results:
+                return results[0], ("ok" if i == 0 else "approx")
+        return None, "not_found"
+
+def geocode_file(in_csv: str, out_csv: str, geocoder: Geocoder, address_col: str = "address",
+                 country_code: str = "pe", overwrite: bool = False, save_every: int = 50) -> pd.DataFrame:
+    """Completa lat/lon de un CSV de centros desde su columna de dirección.
+    Sólo las filas sin coordenadas (todas con overwrite); agrega geocode_status y
+    geocode_name (las filas sin dirección quedan como 'no_address', sin petición). Se guarda cada save_every filas: si el lote se corta, volver a
+    correrlo retoma desde el caché sin repetir peticiones."""
+    df = pd.read_csv(out_csv if os.path.exists(out_csv) and not overwrite else in_csv)
+    for col in ("lat", "lon", "geocode_status", "geocode_name"):
+        if col not in df.columns:
+            df[col] = None
+    todo = df.index if overwrite else df.index[df["lat"].isna() | df["lon"].isna()]
+    log.info("geocodificando %d de %d filas", len(todo), len(df))
+    for done, i in enumerate(todo, 1):
+        try:
+            best, status = geocoder.geocode(df.at[i, address_col], country_code)
+        except requests.RequestException as e:
+            log.warning("%s: %s (se reintentará en la próxima corrida)", df.at[i, address_col], type(e).__name__)
+            continue
+        df.at[i, "geocode_status"] = status
+        if best is not None:
+            df.at[i, "lat"], df.at[i, "lon"], df.at[i, "geocode_name"] = best["lat"], best["lon"], best["display_name"]
+        if done % save_every == 0:
+            df.to_csv(out_csv, index=False)
+            log.info("%d/%d", done, len(todo))
+    df.to_csv(out_csv, index=False)
+    return df
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Geocodifica en lote la columna address de un CSV de centros (Nominatim, 1 req/s, con caché)")
+    ap.add_argument("centros", help="CSV con id, name, address (lat/lon vacíos se completan)")
+    ap.add_argument("--out", default=None, help="CSV de salida (por defecto, el mismo archivo)")
+    ap.add_argument("--address-col", default="address")
+    ap.add_argument("--country", default="pe", help="código de país para acotar la búsqueda ('' = todos)")
+    ap.add_argument("--all", action="store_true", help="regeocodificar también las filas con coordenadas")
+    ap.add_argument("--cache", default=DEFAULT_CACHE)
+    args = ap.parse_args()
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    out = geocode_file(args.centros, args.out or args.centros, Geocoder(args.cache), args.address_col,
+                       args.country, args.all)
+    print(out["geocode_status"].value_counts(dropna=False).to_string())
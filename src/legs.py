@@ -0,0 +1,54 @@
+# src/legs.py
+from __future__ import annotations
+import pandas as pd, polyline
+from concurrent.futures import ThreadPoolExecutor
+from src.osrm import osrm_route_legs
+from src.matrix import offline_table
+
+def fetch_legs(osrm_url: str, routes: list[dict], points: pd.DataFrame, max_workers: int = 8,
+               client=None) -> dict[int, list[dict]]:
+    """Distancia, duración y geometría reales por tramo: una petición /route por
+    vehículo (no una por tramo), con los vehículos en paralelo."""
+
+    def vehicle_legs(r):
+        order = r["order"]
+        rows = points.iloc[order]
+        fetched = osrm_route_legs(osrm_url, list(zip(rows["lon"], rows["lat"])), client=client)
+        legs = []
+        for (a, b), leg in zip(zip(order[:-1], order[1:]), fetched or []):
+            a_row = points.iloc[a]; b_row = points.iloc[b]
+            legs.append({
+                "from": a, "to": b,
+                "from_id": a_row["id"], "to_id": b_row["id"],
+                "from_name": a_row["name"], "to_name": b_row["name"],
+                "meters": leg["distance"], "seconds": leg["duration"],
+                "geometry": leg["geometry"]
+            })
+        return r["vehicle"], legs
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+        return dict(ex.map(vehicle_legs, routes))
+
+def matrix_legs(routes: list[dict], points: pd.DataFrame, distances, durations,
+                geometry: bool = False) -> dict[int, list[dict]]:
+    """Tramos desde las matrices con las que se resolvió (sin red). Con geometry, el
+    segmento recto entre puntos; si no, geometry = None (el mapa la pide a OSRM)."""
+    legs_by_vehicle = {}
+    for r in routes:
+        legs = []
+        for a, b in zip(r["order"][:-1], r["order"][1:]):
+            a_row = points.iloc[a]; b_row = points.iloc[b]
+            legs.append({
+                "from": a, "to": b,
+                "from_id": a_row["id"], "to_id": b_row["id"],
+                "from_name": a_row["name"], "to_name": b_row["name"],
+                "meters": round(float(distances[a, b]), 1), "seconds": round(float(durations[a, b]), 1),
+                "geometry": polyline.encode([(a_row["lat"], a_row["lon"]), (b_row["lat"], b_row["lon"])]) if geometry else None
+            })
+        legs_by_vehicle[r["vehicle"]] = legs
+    return legs_by_vehicle
+
+def estimate_legs(routes: list[dict], points: pd.DataFrame, profiles: dict | None = None) -> dict[int, list[dict]]:
+    """Tramos sin red (matriz offline); la geometría es el segmento recto entre puntos."""
+    distances, durations = offline_table(points, profiles)
+    return matrix_legs(routes, points, distances, durations, geometry=True)
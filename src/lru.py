@@ -0,0 +1,29 @@
+# src/lru.py
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+
+class LRU:
+    """Mapeo acotado: al superar maxsize se descarta lo usado hace más tiempo. Seguro entre hilos."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,159 @@
+# src/matrix.py
+from __future__ import annotations
+import hashlib, json, logging, os
+import numpy as np, pandas as pd, requests
+from src.osrm import osrm_table_tiled
+from src.matrix_cache import cached_table, _coord_keys
+from src.matrix_store import store_lookup, store_source, save_store
+
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371008.8
+
+# Factor de sinuosidad (vía / línea recta) y velocidad media por región.
+# Valores conservadores para la sierra de Apurímac; ajustar con --offline-profiles.
+DEFAULT_PROFILES = {
+    "default":     {"sinuosity": 1.45, "speed_kmh": 35.0},
+    "Abancay":     {"sinuosity": 1.40, "speed_kmh": 38.0},
+    "Andahuaylas": {"sinuosity": 1.45, "speed_kmh": 35.0},
+    "Chincheros":  {"sinuosity": 1.55, "speed_kmh": 30.0},
+}
+
+MATRIX_BACKENDS = ("osrm", "offline", "auto")
+
+def load_profiles(path: str | None) -> dict:
+    if not path:
+        return DEFAULT_PROFILES
+    with open(path, encoding="utf-8") as f:
+        return {**DEFAULT_PROFILES, **json.load(f)}
+
+def node_regions(points: pd.DataFrame, profiles: dict) -> pd.Series:
+    """Región de cada nodo: columna 'region' si existe; si no, el primer nombre de
+    región de los perfiles que aparezca en 'address'; 'default' en otro caso."""
+    if "region" in points.columns:
+        return points["region"].fillna("default").astype(str).reset_index(drop=True)
+    region = pd.Series("default", index=range(len(points)))
+    if "address" in points.columns:
+        address = points["address"].fillna("").astype(str).str.lower().reset_index(drop=True)
+        for name in reversed([k for k in profiles if k != "default"]):
+            region[address.str.contains(name.lower(), regex=False)] = name
+    return region
+
+def offline_table(points: pd.DataFrame, profiles: dict | None = None, block: int = 8):
+    """Matriz sin red: distancia ortodrómica (haversine) x sinuosidad y duración a la
+    velocidad de la región; el factor de cada par es la media de sus dos extremos.
+
+    Se calcula por bloques de filas con broadcasting en float32 para que los temporales
+    quepan en caché (10k nodos < 1 s, 2 x 400 MB).
+    """
+    profiles = profiles or DEFAULT_PROFILES
+    regions = node_regions(points, profiles)
+    default = profiles.get("default", DEFAULT_PROFILES["default"])
+    sinu = np.array([profiles.get(r, default)["sinuosity"] for r in regions], dtype=np.float32)
+    speed = np.array([profiles.get(r, default)["speed_kmh"] / 3.6 for r in regions], dtype=np.float32)
+
+    lat = np.radians(points["lat"].to_numpy(dtype=float)) / 2
+    lon = np.radians(points["lon"].to_numpy(dtype=float)) / 2
+    # sin(Δ/2) = sin(a/2)cos(b/2) - cos(a/2)sin(b/2): evita la pérdida de precisión de 1-cos
+    sl, cl = np.sin(lat).astype(np.float32), np.cos(lat).astype(np.float32)
+    so, co = np.sin(lon).astype(np.float32), np.cos(lon).astype(np.float32)
+    cos_lat = np.cos(2 * lat).astype(np.float32)
+
+    n = len(points)
+    distances = np.empty((n, n), dtype=np.float32)
+    durations = np.empty((n, n), dtype=np.float32)
+    uniform = bool((sinu == sinu[0]).all() and (speed == speed[0]).all()) if n else True
+    t_buf = np.empty((block, n), dtype=np.float32)
+    f_buf = np.empty((block, n), dtype=np.float32)
+    for i in range(0, n, block):
+        rows = slice(i, i + block)
+        h = distances[rows]; t = t_buf[:len(h)]; f = f_buf[:len(h)]
+        # haversine: sin²(Δlat/2) + cos(lat_i) cos(lat_j) sin²(Δlon/2)
+        np.multiply(sl[rows, None], cl, out=h); np.multiply(cl[rows, None], sl, out=t); h -= t; h *= h
+        np.multiply(so[rows, None], co, out=t); np.multiply(co[rows, None], so, out=f); t -= f; t *= t
+        np.multiply(cos_lat[rows, None], cos_lat, out=f); t *= f
+        h += t
+        np.sqrt(h, out=h); np.minimum(h, 1, out=h); np.arcsin(h, out=h)
+        if uniform:
+            h *= 2 * EARTH_RADIUS_M * sinu[0]
+            np.divide(h, speed[0], out=durations[rows])
+        else:
+            np.add(sinu[rows, None], sinu, out=f); f *= EARTH_RADIUS_M  # 2R x media
+            h *= f
+            np.add(speed[rows, None], speed, out=f); f *= 0.5
+            np.divide(h, f, out=durations[rows])
+    return distances, durations
+
+def matrix_source(backend: str, profiles: dict | None = None) -> dict:
+    """Origen de una matriz (meta.json de src.matrix_store): {'backend': 'osrm'} para
+    'osrm' y 'auto', o 'offline' con el digest de los perfiles con que se estimó."""
+    if backend != "offline":
+        return {"backend": "osrm"}
+    text = json.dumps(profiles or DEFAULT_PROFILES, sort_keys=True)
+    return {"backend": "offline", "profiles": hashlib.sha256(text.encode()).hexdigest()[:16]}
+
+def get_matrix(points: pd.DataFrame, osrm_url: str, backend: str = "osrm", cache_dir: str | None = None,
+               tile_size: int = 50, max_workers: int = 4, profiles: dict | None = None,
+               store: str | None = None, memo=None, report: dict | None = None):
+    """Distancias (m) y duraciones (s) según el backend:
+    'osrm' (falla si no hay red), 'offline' (estimación local) o 'auto' (OSRM y, si no
+    responde, estimación local).
+    store: directorio de src.matrix_store; si es del mismo origen (matrix_source) y
+    contiene todos los puntos se usa sin tocar el backend (memmap, sin copia). Si no
+    existe se crea con la matriz calculada, y uno offline o sin origen se reemplaza
+    por la matriz de OSRM. La estimación de un 'auto' sin red nunca se guarda.
+    memo: mapeo del llamador (p. ej. el LRU de src.service) con las matrices ya
+    calculadas por backend, URL de OSRM, origen (matrix_source) y coordenadas, para no
+    repetirlas en el mismo proceso (tampoco guarda las de un 'auto' sin red).
+    report: dict del llamador; recibe 'backend' = el que respondió ('osrm' u 'offline')."""
+    if backend not in MATRIX_BACKENDS:
+        raise ValueError(f"backend de matriz desconocido: {backend!r} (use {MATRIX_BACKENDS})")
+    wanted = matrix_source(backend, profiles)
+    report = {} if report is None else report
+    if memo is not None:
+        # la URL (sin efecto en offline) y el origen con sus perfiles distinguen configuraciones
+        key = (backend, None if backend == "offline" else osrm_url, tuple(sorted(wanted.items())),
+               tuple(_coord_keys(points, 5)))
+        found = memo.get(key)
+        if found is None:
+            found = get_matrix(points, osrm_url, backend, cache_dir, tile_size, max_workers,
+                               profiles, store, report=report)
+            if report["backend"] == wanted["backend"]:
+                memo[key] = found
+        else:
+            report["backend"] = wanted["backend"]
+        return found
+    current = None
+    if store and os.path.exists(os.path.join(store, "index.csv")):
+        current = store_source(store) or {"backend": None}
+        if current == wanted:
+            found = store_lookup(store, points)
+            if found is not None:
+                report["backend"] = wanted["backend"]
+                return found
+            log.warning("el almacén %s no cubre todos los puntos; se calcula la matriz", store)
+        else:
+            log.warning("el almacén %s es de otro origen (%s, se pidió %s); se calcula la matriz",
+                        store, current.get("backend") or "desconocido", backend)
+    distances, durations, report["backend"] = _backend_matrix(points, osrm_url, backend, cache_dir, tile_size,
+                                                              max_workers, profiles)
+    fallback = report["backend"] != wanted["backend"]
+    replace = current is None or (current.get("backend") != "osrm" and wanted["backend"] == "osrm")
+    if store and replace and not fallback and durations is not None:
+        save_store(store, points, distances, durations, source=wanted)
+        return store_lookup(store, points)  # memmap: los workers lo abren sin copiar
+    return distances, durations
+
+def _backend_matrix(points, osrm_url, backend, cache_dir, tile_size, max_workers, profiles):
+    """(distancias, duraciones, backend que respondió)."""
+    if backend == "offline":
+        return (*offline_table(points, profiles), "offline")
+    try:
+        if cache_dir:
+            return (*cached_table(osrm_url, points, cache_dir, tile_size=tile_size, max_workers=max_workers), "osrm")
+        return (*osrm_table_tiled(osrm_url, points, tile_size=tile_size, max_workers=max_workers), "osrm")
+    except requests.RequestException as e:
+        if backend == "osrm":
+            raise
+        log.warning("OSRM no disponible (%s); usando matriz offline.", type(e).__name__)
+        return (*offline_table(points, profiles), "offline")
@@ -0,0 +1,79 @@
+# src/matrix_cache.py
+from __future__ import annotations
+import os, threading
+import numpy as np, pandas as pd
+from src.osrm import osrm_table_tiled
+
+def _coord_keys(points: pd.DataFrame, decimals: int) -> list[str]:
+    """Clave por nodo: 'lon,lat' redondeado (5 decimales ~ 1 m)."""
+    return [f"{round(float(lon), decimals):.{decimals}f},{round(float(lat), decimals):.{decimals}f}"
+            for lon, lat in zip(points["lon"], points["lat"])]
+
+def _cache_path(cache_dir: str, profile: str) -> str:
+    return os.path.join(cache_dir, f"osrm_{profile}.npz")
+
+def load_cache(path: str):
+    """Devuelve (claves, distancias, duraciones); celdas nunca consultadas = NaN y
+    pares sin ruta (null de OSRM) = inf, que cuentan como ya consultados."""
+    if not os.path.exists(path):
+        return [], np.empty((0, 0)), np.empty((0, 0))
+    with np.load(path, allow_pickle=False) as z:
+        return z["keys"].tolist(), z["distances"], z["durations"]
+
+def save_cache(path: str, keys: list[str], distances: np.ndarray, durations: np.ndarray):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"  # único por hilo (servicio)
+    np.savez(tmp, keys=np.array(keys, dtype=str), distances=distances, durations=durations)
+    os.replace(tmp, path)  # escritura atómica: un corte no deja el caché a medias
+
+def cached_table(osrm_url: str, points: pd.DataFrame, cache_dir: str = "cache",
+                 profile: str = "driving", decimals: int = 5, tile_size: int = 50,
+                 max_workers: int = 4):
+    """Como osrm_table_tiled, pero reutiliza las celdas ya consultadas y sólo pide a OSRM
+    las filas/columnas que faltan (parámetros sources/destinations). Los pares sin ruta
+    quedan en el caché como inf (no se vuelven a pedir) y se devuelven como NaN, igual
+    que osrm_table_tiled."""
+    unreachable = lambda x: np.where(np.isnan(x), np.inf, x)
+    path = _cache_path(cache_dir, profile)
+    keys = _coord_keys(points, decimals)
+    ckeys, cdist, cdur = load_cache(path)
+
+    # Agregar al caché los puntos nuevos (filas/columnas en NaN)
+    pos = {k: i for i, k in enumerate(ckeys)}
+    new_keys = [k for k in dict.fromkeys(keys) if k not in pos]
+    if new_keys:
+        m, total = len(ckeys), len(ckeys) + len(new_keys)
+        grown_d = np.full((total, total), np.nan); grown_d[:m, :m] = cdist
+        grown_t = np.full((total, total), np.nan); grown_t[:m, :m] = cdur
+        cdist, cdur = grown_d, grown_t
+        for k in new_keys:
+            pos[k] = len(ckeys); ckeys.append(k)
+
+    idx = np.array([pos[k] for k in keys], dtype=int)
+    sub = np.ix_(idx, idx)
+    missing = np.isnan(cdist[sub])
+    if missing.any():
+        # Puntos nuevos: se pide su columna completa (todos -> nuevos)...
+        cols = np.flatnonzero(np.isin(keys, new_keys))
+        # ...y sólo las filas que aún tengan huecos fuera de esas columnas
+        rest = missing.copy(); rest[:, cols] = False
+        rows = np.flatnonzero(rest.any(axis=1))
+        if len(cols):
+            d, t = osrm_table_tiled(osrm_url, points, destinations=cols, profile=profile,
+                                    tile_size=tile_size, max_workers=max_workers)
+            cdist[np.ix_(idx, idx[cols])] = unreachable(d)
+            if t is not None:
+                cdur[np.ix_(idx, idx[cols])] = unreachable(t)
+        if len(rows):
+            d, t = osrm_table_tiled(osrm_url, points, sources=rows, profile=profile,
+                                    tile_size=tile_size, max_workers=max_workers)
+            cdist[np.ix_(idx[rows], idx)] = unreachable(d)
+            if t is not None:
+                cdur[np.ix_(idx[rows], idx)] = unreachable(t)
+        save_cache(path, ckeys, cdist, cdur)
+
+    distances, durations = cdist[sub], cdur[sub]
+    # Sin duraciones completas, solve_vrp aplica su estimación a 30 km/h
+    no_durations = np.isnan(durations).any()
+    distances = np.where(np.isinf(distances), np.nan, distances)
+    return distances, (None if no_durations else np.where(np.isinf(durations), np.nan, durations))
@@ -0,0 +1,124 @@
+# src/matrix_store.py
+from __future__ import annotations
+import json, mmap, os, shutil, tempfile, threading
+import numpy as np, pandas as pd
+from contextlib import contextmanager
+from src.matrix_cache import _coord_keys
+
+# Almacén de matrices: un directorio con distances.npy / durations.npy (float32, m y s)
+# e index.csv (posición -> id, lon, lat, clave de coordenadas), más meta.json con el origen
+# (backend que calculó la matriz y perfiles offline, ver src.matrix.matrix_source). Los .npy se abren con
+# np.load(mmap_mode="r"): abrir una matriz regional de 5000 nodos no lee nada del disco
+# hasta usarla y todos los procesos comparten las mismas páginas.
+STORE_DTYPE = np.float32
+
+def _save_npy(path: str, array):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+    np.save(tmp, np.asarray(array, dtype=STORE_DTYPE))
+    os.replace(tmp, path)
+
+def save_store(path: str, points: pd.DataFrame, distances, durations, decimals: int = 5,
+               source: dict | None = None):
+    """Guarda las matrices de points (en su orden) como almacén en el directorio path.
+    source: origen de las matrices (src.matrix.matrix_source), se guarda en meta.json."""
+    os.makedirs(path, exist_ok=True)
+    meta = os.path.join(path, "meta.json")
+    if os.path.exists(meta):
+        os.remove(meta)  # sin origen mientras se reescribe
+    _save_npy(os.path.join(path, "distances.npy"), distances)
+    _save_npy(os.path.join(path, "durations.npy"), durations)
+    index = pd.DataFrame({
+        "id": points["id"].astype(str).to_numpy() if "id" in points.columns else "",
+        "lon": points["lon"].to_numpy(), "lat": points["lat"].to_numpy(),
+        "key": _coord_keys(points, decimals),
+    })
+    index.to_csv(os.path.join(path, "index.csv"), index=False)
+    if source is not None:
+        tmp = f"{meta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(source, f, sort_keys=True)
+        os.replace(tmp, meta)
+
+def store_source(path: str) -> dict | None:
+    """Origen guardado en meta.json, o None (almacén anterior a meta.json o a medio escribir)."""
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def open_store(path: str):
+    """(índice, distancias, duraciones) con las matrices mapeadas en memoria (sólo lectura)."""
+    index = pd.read_csv(os.path.join(path, "index.csv"), dtype={"id": str, "key": str})
+    distances = np.load(os.path.join(path, "distances.npy"), mmap_mode="r")
+    durations = np.load(os.path.join(path, "durations.npy"), mmap_mode="r")
+    return index, distances, durations
+
+def store_lookup(path: str, points: pd.DataFrame, decimals: int = 5):
+    """Matrices de points desde el almacén existente, o None si falta algún punto (por coordenadas).
+    Si points coincide con el índice en el mismo orden se devuelven los memmap tal cual
+    (sin copia); si no, la submatriz pedida."""
+    index, distances, durations = open_store(path)
+    pos_of = {k: i for i, k in enumerate(index["key"])}
+    pos = np.array([pos_of.get(k, -1) for k in _coord_keys(points, decimals)], dtype=np.int64)
+    if (pos < 0).any():
+        return None
+    if len(pos) == len(index) and (pos == np.arange(len(pos))).all():
+        return distances, durations
+    sub = np.ix_(pos, pos)
+    return distances[sub], durations[sub]
+
+def _file_of(array) -> str | None:
+    """Archivo .npy completo detrás de un memmap de np.load (no de una vista o submatriz)."""
+    if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap) and array.filename:
+        return array.filename
+    return None
+
+@contextmanager
+def shared_files(distances, durations):
+    """Rutas .npy para que otros procesos abran las matrices con open_shared en vez de
+    recibir copias serializadas. Los memmap de un almacén se reutilizan; cualquier otra
+    matriz se vuelca a un directorio temporal mientras dure el bloque."""
+    files = (_file_of(distances), _file_of(durations))
+    if all(files):
+        yield files
+        return
+    tmp = tempfile.mkdtemp(prefix="vrp_matrix_")
+    try:
+        files = (os.path.join(tmp, "distances.npy"), os.path.join(tmp, "durations.npy"))
+        _save_npy(files[0], distances)
+        _save_npy(files[1], durations)
+        yield files
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def open_shared(path: str, nodes=None):
+    """Matriz compartida por shared_files; con nodes, sólo esa submatriz (copia chica)."""
+    array = np.load(path, mmap_mode="r")
+    return array if nodes is None else array[np.ix_(nodes, nodes)]
+
+if __name__ == "__main__":
+    import argparse
+    from src.matrix import MATRIX_BACKENDS, get_matrix, load_profiles, matrix_source
+    from src.tables import read_table
+    ap = argparse.ArgumentParser(description="Precalcula el almacén de matrices de todos los centros de un CSV")
+    ap.add_argument("centros", help="CSV o Parquet con id, lat, lon (p. ej. el padrón regional de centros)")
+    ap.add_argument("store", help="directorio de salida")
+    ap.add_argument("--osrm", default="https://router.project-osrm.org")
+    ap.add_argument("--matrix", choices=MATRIX_BACKENDS, default="auto")
+    ap.add_argument("--offline-profiles", default=None)
+    ap.add_argument("--tile-size", type=int, default=50)
+    ap.add_argument("--osrm-workers", type=int, default=4)
+    args = ap.parse_args()
+    points = read_table(args.centros, "centros").drop_duplicates("id").reset_index(drop=True)
+    profiles, report = load_profiles(args.offline_profiles), {}
+    distances, durations = get_matrix(points, args.osrm, args.matrix, tile_size=args.tile_size,
+                                      max_workers=args.osrm_workers, profiles=profiles, report=report)
+    if durations is None:
+        raise SystemExit("el backend no devolvió duraciones; no se guarda el almacén")
+    source = matrix_source(report["backend"], profiles)
+    if source != matrix_source(args.matrix, profiles):
+        raise SystemExit("OSRM no respondió y la matriz es la estimación offline; no se guarda el almacén "
+                         "(reintente, o use --matrix offline si eso es lo que quiere guardar)")
+    save_store(args.store, points, distances, durations, source=source)
+    print(f"Almacén: {args.store} ({len(points)} nodos)")
@@ -0,0 +1,96 @@
+# src/metrics.py
+from __future__ import annotations
+import json, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+class Metrics:
+    """Registro liviano en memoria: contadores, spans (duración por etapa), resúmenes
+    (latencias) y series (progreso del objetivo). Seguro entre hilos; cada proceso
+    tiene el suyo (los workers de --decompose/--portfolio no se suman).
+    Los contadores y resúmenes son totales (stage_seconds acumula los spans por etapa);
+    la línea de tiempo de spans y cada serie guardan sólo los últimos max_spans /
+    max_points, para que un proceso largo (src.service) no crezca sin límite."""
+
+    def __init__(self, max_spans: int = 1000, max_points: int = 10000):
+        self._lock = threading.Lock()
+        self.max_spans, self.max_points = max_spans, max_points
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters: dict[tuple, float] = {}
+            self.summaries: dict[tuple, list[float]] = {}   # [n, suma, máx]
+            self.series: dict[str, deque[tuple[float, float]]] = {}
+            self.spans: deque[dict] = deque(maxlen=self.max_spans)
+            self.t0 = time.perf_counter()
+
+    @staticmethod
+    def _key(name: str, labels: dict | None) -> tuple:
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            s = self.summaries.setdefault(key, [0, 0.0, 0.0])
+            s[0] += 1; s[1] += value; s[2] = max(s[2], value)
+
+    def point(self, name: str, value: float):
+        """Agrega (segundos desde reset, valor) a una serie, p. ej. el objetivo."""
+        with self._lock:
+            self.series.setdefault(name, deque(maxlen=self.max_points)).append((round(time.perf_counter() - self.t0, 3), value))
+
+    @contextmanager
+    def span(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            with self._lock:
+                self.spans.append({"name": name, "start": round(t0 - self.t0, 3), "seconds": round(seconds, 4)})
+            self.observe("stage_seconds", seconds, stage=name)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "spans": list(self.spans),
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.counters.items()],
+                "summaries": [{"name": n, "labels": dict(l), "count": s[0], "sum": round(s[1], 4), "max": round(s[2], 4)}
+                              for (n, l), s in self.summaries.items()],
+                "series": {k: list(v) for k, v in self.series.items()},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=1)
+
+    def to_prometheus(self, prefix: str = "vrp_") -> str:
+        """Formato de texto de Prometheus: contadores, resúmenes (_count/_sum/_max) y
+        el último valor de cada serie como gauge."""
+        def fmt(name, labels, value):
+            lab = ",".join(f'{k}="{str(v)}"' for k, v in labels)
+            return f"{prefix}{name}{{{lab}}} {value:g}" if lab else f"{prefix}{name} {value:g}"
+        lines = []
+        with self._lock:
+            for (n, l), v in sorted(self.counters.items()):
+                lines.append(fmt(n, l, v))
+            for (n, l), s in sorted(self.summaries.items()):
+                lines += [fmt(f"{n}_count", l, s[0]), fmt(f"{n}_sum", l, s[1]), fmt(f"{n}_max", l, s[2])]
+            for n, points in sorted(self.series.items()):
+                if points:
+                    lines.append(fmt(n, (), points[-1][1]))
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: str):
+        """.prom / .txt -> Prometheus; cualquier otra extensión -> JSON."""
+        text = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+metrics = Metrics()
+span = metrics.span
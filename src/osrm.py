@@ -1,32 +1,88 @@
-import requests, pandas as pd
+import numpy as np, pandas as pd, polyline
+from concurrent.futures import ThreadPoolExecutor
+from src.osrm_client import OsrmClient, get_client
 
-def osrm_table(osrm_url: str, points: pd.DataFrame):
-    coords = ";".join([f"{row.lon},{row.lat}" for _, row in points.iterrows()])
-    url = f"{osrm_url}/table/v1/driving/{coords}"
+def osrm_table(osrm_url: str, points: pd.DataFrame, sources=None, destinations=None, profile="driving",
+               client: OsrmClient | None = None):
+    coords = ";".join([f"{lon},{lat}" for lon, lat in zip(points["lon"], points["lat"])])
+    url = f"{osrm_url}/table/v1/{profile}/{coords}"
     params = {"annotations": "distance,duration"}
-    r = requests.get(url, params=params, timeout=30)
-    r.raise_for_status()
-    data = r.json()
+    # Submatriz: sólo las filas (sources) / columnas (destinations) indicadas
+    if sources is not None:
+        params["sources"] = ";".join(str(int(i)) for i in sources)
+    if destinations is not None:
+        params["destinations"] = ";".join(str(int(i)) for i in destinations)
+    data = (client or get_client()).get_json(url, params, "table")
     return data["distances"], data.get("durations")
 
-def osrm_route(osrm_url: str, points_lonlat, overview="full"):
+def osrm_table_tiled(osrm_url: str, points: pd.DataFrame, sources=None, destinations=None,
+                     profile="driving", tile_size: int = 50, max_workers: int = 4,
+                     client: OsrmClient | None = None):
+    """Matriz origen x destino en bloques de tile_size x tile_size pedidos en paralelo.
+
+    Cada bloque envía sólo sus propias coordenadas (<= 2*tile_size), así la URL y el
+    max-table-size del servidor no crecen con el total de nodos. Devuelve arrays NumPy
+    (distancias, duraciones); duraciones = None si OSRM no las devolvió.
+    """
+    src = np.arange(len(points)) if sources is None else np.asarray(sources, dtype=int)
+    dst = np.arange(len(points)) if destinations is None else np.asarray(destinations, dtype=int)
+    distances = np.full((len(src), len(dst)), np.nan)
+    durations = np.full((len(src), len(dst)), np.nan)
+    blocks = [(i, j) for i in range(0, len(src), tile_size) for j in range(0, len(dst), tile_size)]
+    client = client or get_client()
+
+    def fetch(block):
+        i, j = block
+        s_idx, d_idx = src[i:i + tile_size], dst[j:j + tile_size]
+        sub = np.unique(np.concatenate([s_idx, d_idx]))
+        d, t = osrm_table(osrm_url, points.iloc[sub], sources=np.searchsorted(sub, s_idx),
+                          destinations=np.searchsorted(sub, d_idx), profile=profile, client=client)
+        return i, j, d, t
+
+    has_durations = True
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+        for i, j, d, t in ex.map(fetch, blocks):
+            d = np.array(d, dtype=float)
+            distances[i:i + d.shape[0], j:j + d.shape[1]] = d
+            if t is None:
+                has_durations = False
+            else:
+                durations[i:i + d.shape[0], j:j + d.shape[1]] = np.array(t, dtype=float)
+    return distances, (durations if has_durations else None)
+
+def osrm_route(osrm_url: str, points_lonlat, overview="full", steps=False, profile="driving",
+               client: OsrmClient | None = None):
     coords = ";".join([f"{lon},{lat}" for lon, lat in points_lonlat])
-    url = f"{osrm_url}/route/v1/driving/{coords}"
-    params = {"overview": overview, "geometries": "polyline"}
-    r = requests.get(url, params=params, timeout=30)
-    r.raise_for_status()
-    data = r.json()
+    url = f"{osrm_url}/route/v1/{profile}/{coords}"
+    params = {"overview": overview, "geometries": "polyline", "steps": str(steps).lower()}
+    data = (client or get_client()).get_json(url, params, "route")
     if not data.get("routes"):
         return None
     return data["routes"][0]
 
-def osrm_leg(osrm_url: str, a_lonlat, b_lonlat, overview="full"):
+def osrm_route_legs(osrm_url: str, points_lonlat, profile="driving", client: OsrmClient | None = None):
+    """Una sola petición /route para toda la secuencia; devuelve un dict por tramo
+    (distance, duration, geometry) como osrm_leg. La geometría de cada tramo se arma
+    uniendo las de sus pasos (steps=true), ya que OSRM no la entrega por tramo."""
+    route = osrm_route(osrm_url, points_lonlat, overview="false", steps=True, profile=profile, client=client)
+    if route is None:
+        return None
+    legs = []
+    for leg in route["legs"]:
+        coords = []
+        for step in leg.get("steps", []):
+            pts = polyline.decode(step["geometry"])
+            # el primer punto de un paso repite el último del anterior
+            coords.extend(pts[1:] if coords and pts and pts[0] == coords[-1] else pts)
+        legs.append({"distance": leg["distance"], "duration": leg["duration"],
+                     "geometry": polyline.encode(coords)})
+    return legs
+
+def osrm_leg(osrm_url: str, a_lonlat, b_lonlat, overview="full", client: OsrmClient | None = None):
     coords = f"{a_lonlat[0]},{a_lonlat[1]};{b_lonlat[0]},{b_lonlat[1]}"
     url = f"{osrm_url}/route/v1/driving/{coords}"
     params = {"overview": overview, "geometries": "polyline"}
-    r = requests.get(url, params=params, timeout=30)
-    r.raise_for_status()
-    data = r.json()
+    data = (client or get_client()).get_json(url, params, "route")
     if not data.get("routes"):
         return None
     r0 = data["routes"][0]
@@ -0,0 +1,207 @@
+# src/osrm_client.py
+from __future__ import annotations
+import asyncio, logging, random, re, threading, time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from src.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# El servidor de demostración de OSRM admite ~1 petición/s; sin límite devuelve 429.
+PUBLIC_OSRM_HOST = "router.project-osrm.org"
+PUBLIC_OSRM_RATE = 1.0
+_SERVICE_PATH = re.compile(r"/(?:route|table|trip|nearest|match|tile)/v1/")
+
+class CircuitOpenError(requests.ConnectionError):
+    """Circuito abierto para el servidor y sin respaldo: se falla sin esperar la red.
+    Es un RequestException, así que los respaldos offline existentes lo atrapan."""
+
+class TokenBucket:
+    """Limitador de tasa: rate tokens/s con ráfagas de hasta burst. Seguro entre hilos."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Espera hasta tener un token; devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class CircuitBreaker:
+    """closed -> open tras threshold fallas seguidas; pasado cooldown deja pasar una
+    petición de prueba (half-open): si responde se cierra, si falla vuelve a abrirse."""
+
+    def __init__(self, name: str, threshold: int = 5, cooldown: float = 30.0):
+        self.name, self.threshold, self.cooldown = name, threshold, cooldown
+        self.state, self.failures, self.opened_at, self.probing = "closed", 0, 0.0, False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state, self.probing = "half_open", False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return self.state == "closed"
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                log.info("circuito de %s cerrado", self.name)
+            self.state, self.failures, self.probing = "closed", 0, False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                log.warning("circuito de %s abierto por %g s tras %d fallas", self.name, self.cooldown,
+                            self.failures)
+                metrics.inc("osrm_circuit_open_total", host=self.name)
+                self.state, self.opened_at, self.probing = "open", time.monotonic(), False
+
+class OsrmClient:
+    """Cliente HTTP compartido para OSRM: pool de conexiones keep-alive, reintentos con
+    backoff exponencial y jitter en 429/5xx/caídas de red, límite de tasa (token bucket)
+    y circuit breaker por servidor. Con el circuito abierto las peticiones van a
+    fallback_url (otro OSRM) o fallan al instante con CircuitOpenError.
+
+    rate=None: sin límite, salvo router.project-osrm.org (PUBLIC_OSRM_RATE)."""
+
+    def __init__(self, pool_size: int = 16, retries: int = 4, backoff: float = 0.5, max_backoff: float = 8.0,
+                 timeout: tuple[float, float] = (5, 30), rate: float | None = None, burst: float | None = None,
+                 fallback_url: str | None = None, breaker_threshold: int = 5, breaker_cooldown: float = 30.0):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.retries, self.backoff, self.max_backoff, self.timeout = retries, backoff, max_backoff, timeout
+        self.rate, self.burst = rate, burst
+        self.fallback_url = fallback_url.rstrip("/") if fallback_url else None
+        self.breaker_threshold, self.breaker_cooldown = breaker_threshold, breaker_cooldown
+        self._hosts: dict[str, tuple[CircuitBreaker, TokenBucket | None]] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host: str) -> tuple[CircuitBreaker, TokenBucket | None]:
+        with self._lock:
+            if host not in self._hosts:
+                rate = self.rate if self.rate is not None else (PUBLIC_OSRM_RATE if host == PUBLIC_OSRM_HOST else None)
+                self._hosts[host] = (CircuitBreaker(host, self.breaker_threshold, self.breaker_cooldown),
+                                     TokenBucket(rate, self.burst) if rate else None)
+            return self._hosts[host]
+
+    def _fallback(self, url: str) -> str | None:
+        """La misma petición contra fallback_url (se conserva /servicio/v1/...)."""
+        m = _SERVICE_PATH.search(url)
+        if not self.fallback_url or not m or url.startswith(self.fallback_url):
+            return None
+        return self.fallback_url + url[m.start():]
+
+    def _delay(self, attempt: int, response) -> float:
+        """Backoff exponencial con jitter completo; respeta Retry-After si viene en segundos."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        after = response.headers.get("Retry-After") if response is not None else None
+        if after and after.isdigit():
+            delay = max(delay, min(float(after), 60.0))
+        return delay
+
+    def _request(self, url: str, params: dict | None, service: str, bucket, timeout) -> dict:
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                waited = bucket.acquire()
+                if waited:
+                    metrics.observe("osrm_throttle_seconds", waited, service=service)
+            t0 = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(url, params=params, timeout=timeout or self.timeout)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    response.raise_for_status()
+                    metrics.inc("osrm_bytes_total", len(response.content), service=service)
+                    return response.json()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            finally:
+                metrics.inc("osrm_requests_total", service=service)
+                metrics.observe("osrm_latency_seconds", time.perf_counter() - t0, service=service)
+            delay = self._delay(attempt, response)
+            metrics.inc("osrm_retries_total", service=service)
+            log.debug("%s: reintento %d en %.2f s (%s)", service, attempt + 1, delay,
+                      response.status_code if response is not None else "sin respuesta")
+            time.sleep(delay)
+
+    def get_json(self, url: str, params: dict | None = None, service: str = "osrm", timeout=None) -> dict:
+        """GET con reintentos, límite de tasa y circuit breaker; devuelve el JSON.
+        Cuenta peticiones, reintentos, bytes, errores y latencia por servicio."""
+        breaker, bucket = self._host(urlsplit(url).netloc)
+        fallback = self._fallback(url)
+        if not breaker.allow():
+            if fallback:
+                metrics.inc("osrm_fallback_total", service=service)
+                return self.get_json(fallback, params, service, timeout)
+            metrics.inc("osrm_errors_total", service=service)
+            raise CircuitOpenError(f"circuito abierto para {breaker.name}")
+        try:
+            data = self._request(url, params, service, bucket, timeout)
+        except requests.RequestException as e:
+            status = getattr(e.response, "status_code", None)
+            if status is not None and status not in RETRY_STATUS:
+                breaker.success()  # 4xx: el servidor responde, la petición es la inválida
+            else:
+                breaker.failure()
+                if fallback:
+                    metrics.inc("osrm_fallback_total", service=service)
+                    return self.get_json(fallback, params, service, timeout)
+            metrics.inc("osrm_errors_total", service=service)
+            raise
+        breaker.success()
+        return data
+
+    async def aget_json(self, url: str, params: dict | None = None, service: str = "osrm", timeout=None) -> dict:
+        """get_json para asyncio: corre en un hilo con el mismo pool, límite y circuito."""
+        return await asyncio.to_thread(self.get_json, url, params, service, timeout)
+
+    async def gather_json(self, calls, concurrency: int = 8) -> list:
+        """Muchas peticiones concurrentes (a lo sumo concurrency en vuelo); calls son
+        tuplas de argumentos de get_json. Devuelve los JSON en el mismo orden."""
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(call):
+            async with sem:
+                return await self.aget_json(*call)
+        return await asyncio.gather(*(one(c) for c in calls))
+
+_client: OsrmClient | None = None
+_client_lock = threading.Lock()
+
+def get_client() -> OsrmClient:
+    """Cliente compartido por todo el proceso (se crea con los valores por defecto)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OsrmClient()
+        return _client
+
+def configure(**kwargs) -> OsrmClient:
+    """Reemplaza el cliente compartido (parámetros de OsrmClient)."""
+    global _client
+    with _client_lock:
+        _client = OsrmClient(**kwargs)
+        return _client
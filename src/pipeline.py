@@ -0,0 +1,264 @@
+# src/pipeline.py
+from __future__ import annotations
+import hashlib, json, logging, os, shutil, threading
+import numpy as np, pandas as pd, requests
+from src.matrix import load_profiles, matrix_source
+from src.metrics import metrics, span
+from src.schedule import schedule_rows
+from src.tables import LEG_DTYPES, PLAN_DTYPES, SCHEDULE_DTYPES, RowWriter, read_table
+
+log = logging.getLogger(__name__)
+
+# Etapas de run.py en orden; cada una deja un artefacto <etapa>-<hash>.<ext>.
+STAGES = ("matrix", "solve", "legs", "render")
+
+def file_digest(path: str | None) -> str | None:
+    """sha256 del contenido de un archivo (None sin archivo)."""
+    if not path:
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def stage_key(stage: str, **inputs) -> str:
+    """Hash (16 hex) de una etapa a partir de sus entradas: digests de archivos y opciones."""
+    text = json.dumps({"stage": stage, **inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def _native(x):
+    """Escalares de NumPy -> tipos de Python (para json.dump)."""
+    return x.item() if hasattr(x, "item") else str(x)
+
+def _publish(path: str, write) -> str:
+    """write(tmp) y renombrado atómico: un corte no deja un artefacto a medias."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+    write(tmp)
+    os.replace(tmp, path)
+    return path
+
+def _dump_json(obj, indent: int | None = None):
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=indent, default=_native)
+    return write
+
+def _load_json(path: str):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+class Pipeline:
+    """Corrida de run.py por etapas: matrix -> solve -> legs -> render.
+    El hash de cada etapa cubre sus entradas (contenido de los CSV, opciones que cambian
+    el resultado y el contenido del artefacto anterior); si su artefacto ya existe en
+    artifacts no se vuelve a calcular. Pedir una etapa corre sólo las anteriores que
+    falten, y volver a resolver con otro resultado invalida legs y render aunque sus
+    opciones no cambien. force: etapas a recalcular igual. Una matriz 'auto' que cayó a
+    offline con OSRM caído se guarda con otro hash: la corrida siguiente vuelve a pedir
+    OSRM en vez de reutilizar la estimación. OR-Tools y folium se importan sólo en las
+    etapas que los usan. Las salidas de siempre (outputs/plan_entregas.csv,
+    plan_snapshot.json, schedule.csv, leg_distances.csv, mapa.html) se reescriben
+    desde los artefactos; sólo render pide geometrías a la red. Las entradas pueden ser
+    CSV, Parquet o Arrow (src.tables)."""
+
+    def __init__(self, centros_csv: str, demandas_csv: str, vehiculos_csv: str, osrm_url: str,
+                 artifacts: str = "outputs/stages", out_dir: str = "outputs", force=(),
+                 matrix_backend: str = "auto", profiles_json: str | None = None, sparse_k: int | None = None,
+                 cache_dir: str | None = "cache", tile_size: int = 50, osrm_workers: int = 4,
+                 matrix_store: str | None = None, solve_options: dict | None = None,
+                 warm_start: str | None = None, map_tolerance: float = 10.0, geojson: str | None = None,
+                 output_format: str = "csv"):
+        self.csvs = {"centros": centros_csv, "demandas": demandas_csv, "vehiculos": vehiculos_csv}
+        self.osrm_url, self.artifacts, self.out_dir = osrm_url, artifacts, out_dir
+        self.force = set(force or ())
+        self.matrix_backend, self.sparse_k = matrix_backend, sparse_k
+        self.cache_dir, self.tile_size, self.osrm_workers = cache_dir, tile_size, osrm_workers
+        self.matrix_store = matrix_store
+        self.solve_options = dict(solve_options or {})
+        self.warm_start, self.map_tolerance, self.geojson = warm_start, map_tolerance, geojson
+        self.output_format = output_format
+        with span("load_inputs"):
+            self.inputs = {name: file_digest(path) for name, path in self.csvs.items()}
+            self.profiles = load_profiles(profiles_json)
+        self.profiles_digest = file_digest(profiles_json)
+        # con backend offline la URL no cambia el resultado
+        self.osrm_key = None if matrix_backend == "offline" else osrm_url
+        self.done: dict[str, str | None] = {}
+        self.routes = self.points = self.legs_by_vehicle = None
+
+    def _frames(self) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        return tuple(read_table(self.csvs[name], name) for name in ("centros", "demandas", "vehiculos"))
+
+    def _needed(self, stage: str, path: str) -> bool:
+        hit = os.path.exists(path) and stage not in self.force
+        metrics.inc("pipeline_stages_total", stage=stage, result="hit" if hit else "run")
+        log.info("etapa %s: %s %s", stage, "sin cambios," if hit else "calculando", path)
+        return not hit
+
+    def _artifact(self, stage: str, key: str, ext: str) -> str:
+        return os.path.join(self.artifacts, f"{stage}-{key}.{ext}")
+
+    def matrix(self) -> str:
+        """Distancias, duraciones (y arcos permitidos con sparse_k) de los puntos de
+        build_data, en .npz."""
+        if "matrix" in self.done:
+            return self.done["matrix"]
+        key = lambda **extra: stage_key("matrix", **self.inputs, backend=self.matrix_backend, osrm=self.osrm_key,
+                                        profiles=self.profiles_digest, sparse_k=self.sparse_k, **extra)
+        path = self._artifact("matrix", key(), "npz")
+        if self._needed("matrix", path):
+            from src.solve_vrp_osrm_apu import build_data, data_matrices
+            with span("build_data"):
+                data = build_data(*self._frames())
+            report = {}
+            distances, durations, allowed = data_matrices(data, self.osrm_url, self.cache_dir, self.tile_size,
+                                                          self.osrm_workers, self.matrix_backend, self.profiles,
+                                                          self.matrix_store, self.sparse_k, report=report)
+            if report["backend"] != matrix_source(self.matrix_backend)["backend"]:
+                # estimación de un 'auto' sin OSRM: artefacto aparte, la próxima corrida no lo reutiliza
+                path = self._artifact("matrix", key(fallback=report["backend"]), "npz")
+                log.warning("etapa matrix: OSRM no respondió; estimación offline en %s (no se reutiliza)", path)
+            arrays = {"distances": np.asarray(distances, dtype=float), "durations": np.asarray(durations, dtype=float)}
+            if allowed is not None:
+                arrays["allowed"] = allowed
+
+            def write(tmp):
+                with open(tmp, "wb") as f:
+                    np.savez(f, **arrays)
+            _publish(path, write)
+        self.done["matrix"] = path
+        return path
+
+    def solve(self) -> str | None:
+        """Rutas con su horario, puntos, tramos (de la matriz) y snapshot del plan en JSON;
+        None si no hubo solución. Escribe plan_entregas, schedule y leg_distances (.csv o
+        .parquet según output_format, vehículo por vehículo) sin pedir nada a la red."""
+        if "solve" in self.done:
+            return self.done["solve"]
+        matrix_path = self.matrix()
+        key = stage_key("solve", **self.inputs, matrix=file_digest(matrix_path), backend=self.matrix_backend,
+                        options=self.solve_options, warm_start=file_digest(self.warm_start))
+        path = self._artifact("solve", key, "json")
+        snapshot_path = os.path.join(self.out_dir, "plan_snapshot.json")
+        if self._needed("solve", path):
+            from src.solve_vrp_osrm_apu import solve_vrp
+            from src.warm_start import load_plan, save_snapshot, snapshot
+            centros, demandas, vehiculos = self._frames()
+            plan = load_plan(self.warm_start, vehiculos) if self.warm_start else None
+            with np.load(matrix_path) as z:
+                matrices = (z["distances"], z["durations"], z["allowed"] if "allowed" in z.files else None)
+
+            # cada mejora queda en outputs/plan_snapshot.json (como mucho una escritura por segundo)
+            saved_at = [-1.0]
+            def on_solution(routes, cost, seconds, points):
+                log.info("mejora: costo %d a los %.2f s", cost, seconds)
+                if seconds - saved_at[0] >= 1:
+                    save_snapshot(snapshot_path, routes, points, vehiculos)
+                    saved_at[0] = seconds
+
+            routes, _, points = solve_vrp(centros, demandas, vehiculos, self.osrm_url,
+                                          matrix_backend=self.matrix_backend, profiles=self.profiles,
+                                          warm_start=plan, on_solution=on_solution, matrices=matrices,
+                                          **self.solve_options)
+            if routes is None:
+                self.done["solve"] = None
+                return None
+            from src.legs import matrix_legs
+            # distancias y tiempos por tramo de las mismas matrices del solver: sin red
+            legs = matrix_legs(routes, points, matrices[0], matrices[1])
+            _publish(path, _dump_json({"routes": routes, "points": json.loads(points.to_json(orient="records")),
+                                       "legs": {str(v): l for v, l in legs.items()},
+                                       "snapshot": snapshot(routes, points, vehiculos)}))
+        solved = _load_json(path)
+        self.routes, self.points = solved["routes"], pd.DataFrame(solved["points"])
+        self.legs_by_vehicle = {int(v): legs for v, legs in solved["legs"].items()}
+        late = [s for r in self.routes for s in r["stops"] if s["late"] > 0]
+        if late:
+            log.warning("%d paradas fuera de ventana (ver schedule.csv); atraso máximo %.0f min",
+                        len(late), max(s["late"] for s in late) / 60)
+
+        # filas por vehículo directo al archivo (CSV o Parquet), sin armar las tablas completas
+        os.makedirs(self.out_dir, exist_ok=True)
+        out = lambda name: os.path.join(self.out_dir, f"{name}.{self.output_format}")
+        ids, names = self.points["id"].tolist(), self.points["name"].tolist()
+        with RowWriter(out("plan_entregas"), PLAN_DTYPES) as plan, RowWriter(out("schedule"), SCHEDULE_DTYPES) as sched, \
+                RowWriter(out("leg_distances"), LEG_DTYPES) as leg_rows:
+            for r in self.routes:
+                v = r["vehicle"]
+                plan.write([{"vehicle": v, "seq": seq, "node_index": node, "id": ids[node], "name": names[node]}
+                            for seq, node in enumerate(r["order"])])
+                sched.write(schedule_rows(r, names))
+                leg_rows.write([{"vehicle": v, **{k:leg[k] for k in ["from_id","to_id","from_name","to_name","meters","seconds"]}}
+                                for leg in self.legs_by_vehicle.get(v, [])])
+        _publish(snapshot_path, _dump_json(solved["snapshot"], indent=1))
+        self.done["solve"] = path
+        return path
+
+    def legs(self) -> str | None:
+        """Geometría por tramo para el mapa (OSRM /route, o segmento recto offline o para
+        el vehículo cuya ruta OSRM no devuelva) sobre los tramos de la etapa solve, en
+        JSON. Sólo la pide render."""
+        if "legs" in self.done:
+            return self.done["legs"]
+        solve_path = self.solve()
+        if solve_path is None:
+            return None
+        key = stage_key("legs", solve=file_digest(solve_path), backend=self.matrix_backend, osrm=self.osrm_key,
+                        profiles=self.profiles_digest)
+        path = self._artifact("legs", key, "json")
+        if self._needed("legs", path):
+            from src.legs import fetch_legs, estimate_legs
+            used = [r for r in self.routes if len(r["order"]) > 2]
+            # una petición /route por vehículo usado (tramos separados de la respuesta), en paralelo
+            with span("legs"):
+                if self.matrix_backend == "offline":
+                    fetched = estimate_legs(used, self.points, self.profiles)
+                else:
+                    try:
+                        fetched = fetch_legs(self.osrm_url, used, self.points, max_workers=self.osrm_workers)
+                    except requests.RequestException:
+                        if self.matrix_backend == "osrm":
+                            raise
+                        log.warning("OSRM no disponible; tramos estimados en línea recta.")
+                        fetched = estimate_legs(used, self.points, self.profiles)
+                # vehículos sin /route (p. ej. NoRoute): segmento recto, no desaparecen del mapa
+                short = [r for r in used if len(fetched.get(r["vehicle"]) or []) != len(r["order"]) - 1]
+                if short:
+                    log.warning("sin /route para los vehículos %s; sus tramos se estiman en línea recta",
+                                ", ".join(str(r["vehicle"]) for r in short))
+                    fetched.update(estimate_legs(short, self.points, self.profiles))
+            # distancias y tiempos siguen siendo los de la matriz (como en los CSV)
+            geometries = {str(v): [{**leg, "geometry": f["geometry"]} for leg, f in zip(self.legs_by_vehicle[v], legs)]
+                          for v, legs in fetched.items()}
+            _publish(path, _dump_json(geometries))
+        self.legs_by_vehicle = {**self.legs_by_vehicle,
+                                **{int(v): legs for v, legs in _load_json(path).items()}}
+        self.done["legs"] = path
+        return path
+
+    def render(self) -> str | None:
+        """Mapa HTML (y GeoJSON de las rutas con geojson); devuelve outputs/mapa.html."""
+        if "render" in self.done:
+            return self.done["render"]
+        legs_path = self.legs()
+        if legs_path is None:
+            return None
+        key = stage_key("render", legs=file_digest(legs_path), centros=self.inputs["centros"],
+                        tolerance=self.map_tolerance, geojson=bool(self.geojson))
+        html = self._artifact("render", key, "html")
+        collection = self._artifact("render", key, "geojson") if self.geojson else None
+        if self._needed("render", html):
+            from src.plot_map_multi import plot_multi
+            # plot_multi escribe el GeoJSON antes que el HTML: si el HTML existe, ambos están completos
+            with span("render"):
+                _publish(html, lambda tmp: plot_multi(self.csvs["centros"], self.routes, self.legs_by_vehicle, tmp,
+                                                      self.map_tolerance, geojson_out=collection))
+        out_html = os.path.join(self.out_dir, "mapa.html")
+        shutil.copyfile(html, out_html)
+        if collection:
+            shutil.copyfile(collection, self.geojson)
+        self.done["render"] = out_html
+        return out_html
@@ -1,15 +1,94 @@
-import folium, pandas as pd, polyline
+import json, math
+import folium, numpy as np, polyline
+from folium.plugins import MarkerCluster
+from src.tables import read_table
+
+# Con más centros que esto los marcadores se agrupan (MarkerCluster) si no se indica cluster.
+CLUSTER_MIN = 100
 
 def _color(i:int):
     palette = ["blue","red","green","purple","orange","darkred","lightred","beige","darkblue","darkgreen","cadetblue","darkpurple","gray","black","lightgray"]
     return palette[i % len(palette)]
 
-def plot_multi(points_csv: str, routes: list[dict], legs_by_vehicle: dict, out_html: str = "outputs/mapa.html"):
-    df = pd.read_csv(points_csv).reset_index(drop=True)
+def _native(x):
+    """Escalares de NumPy/pandas -> tipos de Python (para JSON)."""
+    return x.item() if hasattr(x, "item") else x
+
+def simplify(coords, tolerance_m: float) -> list[list[float]]:
+    """Douglas–Peucker sobre [(lat, lon)] con tolerancia en metros (proyección
+    equirectangular local, distancia al segmento). Conserva los extremos y redondea a
+    5 decimales (~1 m, la precisión de la polilínea de OSRM).
+    Se procesan todos los segmentos abiertos a la vez (una pasada NumPy por nivel del
+    árbol de DP en vez de una por segmento)."""
+    pts = np.asarray(coords, dtype=float).reshape(-1, 2)
+    keep = np.ones(len(pts), dtype=bool)
+    if tolerance_m and tolerance_m > 0 and len(pts) > 2:
+        xy = np.c_[pts[:, 1] * 111320.0 * math.cos(math.radians(pts[:, 0].mean())), pts[:, 0] * 110574.0]
+        keep[1:-1] = False
+        done = np.zeros(len(pts), dtype=bool)  # segmentos (por su inicio) ya dentro de la tolerancia
+        while True:
+            idx = np.flatnonzero(keep)
+            cand = np.flatnonzero(~keep)
+            seg = np.searchsorted(idx, cand) - 1
+            live = ~done[idx[seg]]
+            cand, seg = cand[live], seg[live]
+            if not len(cand):
+                break
+            a, ab = xy[idx[seg]], xy[idx[seg + 1]] - xy[idx[seg]]
+            rel = xy[cand] - a
+            l2 = (ab * ab).sum(axis=1)
+            t = np.clip((rel * ab).sum(axis=1) / np.where(l2 > 0, l2, 1.0), 0, 1)
+            d = np.hypot(*(rel - t[:, None] * ab).T)
+            starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+            first = np.lexsort((-d, seg))[starts]  # punto más lejano de cada segmento
+            far = d[first] > tolerance_m
+            keep[cand[first[far]]] = True
+            done[idx[seg[starts[~far]]]] = True
+    return np.round(pts[keep], 5).tolist()
+
+def routes_geojson(routes: list[dict], legs_by_vehicle: dict, tolerance_m: float = 10.0) -> dict:
+    """FeatureCollection con un LineString simplificado por tramo (vehicle, from_id,
+    to_id, km, color, label)."""
+    features = []
+    for r in routes:
+        v = r["vehicle"]
+        for leg in legs_by_vehicle.get(v, []):
+            if not leg.get("geometry"):
+                continue
+            km = leg["meters"] / 1000.0
+            coords = simplify(polyline.decode(leg["geometry"]), tolerance_m)
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in coords]},
+                "properties": {"vehicle": _native(v), "from_id": _native(leg["from_id"]),
+                               "to_id": _native(leg["to_id"]), "km": round(km, 2), "color": _color(v),
+                               "label": f"V{v}: {leg['from_name']} → {leg['to_name']} | {km:.2f} km"},
+            })
+    return {"type": "FeatureCollection", "features": features}
+
+def plot_multi(points_csv: str, routes: list[dict], legs_by_vehicle: dict, out_html: str = "outputs/mapa.html",
+               tolerance_m: float = 10.0, cluster: bool | None = None, geojson_out: str | None = None):
+    """Mapa HTML con centros y rutas. tolerance_m: simplificación Douglas–Peucker de las
+    geometrías (0 = resolución completa de OSRM); cluster: agrupar marcadores (None =
+    sólo con más de CLUSTER_MIN centros); geojson_out: además escribe las rutas como
+    GeoJSON compacto y las dibuja como una sola capa en vez de una polilínea por tramo."""
+    df = read_table(points_csv, "centros").reset_index(drop=True)
+    latlon = dict(zip(df["id"], zip(df["lat"], df["lon"])))
     m = folium.Map(location=[df.lat.mean(), df.lon.mean()], zoom_start=8, control_scale=True)
 
-    for i, row in df.iterrows():
-        folium.Marker([row.lat, row.lon], popup=f"{row['id']}: {row['name']}").add_to(m)
+    if cluster is None:
+        cluster = len(df) > CLUSTER_MIN
+    layer = MarkerCluster(name="Centros").add_to(m) if cluster else m
+    for pid, name, lat, lon in zip(df["id"], df["name"], df["lat"], df["lon"]):
+        folium.Marker([lat, lon], popup=f"{pid}: {name}").add_to(layer)
+
+    if geojson_out:
+        collection = routes_geojson(routes, legs_by_vehicle, tolerance_m)
+        with open(geojson_out, "w", encoding="utf-8") as f:
+            json.dump(collection, f, ensure_ascii=False, separators=(",", ":"))
+        folium.GeoJson(collection, name="Rutas",
+                       style_function=lambda feat: {"color": feat["properties"]["color"], "weight": 5, "opacity": 0.85},
+                       tooltip=folium.GeoJsonTooltip(fields=["label"], labels=False)).add_to(m)
 
     for r in routes:
         v = r["vehicle"]
@@ -21,17 +100,13 @@ def plot_multi(points_csv: str, routes: list[dict], legs_by_vehicle: dict, out_h
             total_km += km
             geom = leg.get("geometry")
             a_name, b_name = leg["from_name"], leg["to_name"]
-            if geom:
-                coords = polyline.decode(geom)
+            if geom and not geojson_out:
+                coords = simplify(polyline.decode(geom), tolerance_m)
                 folium.PolyLine(coords, weight=5, opacity=0.85, color=color,
                                 tooltip=f"V{v}: {a_name} → {b_name} | {km:.2f} km").add_to(m)
         if legs:
             mid = legs[len(legs)//2]
-            folium.Marker(
-                [df.loc[df['id']==mid['to_id'], 'lat'].iloc[0],
-                 df.loc[df['id']==mid['to_id'], 'lon'].iloc[0]],
-                popup=f"Veh {v} — Total: {total_km:.2f} km"
-            ).add_to(m)
+            folium.Marker(list(latlon[mid["to_id"]]), popup=f"Veh {v} — Total: {total_km:.2f} km").add_to(m)
 
     m.save(out_html)
     return out_html
@@ -0,0 +1,71 @@
+# src/portfolio.py
+from __future__ import annotations
+import logging, math, os, time
+from concurrent.futures import ProcessPoolExecutor
+from src.solve_vrp_osrm_apu import build_model, search_parameters, extract_routes
+from src.matrix_store import shared_files, open_shared
+
+log = logging.getLogger(__name__)
+
+# Estrategias "primera solución/metaheurística" (nombres de routing_enums_pb2)
+DEFAULT_PORTFOLIO = (
+    "PATH_CHEAPEST_ARC/GUIDED_LOCAL_SEARCH",
+    "SAVINGS/GUIDED_LOCAL_SEARCH",
+    "PARALLEL_CHEAPEST_INSERTION/GUIDED_LOCAL_SEARCH",
+    "PATH_CHEAPEST_ARC/TABU_SEARCH",
+    "LOCAL_CHEAPEST_INSERTION/SIMULATED_ANNEALING",
+    "CHRISTOFIDES/GUIDED_LOCAL_SEARCH",
+)
+
+def parse_strategy(spec: str) -> tuple[str, str]:
+    """'SAVINGS/TABU_SEARCH' -> ('SAVINGS', 'TABU_SEARCH'); sin '/' se usa GLS."""
+    first, _, meta = spec.strip().upper().partition("/")
+    return first, meta or "GUIDED_LOCAL_SEARCH"
+
+def _solve_strategy(job):
+    data, (dist_file, dur_file), use_matrix, time_limit, spec = job
+    first, meta = parse_strategy(spec)
+    t0 = time.perf_counter()
+    distances, durations = open_shared(dist_file), open_shared(dur_file)  # sin copia: páginas compartidas
+    manager, routing = build_model(data, distances, durations, use_matrix)
+    solution = routing.SolveWithParameters(search_parameters(time_limit, meta, first))
+    seconds = time.perf_counter() - t0
+    if not solution:
+        return None, None, seconds
+    return extract_routes(routing, manager, solution), solution.ObjectiveValue(), seconds
+
+def solve_portfolio(data: tuple, distances, durations, use_matrix: bool = True, time_limit: int = 20,
+                    workers: int | None = None, strategies=DEFAULT_PORTFOLIO):
+    """Lanza varias estrategias en procesos paralelos y se queda con la de menor costo.
+    time_limit es el tiempo de pared total: si hay más estrategias que procesos, se
+    ejecutan por rondas y cada una recibe time_limit / rondas (mínimo 1 s). Si no
+    entran todas las rondas en time_limit se corren sólo las primeras estrategias de la
+    lista que sí entran (al menos una ronda) y se avisa cuáles quedaron fuera.
+    Devuelve (routes | None, informe) con una fila por estrategia."""
+    strategies = ["/".join(parse_strategy(spec)) for spec in strategies]
+    for spec in strategies:
+        search_parameters(1, *reversed(parse_strategy(spec)))  # nombre inválido -> AttributeError aquí
+    workers = min(workers or os.cpu_count() or 1, len(strategies))
+    rounds = min(math.ceil(len(strategies) / workers), max(1, time_limit))
+    per_strategy = max(1, time_limit // rounds)
+    if rounds * workers < len(strategies):
+        log.warning("portafolio: %d estrategias en %d procesos no entran en %d s; se omiten %s",
+                    len(strategies), workers, time_limit, ", ".join(strategies[rounds * workers:]))
+        strategies = strategies[:rounds * workers]
+    if rounds * per_strategy > time_limit:
+        log.warning("portafolio: la búsqueda toma %d s, más que time_limit=%d s (mínimo 1 s por estrategia)",
+                    rounds * per_strategy, time_limit)
+
+    with shared_files(distances, durations) as files:
+        jobs = [(data, files, use_matrix, per_strategy, spec) for spec in strategies]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_solve_strategy, jobs))
+
+    report = [{"strategy": spec, "cost": cost, "seconds": round(seconds, 2), "winner": False}
+              for spec, (_, cost, seconds) in zip(strategies, results)]
+    solved = [i for i, (routes, _, _) in enumerate(results) if routes is not None]
+    if not solved:
+        return None, report
+    best = min(solved, key=lambda i: results[i][1])  # empate: la primera de la lista
+    report[best]["winner"] = True
+    return results[best][0], report
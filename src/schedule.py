@@ -0,0 +1,65 @@
+# src/schedule.py
+from __future__ import annotations
+import numpy as np, pandas as pd
+
+def sec_to_hm(sec) -> str:
+    """Segundos desde medianoche -> 'HH:MM' (inverso de hm_to_sec; pasa de 24 si la ruta cruza la medianoche)."""
+    sec = int(round(sec))
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}"
+
+def route_schedule(data: tuple, durations, route: dict) -> list[dict]:
+    """Horario de una ruta con la aritmética de la dimensión Time del modelo (duraciones
+    redondeadas a s, servicio en el nodo de salida, espera como slack): se sale del
+    depósito al inicio del turno de la flota, se llega lo antes posible y se espera a
+    que abra la ventana. Por parada: arrival, wait, start (inicio del servicio),
+    departure, carga a bordo al salir (load_vol_l, load_kg), la ventana y early/late
+    (s fuera de ella; las ventanas son blandas). El primer y el último nodo son el
+    depósito, con el turno de la flota como ventana. Tiempos en s desde medianoche."""
+    (
+        points, dem_vol, dem_kg, service_sec, tw_start, tw_end,
+        cap_vol, cap_kg, veh_is_refrig, cold_centers,
+        fleet_start, fleet_end, veh_depot
+    ) = data
+    travel = np.rint(np.asarray(durations, dtype=float)).astype(np.int64)
+    order = route["order"]
+    ids = points["id"].tolist()
+    load_vol = sum(dem_vol[i] for i in order[1:-1])
+    load_kg = sum(dem_kg[i] for i in order[1:-1])
+    stops, departure = [], int(fleet_start)
+    for k, node in enumerate(order):
+        depot = k == 0 or k == len(order) - 1
+        lo, hi = (int(fleet_start), int(fleet_end)) if depot else (int(tw_start[node]), int(tw_end[node]))
+        arrival = departure if k == 0 else departure + int(travel[order[k - 1], node])
+        start = arrival if depot else max(arrival, lo)
+        if not depot:
+            load_vol -= dem_vol[node]; load_kg -= dem_kg[node]
+        departure = start + (0 if depot else int(service_sec[node]))
+        stops.append({"node": int(node), "id": ids[node], "arrival": arrival, "wait": start - arrival,
+                      "start": start, "departure": departure,
+                      "load_vol_l": round(max(load_vol, 0.0), 3), "load_kg": round(max(load_kg, 0.0), 3),
+                      "tw_start": lo, "tw_end": hi, "early": max(0, lo - start), "late": max(0, start - hi)})
+    return stops
+
+def attach_schedules(data: tuple, durations, routes: list[dict]) -> list[dict]:
+    """Agrega a cada ruta stops (route_schedule) y duration (s de salida a regreso)."""
+    for r in routes:
+        r["stops"] = route_schedule(data, durations, r)
+        r["duration"] = r["stops"][-1]["arrival"] - r["stops"][0]["departure"]
+    return routes
+
+def schedule_rows(route: dict, names: list[str]) -> list[dict]:
+    """Filas de despacho de una ruta (outputs/schedule.csv): horas HH:MM, espera y atraso en minutos."""
+    rows = []
+    for seq, s in enumerate(route.get("stops", [])):
+        rows.append({"vehicle": route["vehicle"], "seq": seq, "id": s["id"], "name": names[s["node"]],
+                     "arrival": sec_to_hm(s["arrival"]), "wait_min": round(s["wait"] / 60, 1),
+                     "start": sec_to_hm(s["start"]), "departure": sec_to_hm(s["departure"]),
+                     "load_vol_l": s["load_vol_l"], "load_kg": s["load_kg"],
+                     "window": f"{sec_to_hm(s['tw_start'])}-{sec_to_hm(s['tw_end'])}",
+                     "early_min": round(s["early"] / 60, 1), "late_min": round(s["late"] / 60, 1)})
+    return rows
+
+def schedule_frame(routes: list[dict], points: pd.DataFrame) -> pd.DataFrame:
+    """schedule_rows de todas las rutas en una tabla."""
+    names = points["name"].tolist()
+    return pd.DataFrame([row for r in routes for row in schedule_rows(r, names)])
@@ -0,0 +1,268 @@
+# src/service.py
+from __future__ import annotations
+import io, json, logging, threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import pandas as pd, requests
+from src.solve_vrp_osrm_apu import solve_vrp
+from src.legs import fetch_legs, estimate_legs
+from src.lru import LRU
+from src.matrix import MATRIX_BACKENDS, load_profiles
+from src.warm_start import plan_from_snapshot
+from src.metrics import metrics
+from src.tables import TABLE_DTYPES, apply_dtypes
+
+log = logging.getLogger(__name__)
+
+TABLES = ("centros", "demandas", "vehiculos")
+# Opciones de solve_vrp que cada trabajo puede fijar (el resto es configuración del servicio).
+JOB_OPTIONS = {"time_limit": int, "decompose": str, "workers": int, "cluster_size": int,
+               "cluster_method": str, "improve_time": int, "sparse_k": int}
+
+def _read_table(value, name: str) -> pd.DataFrame:
+    """Tabla del trabajo: lista de registros JSON o texto CSV (mismas columnas y tipos que data/*.csv)."""
+    if isinstance(value, str):
+        return apply_dtypes(pd.read_csv(io.StringIO(value)), TABLE_DTYPES[name])
+    if isinstance(value, list) and value:
+        return apply_dtypes(pd.DataFrame.from_records(value), TABLE_DTYPES[name])
+    raise ValueError(f"falta la tabla {name!r} (lista de registros o texto CSV)")
+
+def _job_options(options: dict) -> dict:
+    """Opciones validadas -> kwargs de solve_vrp (+ 'matrix' y 'legs', que usa el servicio)."""
+    kwargs = {}
+    for name, value in options.items():
+        if name in JOB_OPTIONS:
+            kwargs[name] = JOB_OPTIONS[name](value)
+        elif name == "matrix":
+            if value not in MATRIX_BACKENDS:
+                raise ValueError(f"matrix debe ser uno de {MATRIX_BACKENDS}")
+            kwargs[name] = value
+        elif name == "portfolio":
+            kwargs[name] = value if isinstance(value, list) else bool(value)
+        elif name == "plateau":
+            kwargs[name] = tuple(float(x) for x in value)
+        elif name == "legs":
+            kwargs[name] = bool(value)
+        else:
+            raise ValueError(f"opción desconocida: {name!r}")
+    return kwargs
+
+class Planner:
+    """Cola de trabajos de planificación sobre un pool de hilos. El proceso queda vivo
+    entre trabajos: OR-Tools/pandas ya importados, matrices en memoria (LRU por
+    backend y coordenadas, además del caché en disco y el almacén) y geometrías de
+    tramos ya pedidas a OSRM (LRU por par de coordenadas)."""
+
+    def __init__(self, osrm_url: str, matrix_backend: str = "auto", cache_dir: str | None = "cache",
+                 matrix_store: str | None = None, profiles: dict | None = None, workers: int = 2,
+                 tile_size: int = 50, osrm_workers: int = 4, matrices: int = 16, legs: int = 50000,
+                 keep_jobs: int = 500):
+        self.osrm_url, self.matrix_backend, self.cache_dir = osrm_url, matrix_backend, cache_dir
+        self.matrix_store, self.profiles = matrix_store, profiles
+        self.tile_size, self.osrm_workers, self.workers, self.keep_jobs = tile_size, osrm_workers, workers, keep_jobs
+        self.matrices = LRU(matrices)
+        self.legs = LRU(legs)
+        self.jobs: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="plan")
+
+    def submit(self, payload: dict) -> dict:
+        """Valida el trabajo y lo encola; devuelve su estado (ValueError si el pedido es inválido)."""
+        tables = {name: _read_table(payload.get(name), name) for name in TABLES}
+        options = _job_options(payload.get("options") or {})
+        warm_start = plan_from_snapshot(payload["warm_start"], tables["vehiculos"]) if payload.get("warm_start") else None
+        job = {"id": uuid.uuid4().hex[:12], "status": "queued", "created": time.time(), "started": None,
+               "finished": None, "error": None, "progress": [], "result": None}
+        with self._lock:
+            self.jobs[job["id"]] = job
+            done = [k for k, j in self.jobs.items() if j["status"] in ("done", "failed")]
+            for k in done[:max(0, len(self.jobs) - self.keep_jobs)]:
+                del self.jobs[k]
+        metrics.inc("service_jobs_total", status="queued")
+        self.pool.submit(self._run, job, tables, options, warm_start)
+        return self.status(job["id"])
+
+    def _run(self, job: dict, tables: dict, options: dict, warm_start):
+        job["status"], job["started"] = "running", time.time()
+        backend = options.pop("matrix", self.matrix_backend)
+        with_legs = options.pop("legs", False)
+        t0 = time.perf_counter()
+
+        def on_solution(routes, cost, seconds, points):
+            job["progress"].append({"seconds": round(time.perf_counter() - t0, 3), "cost": int(cost)})
+
+        try:
+            routes, _, points = solve_vrp(tables["centros"], tables["demandas"], tables["vehiculos"], self.osrm_url,
+                                          cache_dir=self.cache_dir, tile_size=self.tile_size,
+                                          max_workers=self.osrm_workers, matrix_backend=backend,
+                                          profiles=self.profiles, warm_start=warm_start, on_solution=on_solution,
+                                          matrix_store=self.matrix_store, matrix_memo=self.matrices, **options)
+            if routes is None:
+                raise ValueError("sin solución (diagnóstico de factibilidad en el log del servicio)")
+            job["result"] = self._result(routes, points, tables["vehiculos"], backend, with_legs)
+            job["status"] = "done"
+        except Exception as e:
+            log.exception("trabajo %s falló", job["id"])
+            job["status"], job["error"] = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            job["finished"] = time.time()
+            metrics.inc("service_jobs_total", status=job["status"])
+            metrics.observe("service_job_seconds", job["finished"] - job["started"], status=job["status"])
+
+    def _result(self, routes: list[dict], points: pd.DataFrame, vehiculos: pd.DataFrame, backend: str,
+                with_legs: bool) -> dict:
+        """Plan con el formato del snapshot (sirve como warm_start de un re-plan) más el
+        horario por parada (stops, ver src.schedule) y, si se pidieron, los tramos con
+        distancia, duración y geometría."""
+        ids = points["id"].astype(str).to_numpy()
+        veh_ids = vehiculos["veh_id"].tolist() if "veh_id" in vehiculos.columns else None
+        result = {"routes": [{"vehicle": r["vehicle"], "veh_id": veh_ids[r["vehicle"]] if veh_ids else None,
+                              "ids": ids[r["order"]].tolist(), "meters": int(r["meters"]),
+                              "seconds": r.get("duration"), "stops": r.get("stops", [])} for r in routes]}
+        if with_legs:
+            used = [r for r in routes if len(r["order"]) > 2]
+            result["legs"] = {str(v): legs for v, legs in self._legs(used, points, backend).items()}
+        return result
+
+    def _legs(self, routes: list[dict], points: pd.DataFrame, backend: str) -> dict[int, list[dict]]:
+        """Tramos de los vehículos, pidiendo a OSRM sólo los que no están en el LRU."""
+        if backend == "offline":
+            return estimate_legs(routes, points, self.profiles)
+        keys = list(zip(points["lon"].round(5), points["lat"].round(5)))
+        out, missing = {}, []
+        for r in routes:
+            pairs = list(zip(r["order"][:-1], r["order"][1:]))
+            cached = [self.legs.get((keys[a], keys[b])) for a, b in pairs]
+            if all(c is not None for c in cached):
+                out[r["vehicle"]] = [_leg(points, a, b, c) for (a, b), c in zip(pairs, cached)]
+            else:
+                missing.append(r)
+        metrics.inc("service_leg_cache_total", len(out), result="hit")
+        metrics.inc("service_leg_cache_total", len(missing), result="miss")
+        if missing:
+            try:
+                fetched = fetch_legs(self.osrm_url, missing, points, max_workers=self.osrm_workers)
+                for legs in fetched.values():
+                    for leg in legs:
+                        self.legs[(keys[leg["from"]], keys[leg["to"]])] = {
+                            k: leg[k] for k in ("meters", "seconds", "geometry")}
+            except requests.RequestException:
+                if backend == "osrm":
+                    raise
+                log.warning("OSRM no disponible; tramos estimados en línea recta.")
+                fetched = estimate_legs(missing, points, self.profiles)
+            out.update(fetched)
+        return out
+
+    def status(self, job_id: str) -> dict | None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        now = time.time()
+        return {"id": job["id"], "status": job["status"], "error": job["error"],
+                "queued_seconds": round((job["started"] or now) - job["created"], 3),
+                "run_seconds": round((job["finished"] or now) - job["started"], 3) if job["started"] else None,
+                "best_cost": job["progress"][-1]["cost"] if job["progress"] else None}
+
+    def progress(self, job_id: str) -> dict | None:
+        status = self.status(job_id)
+        return None if status is None else {**status, "improvements": list(self.jobs[job_id]["progress"])}
+
+    def health(self) -> dict:
+        states = [j["status"] for j in list(self.jobs.values())]
+        return {"status": "ok", "workers": self.workers, "queued": states.count("queued"),
+                "running": states.count("running"), "matrices_cached": len(self.matrices),
+                "legs_cached": len(self.legs)}
+
+def _leg(points: pd.DataFrame, a: int, b: int, cached: dict) -> dict:
+    """Tramo como los de src.legs a partir de la parte guardada en el LRU."""
+    a_row, b_row = points.iloc[a], points.iloc[b]
+    return {"from": a, "to": b, "from_id": a_row["id"], "to_id": b_row["id"],
+            "from_name": a_row["name"], "to_name": b_row["name"], **cached}
+
+class _Handler(BaseHTTPRequestHandler):
+    """POST /jobs; GET /jobs, /jobs/<id>, /jobs/<id>/progress, /jobs/<id>/result, /health, /metrics."""
+    planner: Planner
+
+    def log_message(self, fmt, *args):
+        log.debug("%s %s", self.address_string(), fmt % args)
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": "no encontrado"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            status = self.planner.submit(payload)
+        except (ValueError, KeyError, TypeError, pd.errors.ParserError) as e:
+            return self._send(400, {"error": f"{type(e).__name__}: {e}"})
+        self._send(202, status)
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if parts == ["health"]:
+            return self._send(200, self.planner.health())
+        if parts == ["metrics"]:
+            return self._send(200, metrics.to_prometheus(), "text/plain; version=0.0.4")
+        if parts == ["jobs"]:
+            return self._send(200, [self.planner.status(k) for k in list(self.planner.jobs)])
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or parts[1] not in self.planner.jobs:
+            return self._send(404, {"error": "no encontrado"})
+        job_id, view = parts[1], parts[2] if len(parts) == 3 else "status"
+        if view == "status":
+            return self._send(200, self.planner.status(job_id))
+        if view == "progress":
+            return self._send(200, self.planner.progress(job_id))
+        if view == "result":
+            job = self.planner.jobs[job_id]
+            if job["status"] != "done":
+                return self._send(409, self.planner.status(job_id))
+            return self._send(200, {"id": job_id, **job["result"]})
+        self._send(404, {"error": "no encontrado"})
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        data = (body if isinstance(body, str) else json.dumps(body, ensure_ascii=False, default=str)).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_service(planner: Planner, host: str = "127.0.0.1", port: int = 8080):
+    """Servidor HTTP en un hilo; devuelve (server, url)."""
+    handler = type("Handler", (_Handler,), {"planner": planner})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+if __name__ == "__main__":
+    import argparse
+    from src.osrm_client import configure as configure_osrm
+    ap = argparse.ArgumentParser(description="Servicio HTTP de planificación (cola de trabajos con cachés en memoria)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--workers", type=int, default=2, help="trabajos resueltos a la vez")
+    ap.add_argument("--osrm", default="https://router.project-osrm.org")
+    ap.add_argument("--matrix", choices=MATRIX_BACKENDS, default="auto")
+    ap.add_argument("--cache-dir", default="cache", help="caché de matrices OSRM ('' para desactivar)")
+    ap.add_argument("--matrix-store", default=None, help="almacén regional (python -m src.matrix_store)")
+    ap.add_argument("--offline-profiles", default=None)
+    ap.add_argument("--tile-size", type=int, default=50)
+    ap.add_argument("--osrm-workers", type=int, default=4)
+    ap.add_argument("--osrm-rate", type=float, default=None)
+    ap.add_argument("--osrm-fallback", default=None)
+    ap.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    args = ap.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    configure_osrm(pool_size=max(16, args.osrm_workers * args.workers), rate=args.osrm_rate,
+                   fallback_url=args.osrm_fallback)
+    planner = Planner(args.osrm, args.matrix, args.cache_dir or None, args.matrix_store,
+                      load_profiles(args.offline_profiles), args.workers, args.tile_size, args.osrm_workers)
+    server, url = start_service(planner, args.host, args.port)
+    log.info("Servicio de planificación en %s (%d workers)", url, args.workers)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,8 +1,16 @@
 # src/solve_vrp_osrm_apu.py
 from __future__ import annotations
-import pandas as pd, math
+import logging, time
+import pandas as pd, numpy as np, math
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from src.osrm import osrm_table
+from src.matrix import get_matrix
+from src.schedule import attach_schedules
+from src.metrics import metrics, span
+
+log = logging.getLogger(__name__)
+
+HORIZON_SEC = 14 * 3600  # duración máxima de una ruta (dimensión Time)
+UNREACHABLE = 10**7      # costo (m) y tiempo (s) de un par sin ruta: supera el horizonte
 
 def hm_to_sec(hm: str) -> int:
     h, m = hm.split(":")
@@ -17,61 +25,113 @@ def _fix_window(s: int | None, e: int | None, fallback_len: int = 4*3600) -> tup
         return s, e
     return s, s + fallback_len  # repara ventana invertida
 
-def build_data(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.DataFrame):
-    # Un solo depósito (debe existir en centros con id = depot_id de vehículos)
-    depot_id = vehiculos.iloc[0]["depot_id"]
-    depo_row = centros[centros["id"] == depot_id].iloc[0]
-
-    # Lista de nodos: 0 = depósito, luego destinos únicos que aparecen en demandas
-    nodes = [depo_row]
-    node_map = {depo_row["id"]: 0}
-    for _, d in demandas.iterrows():
-        c = centros[centros["id"] == d["center_id"]].iloc[0]
-        if c["id"] not in node_map:
-            node_map[c["id"]] = len(nodes)
-            nodes.append(c)
-    pts = pd.DataFrame(nodes).reset_index(drop=True)
-
-    n = len(pts)
-    dem_vol = [0.0] * n
-    dem_kg = [0.0] * n
-    service_sec = [0] * n
-    tw_start = [0] * n
-    tw_end = [24 * 3600] * n
+def int_matrices(distances, durations, service_sec, n_depots: int = 1, ids=None) -> tuple[np.ndarray, np.ndarray]:
+    """Matrices enteras para OR-Tools: costo (m) y tiempo (s) con el servicio del nodo
+    de salida ya sumado (excepto depósitos). np.rint redondea igual que round().
+    Las celdas no finitas (null de OSRM: par sin ruta) valen UNREACHABLE, que ninguna
+    ruta puede usar dentro del horizonte, y se avisa con los pares (ids si se dan)."""
+    distances = np.asarray(distances, dtype=float)
+    durations = np.asarray(durations, dtype=float)
+    unreachable = ~(np.isfinite(distances) & np.isfinite(durations))
+    if unreachable.any():
+        pairs = np.argwhere(unreachable)
+        name = (lambda i: ids[i]) if ids is not None else (lambda i: i)
+        log.warning("%d pares sin ruta en la matriz (%s%s); se les asigna costo prohibitivo", len(pairs),
+                    ", ".join(f"{name(i)}->{name(j)}" for i, j in pairs[:10]), ", ..." if len(pairs) > 10 else "")
+        distances = np.where(unreachable, UNREACHABLE, distances)
+        durations = np.where(unreachable, UNREACHABLE, durations)
+    dist = np.rint(distances).astype(np.int64)
+    svc = np.asarray(service_sec, dtype=np.int64).copy()
+    svc[:n_depots] = 0
+    time = np.rint(durations).astype(np.int64) + svc[:, None]
+    return dist, time
 
-    # Ventana del depósito según su horario
-    depo_open = hm_to_sec(depo_row["open_from"])
-    depo_close = hm_to_sec(depo_row["open_to"])
-    tw_start[0], tw_end[0] = _fix_window(depo_open, depo_close, 9*3600)
+def capacity_ints(demands, capacities) -> tuple[list[int], list[int]]:
+    """Demandas y capacidades enteras escaladas x10 (demanda hacia arriba, capacidad hacia abajo)."""
+    return ([int(math.ceil(v * 10)) for v in demands], [int(math.floor(v * 10)) for v in capacities])
 
-    # Centros con cadena de frío (si alguna demanda lo requiere)
-    cold_centers = set(demandas.loc[demandas["cold_chain"] == True, "center_id"].tolist())
+def hm_to_sec_array(values) -> np.ndarray:
+    """Versión vectorizada de hm_to_sec para una columna 'HH:MM'."""
+    hm = pd.Series(values, dtype=str).str.split(":", n=1, expand=True)
+    return hm[0].astype(np.int64).to_numpy() * 3600 + hm[1].astype(np.int64).to_numpy() * 60
 
-    # Acumular demanda + ventanas (intersección conservadora) + servicio
-    for _, d in demandas.iterrows():
-        idx = node_map[d["center_id"]]
-        dem_vol[idx] += float(d["vol_l"])
-        dem_kg[idx]  += float(d["kg"])
-        service_sec[idx] = max(service_sec[idx], int(d["service_min"]) * 60)
-
-        s = hm_to_sec(d["tw_start"]); e = hm_to_sec(d["tw_end"])
-        s, e = _fix_window(s, e)
-        if tw_start[idx] == 0 and tw_end[idx] == 24*3600:
-            tw_start[idx], tw_end[idx] = s, e
+def _fold_windows(s0: int, e0: int, starts, ends) -> tuple[int, int]:
+    """Intersección secuencial de ventanas de un nodo (regla original, fila a fila)."""
+    for s, e in zip(starts, ends):
+        s, e = int(s), int(e)
+        if s0 == 0 and e0 == 24*3600:
+            s0, e0 = s, e
         else:
             # intersectar
-            new_s = max(tw_start[idx], s)
-            new_e = min(tw_end[idx], e)
+            new_s = max(s0, s)
+            new_e = min(e0, e)
             if new_s <= new_e:
-                tw_start[idx], tw_end[idx] = new_s, new_e
+                s0, e0 = new_s, new_e
             else:
                 # si se cruza mal, asignar una ventanita mínima de 2h desde s
-                tw_start[idx], tw_end[idx] = _fix_window(s, s + 2*3600)
+                s0, e0 = _fix_window(s, s + 2*3600)
+    return s0, e0
+
+def build_data(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.DataFrame):
+    # Depósitos: los depot_id de los vehículos (deben existir en centros), en orden de aparición
+    depot_ids = list(pd.unique(vehiculos["depot_id"]))
+    centros_by_id = centros.drop_duplicates("id").set_index("id", drop=False)
+
+    # Lista de nodos: 0..D-1 = depósitos, luego destinos únicos en orden de aparición en demandas
+    center_ids = pd.unique(demandas["center_id"])
+    unknown = [c for c in [*depot_ids, *center_ids] if c not in centros_by_id.index]
+    if unknown:
+        raise KeyError(f"Centros sin registro en centros: {unknown}")
+    n_depots = len(depot_ids)
+    node_ids = depot_ids + [c for c in center_ids if c not in depot_ids]
+    pts = centros_by_id.loc[node_ids].reset_index(drop=True)
+    node_of = pd.Index(node_ids).get_indexer(demandas["center_id"])
+
+    n = len(pts)
+    # Demanda y servicio: ufunc.at acumula en el orden de las filas (mismo redondeo que el bucle)
+    dem_vol = np.zeros(n); np.add.at(dem_vol, node_of, demandas["vol_l"].to_numpy(dtype=float))
+    dem_kg  = np.zeros(n); np.add.at(dem_kg, node_of, demandas["kg"].to_numpy(dtype=float))
+    service = np.zeros(n, dtype=np.int64)
+    np.maximum.at(service, node_of, demandas["service_min"].to_numpy(dtype=float).astype(np.int64) * 60)
+    tw_start = np.zeros(n, dtype=np.int64)
+    tw_end = np.full(n, 24 * 3600, dtype=np.int64)
+
+    # Ventana de cada depósito según su horario
+    for k, depo_row in pts.iloc[:n_depots].iterrows():
+        depo_open = hm_to_sec(depo_row["open_from"])
+        depo_close = hm_to_sec(depo_row["open_to"])
+        tw_start[k], tw_end[k] = _fix_window(depo_open, depo_close, 9*3600)
+
+    # Centros con cadena de frío (si alguna demanda lo requiere)
+    cold_centers = set(demandas.loc[demandas["cold_chain"] == True, "center_id"].tolist())
+
+    # Ventanas por fila (reparando invertidas) ordenadas por nodo, respetando el orden original
+    s = hm_to_sec_array(demandas["tw_start"]); e = hm_to_sec_array(demandas["tw_end"])
+    e = np.where(s <= e, e, s + 4*3600)
+    order = np.argsort(node_of, kind="stable")
+    g, s, e = node_of[order], s[order], e[order]
+    cum_s = pd.Series(s).groupby(g).cummax().to_numpy()
+    cum_e = pd.Series(e).groupby(g).cummin().to_numpy()
+    last = np.r_[g[1:] != g[:-1], True] if len(g) else np.zeros(0, dtype=bool)
+
+    # Caso común: la intersección acumulada nunca queda vacía -> (max inicios, min fines).
+    # Grupos con cruce, reinicio a [0,24h] o depósitos se resuelven con la regla fila a fila.
+    irregular = (cum_s > cum_e) | ((cum_s == 0) & (cum_e == 24*3600) & ~last) | (g < n_depots)
+    bad = np.unique(g[irregular])
+    ok = last & ~np.isin(g, bad)
+    tw_start[g[ok]], tw_end[g[ok]] = cum_s[ok], cum_e[ok]
+    for node in bad:
+        rows = g == node
+        tw_start[node], tw_end[node] = _fold_windows(tw_start[node], tw_end[node], s[rows], e[rows])
+
+    dem_vol, dem_kg = dem_vol.tolist(), dem_kg.tolist()
+    service_sec, tw_start, tw_end = service.tolist(), tw_start.tolist(), tw_end.tolist()
 
     # Capacidades de vehículos y refrigeración
     veh_caps_vol = [float(v) for v in vehiculos["capacity_vol_l"].tolist()]
     veh_caps_kg  = [float(v) for v in vehiculos["capacity_kg"].tolist()]
     veh_is_refrig= [bool(v)  for v in vehiculos["refrigerated"].tolist()]
+    veh_depot    = [depot_ids.index(d) for d in vehiculos["depot_id"].tolist()]  # nodo de inicio/fin
 
     # Turnos (para soft bounds de start/end)
     v_starts = [hm_to_sec(v) for v in vehiculos["shift_start"].tolist()]
@@ -82,59 +142,70 @@ def build_data(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.Data
     return (
         pts, dem_vol, dem_kg, service_sec, tw_start, tw_end,
         veh_caps_vol, veh_caps_kg, veh_is_refrig, cold_centers,
-        fleet_start, fleet_end
+        fleet_start, fleet_end, veh_depot
     )
 
-def solve_vrp(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.DataFrame, osrm_url: str):
+def subset_data(data: tuple, nodes, vehicles) -> tuple:
+    """Subproblema de build_data con los nodos (depósitos primero) y vehículos dados."""
     (
         points, dem_vol, dem_kg, service_sec, tw_start, tw_end,
         cap_vol, cap_kg, veh_is_refrig, cold_centers,
-        fleet_start, fleet_end
-    ) = build_data(centros, demandas, vehiculos)
-
-    # Matrices OSRM
-    distances, durations = osrm_table(osrm_url, points)  # m, s
-    if durations is None:
-        # Si OSRM no devolvió duraciones, estimar a 30 km/h
-        durations = []
-        for row in distances:
-            durations.append([int(round(d / 1000.0 / 30.0 * 3600.0)) for d in row])
-
-    # --- DEBUG: imprimir ventanas y servicio calculados ---
-    print("DEBUG ventanas/servicio por nodo:")
-    for i in range(len(points)):
-        print(i, points.iloc[i]["id"], points.iloc[i]["name"],
-              f"tw=[{tw_start[i]}..{tw_end[i]}] sec",
-              f"svc={service_sec[i]} sec")
+        fleet_start, fleet_end, veh_depot
+    ) = data
+    nodes = [int(i) for i in nodes]; vehicles = [int(v) for v in vehicles]
+    local = {g: l for l, g in enumerate(nodes)}
+    pick = lambda xs: [xs[i] for i in nodes]
+    vpick = lambda xs: [xs[v] for v in vehicles]
+    return (
+        points.iloc[nodes].reset_index(drop=True), pick(dem_vol), pick(dem_kg), pick(service_sec),
+        pick(tw_start), pick(tw_end), vpick(cap_vol), vpick(cap_kg), vpick(veh_is_refrig), cold_centers,
+        fleet_start, fleet_end, [local[veh_depot[v]] for v in vehicles]
+    )
 
+def build_model(data: tuple, distances, durations, use_matrix: bool = True, allowed=None):
+    """RoutingIndexManager + RoutingModel con costo, tiempo, capacidades y cadena de frío.
+    allowed: máscara n x n de arcos candidatos (src.sparse); el sucesor de cada centro
+    queda limitado a sus candidatos o al cierre de ruta."""
+    (
+        points, dem_vol, dem_kg, service_sec, tw_start, tw_end,
+        cap_vol, cap_kg, veh_is_refrig, cold_centers,
+        fleet_start, fleet_end, veh_depot
+    ) = data
     n = len(points)
-    V = len(vehiculos)
-    starts = [0] * V
-    ends   = [0] * V
+    V = len(veh_depot)
+    n_depots = max(veh_depot) + 1  # los depósitos ocupan los primeros nodos
+    starts = list(veh_depot)
+    ends   = list(veh_depot)
 
     manager = pywrapcp.RoutingIndexManager(n, V, starts, ends)
     routing = pywrapcp.RoutingModel(manager)
 
-    # Costo: distancia (m)
-    def dist_cb(from_index, to_index):
-        i = manager.IndexToNode(from_index); j = manager.IndexToNode(to_index)
-        return int(round(distances[i][j]))
-    dist_idx = routing.RegisterTransitCallback(dist_cb)
-    routing.SetArcCostEvaluatorOfAllVehicles(dist_idx)
+    if use_matrix:
+        # Matrices precalculadas: OR-Tools evalúa los arcos en C++ sin volver a Python
+        dist_int, time_int = int_matrices(distances, durations, service_sec, n_depots, points["id"].tolist())
+        dist_idx = routing.RegisterTransitMatrix(dist_int.tolist())
+        dur_idx = routing.RegisterTransitMatrix(time_int.tolist())
+    else:
+        # Costo: distancia (m)
+        def dist_cb(from_index, to_index):
+            i = manager.IndexToNode(from_index); j = manager.IndexToNode(to_index)
+            return int(round(distances[i][j]))
+        dist_idx = routing.RegisterTransitCallback(dist_cb)
 
-    # Duración vial + tiempo de servicio en el nodo de salida (excepto depósito)
-    def dur_cb(from_index, to_index):
-        i = manager.IndexToNode(from_index); j = manager.IndexToNode(to_index)
-        travel = int(round(durations[i][j]))
-        service = int(service_sec[i]) if i != 0 else 0
-        return travel + service
-    dur_idx = routing.RegisterTransitCallback(dur_cb)
+        # Duración vial + tiempo de servicio en el nodo de salida (excepto depósitos)
+        def dur_cb(from_index, to_index):
+            i = manager.IndexToNode(from_index); j = manager.IndexToNode(to_index)
+            travel = int(round(durations[i][j]))
+            service = int(service_sec[i]) if i >= n_depots else 0
+            return travel + service
+        dur_idx = routing.RegisterTransitCallback(dur_cb)
+    routing.SetArcCostEvaluatorOfAllVehicles(dist_idx)
 
     # Dimensión de tiempo (slack grande, horizonte amplio)
     routing.AddDimension(
         dur_idx,
         6 * 3600,          # slack (espera permisible)
-        14 * 3600,         # horizonte por vehículo (14h)
+        HORIZON_SEC,       # horizonte por vehículo (14h)
         True,              # start at zero
         "Time"
     )
@@ -160,22 +231,24 @@ def solve_vrp(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.DataF
         time_dim.SetCumulVarSoftUpperBound(e_index,  fleet_end,  penalty_per_sec)
 
     # Capacidades (enteros escalados x10)
-    dem_vol_int = [int(math.ceil(v * 10)) for v in dem_vol]
-    dem_kg_int  = [int(math.ceil(v * 10)) for v in dem_kg]
-    cap_vol_int = [int(math.floor(v * 10)) for v in cap_vol]
-    cap_kg_int  = [int(math.floor(v * 10)) for v in cap_kg]
+    dem_vol_int, cap_vol_int = capacity_ints(dem_vol, cap_vol)
+    dem_kg_int, cap_kg_int   = capacity_ints(dem_kg, cap_kg)
 
-    def vol_dem(from_index): return dem_vol_int[manager.IndexToNode(from_index)]
-    def kg_dem(from_index):  return dem_kg_int[manager.IndexToNode(from_index)]
-    vol_idx = routing.RegisterUnaryTransitCallback(vol_dem)
-    kg_idx  = routing.RegisterUnaryTransitCallback(kg_dem)
+    if use_matrix:
+        vol_idx = routing.RegisterUnaryTransitVector(dem_vol_int)
+        kg_idx  = routing.RegisterUnaryTransitVector(dem_kg_int)
+    else:
+        def vol_dem(from_index): return dem_vol_int[manager.IndexToNode(from_index)]
+        def kg_dem(from_index):  return dem_kg_int[manager.IndexToNode(from_index)]
+        vol_idx = routing.RegisterUnaryTransitCallback(vol_dem)
+        kg_idx  = routing.RegisterUnaryTransitCallback(kg_dem)
 
     routing.AddDimensionWithVehicleCapacity(vol_idx, 0, cap_vol_int, True, "Volume")
     routing.AddDimensionWithVehicleCapacity(kg_idx,  0, cap_kg_int,  True, "Weight")
 
     # Cadena de frío: prohibir asignación en vehículos no refrigerados
     cold_nodes = set()
-    for node in range(1, n):  # omitir depósito
+    for node in range(n_depots, n):  # omitir depósitos
         if points.iloc[node]["id"] in cold_centers:
             cold_nodes.add(node)
     for node in cold_nodes:
@@ -184,28 +257,250 @@ def solve_vrp(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.DataF
             if not is_ref:
                 routing.VehicleVar(idx).RemoveValue(v)
 
-    # Buscar solución
-    search = pywrapcp.DefaultRoutingSearchParameters()
-    search.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    search.time_limit.FromSeconds(20)
+    if allowed is not None:
+        ends = [routing.End(v) for v in range(V)]
+        for node in range(n_depots, n):
+            succ = np.flatnonzero(allowed[node, n_depots:]) + n_depots
+            succ = succ[succ != node]
+            routing.NextVar(manager.NodeToIndex(node)).SetValues(
+                [manager.NodeToIndex(int(j)) for j in succ] + ends)
+    return manager, routing
 
-    solution = routing.SolveWithParameters(search)
-    if not solution:
-        return None, None, points
+def search_parameters(time_limit: int = 20, metaheuristic: str = "GUIDED_LOCAL_SEARCH",
+                      first_solution: str = "PATH_CHEAPEST_ARC"):
+    search = pywrapcp.DefaultRoutingSearchParameters()
+    search.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution)
+    search.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    search.time_limit.FromSeconds(time_limit)
+    return search
 
-    # Extraer rutas
+def extract_routes(routing, manager, solution) -> list[dict]:
+    """Rutas de una asignación; solution=None lee los valores actuales (dentro de un
+    callback de solución)."""
+    value = solution.Value if solution is not None else (lambda var: var.Value())
     routes = []
-    for v in range(V):
+    for v in range(routing.vehicles()):
         idx = routing.Start(v)
         order = []
         dist_m = 0
         while not routing.IsEnd(idx):
             node = manager.IndexToNode(idx)
             order.append(node)
-            nxt = solution.Value(routing.NextVar(idx))
+            nxt = value(routing.NextVar(idx))
             dist_m += routing.GetArcCostForVehicle(idx, nxt, v)
             idx = nxt
         order.append(manager.IndexToNode(idx))
         routes.append({"vehicle": v, "order": order, "meters": dist_m})
-    return routes, manager, points
+    return routes
+
+def run_search(routing, search, initial=None, manager=None, on_solution=None,
+               plateau: tuple[float, float] | None = None):
+    """SolveWithParameters (o SolveFromAssignmentWithParameters si hay asignación
+    inicial) registrando en metrics cada solución mejorada y las estadísticas del solver.
+
+    on_solution(routes, costo, segundos) se llama con cada mejora (requiere manager).
+    plateau=(umbral, ventana_s) detiene la búsqueda antes del time_limit cuando el mejor
+    costo bajó menos de umbral (relativo, 0.001 = 0,1 %) en los últimos ventana_s segundos.
+    """
+    t0 = time.perf_counter()
+    history = []  # (segundos, mejor costo) en cada mejora
+
+    def on_improvement():
+        # la metaheurística también acepta soluciones peores: sólo cuentan las mejoras
+        cost = routing.CostVar().Max()
+        if history and cost >= history[-1][1]:
+            return
+        seconds = time.perf_counter() - t0
+        history.append((seconds, cost))
+        metrics.point("solver_objective", cost)
+        if on_solution is not None:
+            on_solution(extract_routes(routing, manager, None), cost, round(seconds, 3))
+    routing.AddAtSolutionCallback(on_improvement)
+
+    if plateau:
+        threshold, window = plateau
+        def stalled() -> bool:
+            now = time.perf_counter() - t0
+            if not history or now - history[0][0] < window:
+                return False
+            # mejor costo al comienzo de la ventana vs. el actual
+            ref = next((c for t, c in reversed(history) if t <= now - window), history[0][1])
+            return ref - history[-1][1] <= threshold * abs(ref)
+        limit = routing.solver().CustomLimit(stalled)
+        routing.AddSearchMonitor(limit)
+
+    with span("search"):
+        if initial is None:
+            solution = routing.SolveWithParameters(search)
+        else:
+            solution = routing.SolveFromAssignmentWithParameters(initial, search)
+    solver = routing.solver()
+    metrics.inc("solver_solutions_total", solver.Solutions())
+    metrics.inc("solver_branches_total", solver.Branches())
+    metrics.inc("solver_failures_total", solver.Failures())
+    log.info("búsqueda: %s en %.1f s, %d soluciones, %d ramas, objetivo %s",
+             "ok" if solution else "sin solución", time.perf_counter() - t0, solver.Solutions(),
+             solver.Branches(), solution.ObjectiveValue() if solution else "-")
+    return solution
+
+def solve_model(data: tuple, distances, durations, use_matrix: bool = True, time_limit: int = 20,
+                on_solution=None, plateau: tuple[float, float] | None = None, allowed=None):
+    """Construye y resuelve el modelo; devuelve (routes, manager) o (None, manager).
+    on_solution / plateau: ver run_search; allowed: ver build_model."""
+    with span("model_build"):
+        manager, routing = build_model(data, distances, durations, use_matrix, allowed)
+    solution = run_search(routing, search_parameters(time_limit), None, manager, on_solution, plateau)
+    if not solution:
+        return None, manager
+    with span("extract_routes"):
+        return extract_routes(routing, manager, solution), manager
+
+def solve_from_routes(data: tuple, distances, durations, orders: list[list[int]], use_matrix: bool = True,
+                      time_limit: int = 20, metaheuristic: str = "GUIDED_LOCAL_SEARCH",
+                      on_solution=None, plateau: tuple[float, float] | None = None, allowed=None):
+    """Mejora un plan existente: orders[v] = nodos visitados por el vehículo v (sin
+    depósitos) se usa como asignación inicial de la búsqueda local. Con
+    metaheuristic="GREEDY_DESCENT" se detiene en el primer óptimo local (rápido y estable)."""
+    search = search_parameters(time_limit, metaheuristic)
+    with span("model_build"):
+        manager, routing = build_model(data, distances, durations, use_matrix, allowed)
+        routing.CloseModelWithParameters(search)
+        initial = routing.ReadAssignmentFromRoutes(
+            [[manager.NodeToIndex(int(i)) for i in order] for order in orders], True)
+    if initial is None:
+        log.warning("el plan inicial no es válido para el modelo actual")
+        return None, manager
+    solution = run_search(routing, search, initial, manager, on_solution, plateau)
+    if not solution:
+        return None, manager
+    with span("extract_routes"):
+        return extract_routes(routing, manager, solution), manager
+
+def _scheduled(data: tuple, durations, routes: list[dict] | None) -> list[dict] | None:
+    if routes is None:
+        return None
+    with span("schedule"):
+        return attach_schedules(data, durations, routes)
+
+def data_matrices(data: tuple, osrm_url: str, cache_dir: str | None = None, tile_size: int = 50,
+                  max_workers: int = 4, matrix_backend: str = "osrm", profiles: dict | None = None,
+                  matrix_store: str | None = None, sparse_k: int | None = None, matrix_memo=None,
+                  report: dict | None = None):
+    """(distancias m, duraciones s, arcos permitidos o None) de los puntos de build_data:
+    matriz OSRM (o estimación offline según matrix_backend), o la dispersa con sparse_k.
+    report: dict del llamador; recibe 'backend' = el que respondió ('osrm' u 'offline')."""
+    points = data[0]
+    allowed = None
+    with span("matrix"):
+        if sparse_k:
+            from src.sparse import sparse_matrix
+            distances, durations, allowed = sparse_matrix(points, osrm_url, sparse_k, max(data[-1]) + 1,
+                                                          matrix_backend, tile_size, max_workers, profiles,
+                                                          cold=points["id"].isin(data[9]).to_numpy(),
+                                                          report=report)
+        else:
+            distances, durations = get_matrix(points, osrm_url, matrix_backend, cache_dir=cache_dir,
+                                              tile_size=tile_size, max_workers=max_workers,
+                                              profiles=profiles, store=matrix_store,
+                                              memo=matrix_memo, report=report)  # m, s
+    if durations is None:
+        # Si OSRM no devolvió duraciones, estimar a 30 km/h
+        durations = np.rint(np.asarray(distances, dtype=float) / 1000.0 / 30.0 * 3600.0)
+    return distances, durations, allowed
+
+def solve_vrp(centros: pd.DataFrame, demandas: pd.DataFrame, vehiculos: pd.DataFrame, osrm_url: str,
+              cache_dir: str | None = None, tile_size: int = 50, max_workers: int = 4,
+              use_matrix: bool = True, matrix_backend: str = "osrm", profiles: dict | None = None,
+              decompose: bool | str = False, workers: int | None = None, time_limit: int = 20,
+              cluster_size: int = 100, cluster_method: str = "sweep", improve_time: int = 0,
+              warm_start: dict[int, list[str]] | None = None, portfolio: bool | list[str] = False,
+              on_solution=None, plateau: tuple[float, float] | None = None,
+              matrix_store: str | None = None, sparse_k: int | None = None, matrix_memo=None,
+              matrices: tuple | None = None):
+    """Resuelve el VRP. Con decompose se resuelven subproblemas en procesos paralelos
+    (manager = None, las rutas usan los índices globales de points):
+    'depot' (o True) = un subproblema por depósito; 'cluster' = grupos de ~cluster_size
+    centros por depósito (ver src.decompose), con improve_time s de mejora global al final.
+    warm_start = plan previo ({vehículo: [ids]}, ver src.warm_start.load_plan): la búsqueda
+    parte de ese plan con los centros nuevos insertados en lugar de PATH_CHEAPEST_ARC, y
+    sólo desciende al óptimo local más cercano para no rehacer las rutas estables.
+    portfolio = True (o lista 'PRIMERA/METAHEURÍSTICA') corre varias estrategias en
+    paralelo (workers procesos, time_limit de pared) y devuelve la de menor costo.
+    on_solution(routes, costo, segundos, points) recibe cada mejora mientras se busca y
+    plateau=(umbral, ventana_s) corta la búsqueda al estancarse (ver run_search); ambos
+    aplican al modelo único, no a decompose/portfolio (los workers no los reportan).
+    matrix_store: directorio de src.matrix_store (matrices float32 mapeadas en memoria,
+    compartidas sin copia con los workers); se crea en la primera corrida.
+    sparse_k: sólo se piden a OSRM los arcos entre cada centro y sus sparse_k vecinos más
+    cercanos (más los de depósitos) y el modelo se limita a ellos (ver src.sparse).
+    matrix_memo: mapeo para reutilizar matrices entre corridas del mismo proceso (ver get_matrix).
+    matrices: (distancias, duraciones, permitidos) ya calculadas con data_matrices para
+    estos mismos datos (p. ej. el artefacto de la etapa matrix de run.py); no se piden.
+    Cada ruta vuelve con stops (arribo, espera, inicio, salida, carga y ventana por
+    parada, ver src.schedule) y duration, calculados con las matrices ya obtenidas.
+    Antes de buscar se corre src.feasibility: con errores (capacidad, frío, horizonte)
+    se registran los diagnósticos y se devuelve (None, None, points) sin buscar."""
+    from src.feasibility import check_capacity, check_time, log_issues
+    with span("build_data"):
+        data = build_data(centros, demandas, vehiculos)
+    points, service_sec, tw_start, tw_end = data[0], data[3], data[4], data[5]
+    # Planes imposibles por capacidad o frío: se descartan antes de pedir la matriz
+    with span("precheck"):
+        impossible = log_issues(check_capacity(data))
+    if impossible:
+        return None, None, points
+
+    if matrices is None:
+        matrices = data_matrices(data, osrm_url, cache_dir, tile_size, max_workers, matrix_backend,
+                                 profiles, matrix_store, sparse_k, matrix_memo)
+    distances, durations, allowed = matrices
+
+    with span("precheck"):
+        impossible = log_issues(check_time(data, durations))
+    if impossible:
+        return None, None, points
+
+    # ventanas y servicio calculados (sólo con nivel DEBUG)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("ventanas/servicio por nodo:")
+        for i in range(len(points)):
+            log.debug("%d %s %s tw=[%s..%s] sec svc=%s sec", i, points.iloc[i]["id"], points.iloc[i]["name"],
+                      tw_start[i], tw_end[i], service_sec[i])
+
+    if decompose == "cluster":
+        from src.decompose import solve_by_clusters
+        with span("parallel_search"):
+            routes = solve_by_clusters(data, distances, durations, use_matrix, time_limit, workers,
+                                       cluster_size, cluster_method, improve_time)
+        return _scheduled(data, durations, routes), None, points
+    if decompose:
+        from src.decompose import solve_by_depot
+        with span("parallel_search"):
+            routes = solve_by_depot(data, distances, durations, use_matrix, time_limit, workers)
+        return _scheduled(data, durations, routes), None, points
+
+    if portfolio:
+        from src.portfolio import solve_portfolio, DEFAULT_PORTFOLIO
+        strategies = DEFAULT_PORTFOLIO if portfolio is True else portfolio
+        with span("parallel_search"):
+            routes, report = solve_portfolio(data, distances, durations, use_matrix, time_limit, workers,
+                                             strategies)
+        log.info("portafolio:\n%s", pd.DataFrame(report).to_string(index=False))
+        return _scheduled(data, durations, routes), None, points
+
+    if on_solution is not None:
+        notify = on_solution
+        on_solution = lambda routes, cost, seconds: notify(routes, cost, seconds, points)
+    routes = None
+    if warm_start:
+        from src.warm_start import initial_orders
+        orders = initial_orders(data, distances, warm_start)
+        routes, manager = solve_from_routes(data, distances, durations, orders, use_matrix, time_limit,
+                                            "GREEDY_DESCENT", on_solution, plateau, allowed)
+    if routes is None:
+        # sin plan previo (o inválido para el modelo actual): búsqueda desde cero
+        routes, manager = solve_model(data, distances, durations, use_matrix, time_limit,
+                                      on_solution, plateau, allowed)
+    if routes is None:
+        return None, None, points
+    return _scheduled(data, durations, routes), manager, points
@@ -0,0 +1,160 @@
+# src/sparse.py
+from __future__ import annotations
+import logging, math
+import numpy as np, pandas as pd, requests
+from concurrent.futures import ThreadPoolExecutor
+from src.osrm import osrm_table, osrm_table_tiled
+from src.matrix import offline_table, MATRIX_BACKENDS
+
+log = logging.getLogger(__name__)
+
+# Costo de los arcos fuera del grafo de candidatos: ~10.000 km / ~115 días. Supera el
+# horizonte de la dimensión Time, así que el modelo nunca puede usarlos.
+FAR = 1e7
+
+def _grid_xy(points: pd.DataFrame) -> np.ndarray:
+    """Proyección equirectangular local en km (suficiente para vecindad)."""
+    lat = points["lat"].to_numpy(dtype=float); lon = points["lon"].to_numpy(dtype=float)
+    return np.c_[lon * 111.32 * math.cos(math.radians(float(np.mean(lat)))), lat * 110.57]
+
+def knn_candidates(points: pd.DataFrame, k: int = 20, n_depots: int = 1) -> np.ndarray:
+    """(centros x k) índices de los k centros más cercanos en línea recta de cada centro
+    (fila i = nodo n_depots + i; -1 si hay menos de k). Índice espacial de grilla: cada
+    celda se compara sólo con las vecinas, agrandando el anillo hasta que el k-ésimo
+    vecino quede dentro del radio cubierto (resultado exacto, costo ~lineal)."""
+    xy = _grid_xy(points)[n_depots:]
+    n = len(xy)
+    out = np.full((n, k), -1, dtype=np.int64)
+    if n <= 1 or k <= 0:
+        return out
+    lo = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - lo, 1e-9)
+    size = max(math.sqrt(span[0] * span[1] * (k + 1) / n), 1e-6)  # ~k puntos por celda
+    cell = np.floor((xy - lo) / size).astype(np.int64)
+    ncx, ncy = cell.max(axis=0) + 1
+    cid = cell[:, 0] * ncy + cell[:, 1]
+    order = np.argsort(cid, kind="stable")
+    starts = np.searchsorted(cid[order], np.arange(ncx * ncy + 1))
+
+    def members(cx0, cx1, cy0, cy1):
+        xs = np.arange(max(cx0, 0), min(cx1, ncx - 1) + 1)
+        ys = np.arange(max(cy0, 0), min(cy1, ncy - 1) + 1)
+        ids = (xs[:, None] * ncy + ys[None, :]).ravel()
+        return np.concatenate([order[starts[c]:starts[c + 1]] for c in ids])
+
+    kk = min(k, n - 1)
+    for c in np.unique(cid):
+        own = order[starts[c]:starts[c + 1]]
+        cx, cy = divmod(int(c), ncy)
+        ring = 1
+        while True:
+            near = members(cx - ring, cx + ring, cy - ring, cy + ring)
+            d = np.hypot(*(xy[own, None, :] - xy[None, near, :]).transpose(2, 0, 1))
+            d[own[:, None] == near[None, :]] = np.inf
+            covered = len(near) - 1 >= kk
+            if covered:
+                part = np.argpartition(d, kk - 1, axis=1)[:, :kk]
+                kth = np.take_along_axis(d, part, axis=1).max(axis=1)
+                # lo no revisado está al menos a ring * size de cualquier punto de la celda
+                covered = (kth <= ring * size).all() or len(near) == n
+            if covered:
+                best = np.take_along_axis(part, np.argsort(np.take_along_axis(d, part, axis=1), axis=1), axis=1)
+                out[own, :kk] = near[best] + n_depots
+                break
+            ring += 1
+    return out[:, :kk] if kk < k else out
+
+def candidate_mask(candidates: np.ndarray, n: int, n_depots: int = 1, nodes=None) -> np.ndarray:
+    """Arcos permitidos (n x n): vecinos en ambos sentidos, desde/hacia depósitos y diagonal.
+    nodes: nodo de cada fila de candidates (por defecto todos los centros)."""
+    mask = np.zeros((n, n), dtype=bool)
+    nodes = np.arange(n_depots, n) if nodes is None else np.asarray(nodes)
+    rows = np.repeat(nodes, candidates.shape[1])
+    cols = candidates.ravel()
+    ok = cols >= 0
+    mask[rows[ok], cols[ok]] = True
+    mask[cols[ok], rows[ok]] = True
+    mask[:n_depots, :] = True
+    mask[:, :n_depots] = True
+    np.fill_diagonal(mask, True)
+    return mask
+
+def _sparse_osrm(osrm_url, points, mask, n_depots, tile_size, max_workers):
+    """Sólo las celdas del grafo: filas/columnas de depósitos con /table en bloques y,
+    para los centros, grupos de orígenes cercanos con la unión de sus vecinos como
+    destinos (<= 2 * tile_size coordenadas por petición)."""
+    n = len(points)
+    distances = np.full((n, n), FAR, dtype=np.float32)
+    durations = np.full((n, n), FAR, dtype=np.float32)
+    depots = np.arange(n_depots)
+    for sources, destinations in ((depots, None), (None, depots)):
+        d, t = osrm_table_tiled(osrm_url, points, sources=sources, destinations=destinations,
+                                tile_size=tile_size, max_workers=max_workers)
+        if t is None:
+            t = d / 1000.0 / 30.0 * 3600.0  # sin duraciones: 30 km/h, como solve_vrp
+        rows = depots if sources is not None else slice(None)
+        cols = depots if destinations is not None else slice(None)
+        distances[rows, cols] = d; durations[rows, cols] = t
+
+    # orígenes en orden espacial (barrido por filas de grilla) para que los grupos compartan vecinos
+    xy = _grid_xy(points)
+    band = np.floor((xy[:, 1] - xy[:, 1].min()) / 10.0)  # franjas de 10 km
+    centers = np.arange(n_depots, n)
+    centers = centers[np.lexsort((xy[centers, 0], band[centers]))]
+    groups, cur, cur_nodes = [], [], set()
+    for i in centers:
+        nxt = set(np.flatnonzero(mask[i, n_depots:]) + n_depots) | {int(i)}
+        if cur and len(cur_nodes | nxt) > 2 * tile_size:
+            groups.append((cur, sorted(cur_nodes))); cur, cur_nodes = [], set()
+        cur.append(int(i)); cur_nodes |= nxt
+    if cur:
+        groups.append((cur, sorted(cur_nodes)))
+
+    def fetch(group):
+        src, nodes = group
+        pos = {v: j for j, v in enumerate(nodes)}
+        d, t = osrm_table(osrm_url, points.iloc[nodes], sources=[pos[v] for v in src])
+        return src, nodes, np.array(d, dtype=float), (np.array(t, dtype=float) if t is not None else None)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+        for src, nodes, d, t in ex.map(fetch, groups):
+            if t is None:
+                t = d / 1000.0 / 30.0 * 3600.0
+            keep = mask[np.ix_(src, nodes)]
+            block_d = distances[np.ix_(src, nodes)]; block_t = durations[np.ix_(src, nodes)]
+            block_d[keep] = d[keep]; block_t[keep] = t[keep]
+            distances[np.ix_(src, nodes)] = block_d; durations[np.ix_(src, nodes)] = block_t
+    return distances, durations
+
+def sparse_matrix(points: pd.DataFrame, osrm_url: str, k: int = 20, n_depots: int = 1, backend: str = "osrm",
+                  tile_size: int = 50, max_workers: int = 4, profiles: dict | None = None, cold=None,
+                  report: dict | None = None):
+    """(distancias, duraciones, máscara) con costo real sólo en el grafo de k vecinos
+    (más depósitos) y FAR en el resto. Con OSRM se piden ~n*(k + depósitos) celdas en
+    vez de n²; 'offline' calcula la matriz local y la enmascara. 'auto' cae a offline
+    si OSRM no responde.
+    cold: máscara de nodos con cadena de frío; se les agregan sus k vecinos fríos, si no
+    los refrigerados (pocos) no pueden encadenarlos y el modelo queda sin solución.
+    report: dict del llamador; recibe 'backend' = el que respondió ('osrm' u 'offline')."""
+    if backend not in MATRIX_BACKENDS:
+        raise ValueError(f"backend de matriz desconocido: {backend!r} (use {MATRIX_BACKENDS})")
+    n = len(points)
+    mask = candidate_mask(knn_candidates(points, k, n_depots), n, n_depots)
+    if cold is not None:
+        nodes = np.flatnonzero(np.asarray(cold, dtype=bool)[n_depots:]) + n_depots
+        near = knn_candidates(points.iloc[nodes], k, 0)
+        mask |= candidate_mask(np.where(near >= 0, nodes[near], -1), n, n_depots, nodes)
+    report = {} if report is None else report
+    if backend != "offline":
+        try:
+            distances, durations = _sparse_osrm(osrm_url, points, mask, n_depots, tile_size, max_workers)
+            report["backend"] = "osrm"
+            return distances, durations, mask
+        except requests.RequestException as e:
+            if backend == "osrm":
+                raise
+            log.warning("OSRM no disponible (%s); usando matriz offline.", type(e).__name__)
+    report["backend"] = "offline"
+    distances, durations = offline_table(points, profiles)
+    distances[~mask] = FAR; durations[~mask] = FAR
+    return distances, durations, mask
@@ -0,0 +1,127 @@
+# src/tables.py
+from __future__ import annotations
+import os
+import pandas as pd
+
+# Tipos explícitos de las tablas de entrada (columnas ausentes se ignoran, las demás se
+# infieren). Los ids son texto en las tres tablas para que "101" y 101 no difieran.
+TABLE_DTYPES = {
+    "centros": {"id": "str", "name": "str", "address": "str", "lat": "float64", "lon": "float64",
+                "type": "category", "region": "str", "open_from": "str", "open_to": "str"},
+    "demandas": {"order_id": "str", "center_id": "str", "item": "category", "qty": "float64",
+                 "vol_l": "float64", "kg": "float64", "priority": "Int16", "cold_chain": "bool",
+                 "tw_start": "str", "tw_end": "str", "service_min": "float64"},
+    "vehiculos": {"veh_id": "str", "plate": "str", "capacity_vol_l": "float64", "capacity_kg": "float64",
+                  "refrigerated": "bool", "shift_start": "str", "shift_end": "str", "depot_id": "str"},
+}
+# Salidas por fila (run.py / src.pipeline), en el orden de sus columnas.
+PLAN_DTYPES = {"vehicle": "int32", "seq": "int32", "node_index": "int32", "id": "str", "name": "str"}
+LEG_DTYPES = {"vehicle": "int32", "from_id": "str", "to_id": "str", "from_name": "str", "to_name": "str",
+              "meters": "float64", "seconds": "float64"}
+SCHEDULE_DTYPES = {"vehicle": "int32", "seq": "int32", "id": "str", "name": "str", "arrival": "str",
+                   "wait_min": "float64", "start": "str", "departure": "str", "load_vol_l": "float64",
+                   "load_kg": "float64", "window": "str", "early_min": "float64", "late_min": "float64"}
+OUTPUT_FORMATS = ("csv", "parquet")
+TRUE_VALUES = {"true", "1", "yes", "si", "sí", "t", "y"}
+
+def _format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    return {".parquet": "parquet", ".pq": "parquet", ".feather": "feather", ".arrow": "feather"}.get(ext, "csv")
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Parquet/Arrow necesita pyarrow (pip install pyarrow)") from e
+
+def apply_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """df con los tipos de dtypes en las columnas presentes. Texto conserva los nulos y
+    los booleanos aceptan 'True'/'false'/'1'/'sí' (astype(bool) daría True para 'False')."""
+    out = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        s = df[col]
+        if dtype == "str":
+            if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) in ("string", "empty"):
+                continue  # ya es texto (p. ej. Parquet): evita copiar la columna
+            out[col] = s.where(s.isna(), s.astype(str)).astype(object)
+        elif dtype == "bool" and s.dtype == object:
+            out[col] = s.map(lambda v: str(v).strip().lower() in TRUE_VALUES)
+        elif dtype == "bool":
+            out[col] = s.fillna(False).astype(bool)
+        else:
+            out[col] = s.astype(dtype)
+    return df.assign(**out) if out else df
+
+def read_table(path: str, dtypes: dict | str | None = None) -> pd.DataFrame:
+    """CSV, Parquet (.parquet/.pq) o Feather/Arrow (.feather/.arrow) según la extensión,
+    con tipos explícitos: dtypes = nombre de tabla de TABLE_DTYPES o {columna: tipo}.
+    Parquet y Arrow guardan sus tipos y cargan varias veces más rápido que CSV."""
+    dtypes = TABLE_DTYPES[dtypes] if isinstance(dtypes, str) else (dtypes or {})
+    fmt = _format(path)
+    if fmt == "csv":
+        # read_csv ya aplica los tipos; sólo los booleanos se normalizan después
+        df = pd.read_csv(path, dtype={c: (str if t == "str" else t) for c, t in dtypes.items() if t != "bool"})
+        return apply_dtypes(df, {c: t for c, t in dtypes.items() if t == "bool"})
+    _require_pyarrow()
+    df = pd.read_parquet(path) if fmt == "parquet" else pd.read_feather(path)
+    return apply_dtypes(df, dtypes)
+
+def write_table(df: pd.DataFrame, path: str):
+    """Escribe df en el formato de la extensión de path (ver read_table)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fmt = _format(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    else:
+        _require_pyarrow()
+        df.to_parquet(path, index=False) if fmt == "parquet" else df.reset_index(drop=True).to_feather(path)
+
+class RowWriter:
+    """Filas por lotes (p. ej. un vehículo a la vez) a CSV o Parquet con columnas y tipos
+    fijos: cada lote se escribe y se descarta, sin juntar todo el plan en memoria. En
+    CSV el archivo crece con cada lote (se puede seguir con tail); en Parquet cada lote
+    es un row group y el archivo queda legible al cerrar."""
+
+    def __init__(self, path: str, dtypes: dict):
+        self.path, self.dtypes = path, dtypes
+        self.fmt = "parquet" if _format(path) == "parquet" else "csv"
+        self.rows = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if self.fmt == "parquet":
+            _require_pyarrow()
+            import pyarrow as pa, pyarrow.parquet as pq
+            arrow = {"str": pa.string(), "float64": pa.float64(), "int32": pa.int32(), "int64": pa.int64(),
+                     "bool": pa.bool_()}
+            self.schema = pa.schema([(c, arrow[t]) for c, t in dtypes.items()])
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self._file = open(path, "w", encoding="utf-8", newline="")
+            pd.DataFrame(columns=list(dtypes)).to_csv(self._file, index=False)
+
+    def write(self, rows) -> int:
+        """Agrega un lote (lista de dicts o DataFrame); devuelve las filas escritas."""
+        frame = apply_dtypes(pd.DataFrame(rows, columns=list(self.dtypes)), self.dtypes)
+        if not len(frame):
+            return 0
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            self._writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+        else:
+            frame.to_csv(self._file, header=False, index=False)
+            self._file.flush()
+        self.rows += len(frame)
+        return len(frame)
+
+    def close(self):
+        if self.fmt == "parquet":
+            self._writer.close()
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,156 @@
+# src/trip.py
+from __future__ import annotations
+import logging
+import numpy as np, pandas as pd, polyline, requests
+from ortools.constraint_solver import pywrapcp
+from src.osrm import osrm_route_legs, osrm_table_tiled
+from src.matrix import MATRIX_BACKENDS, offline_table
+from src.matrix_cache import _coord_keys
+from src.solve_vrp_osrm_apu import search_parameters, run_search
+from src.lru import LRU
+
+log = logging.getLogger(__name__)
+
+def _insert(order: list[int], new: list[int], cost: np.ndarray) -> list[int]:
+    """Inserta cada nodo nuevo donde menos costo agrega (order incluye inicio y fin)."""
+    order = list(order)
+    for j in new:
+        a, b = np.array(order[:-1]), np.array(order[1:])
+        k = int(np.argmin(cost[a, j] + cost[j, b] - cost[a, b]))
+        order.insert(k + 1, j)
+    return order
+
+def order_stops(durations, start: int = 0, end: int = 0, initial: list[int] | None = None,
+                time_limit_ms: int = 1000) -> list[int]:
+    """Orden de visita de un solo vehículo (índices, de start a end) que minimiza la
+    duración. Con initial (orden previo) se parte de él con descenso greedy, que en un
+    re-plan de una parada termina en milisegundos; sin él, PATH_CHEAPEST_ARC + GLS."""
+    n = len(durations)
+    middle = [i for i in range(n) if i not in (start, end)]
+    if len(middle) <= 1:
+        return [start] + middle + [end]
+    cost = np.rint(np.asarray(durations, dtype=float)).astype(np.int64)
+    manager = pywrapcp.RoutingIndexManager(n, 1, [start], [end])
+    routing = pywrapcp.RoutingModel(manager)
+    transit = routing.RegisterTransitMatrix(cost.tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit)
+    search = search_parameters(0, "GREEDY_DESCENT" if initial else "GUIDED_LOCAL_SEARCH")
+    search.time_limit.FromMilliseconds(time_limit_ms)
+    assignment = None
+    if initial:
+        routing.CloseModelWithParameters(search)
+        assignment = routing.ReadAssignmentFromRoutes([initial[1:-1]], True)
+    solution = run_search(routing, search, initial=assignment)
+    if solution is None:
+        return initial or [start] + middle + [end]
+    idx, order = routing.Start(0), []
+    while not routing.IsEnd(idx):
+        order.append(manager.IndexToNode(idx))
+        idx = solution.Value(routing.NextVar(idx))
+    return order + [manager.IndexToNode(idx)]
+
+class TripPlanner:
+    """Ruta de la app (un vehículo, sin capacidades ni ventanas) con el mismo backend de
+    matriz que el planificador. Por sesión se guardan la matriz y el último orden (LRU
+    de sesiones): agregar una parada pide sólo su fila y su columna y re-optimiza desde
+    el orden anterior; quitarla no pide nada. Las geometrías por tramo se comparten
+    entre sesiones (LRU por par de coordenadas)."""
+
+    def __init__(self, osrm_url: str, backend: str = "auto", profiles: dict | None = None,
+                 sessions: int = 64, legs: int = 20000, tile_size: int = 50, max_workers: int = 4):
+        if backend not in MATRIX_BACKENDS:
+            raise ValueError(f"backend de matriz desconocido: {backend!r} (use {MATRIX_BACKENDS})")
+        self.osrm_url, self.backend, self.profiles = osrm_url, backend, profiles
+        self.tile_size, self.max_workers = tile_size, max_workers
+        self.sessions = LRU(sessions)
+        self.legs = LRU(legs)
+
+    def _table(self, points: pd.DataFrame, sources=None, destinations=None):
+        if self.backend != "offline":
+            try:
+                d, t = osrm_table_tiled(self.osrm_url, points, sources=sources, destinations=destinations,
+                                        tile_size=self.tile_size, max_workers=self.max_workers)
+                return d, (t if t is not None else d / 1000.0 / 30.0 * 3600.0)
+            except requests.RequestException as e:
+                if self.backend == "osrm":
+                    raise
+                log.warning("OSRM no disponible (%s); usando matriz offline.", type(e).__name__)
+        d, t = offline_table(points, self.profiles)
+        rows = slice(None) if sources is None else sources
+        cols = slice(None) if destinations is None else destinations
+        return d[rows][:, cols], t[rows][:, cols]
+
+    def matrix(self, session_id: str, points: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """Matrices de points reutilizando las de la sesión: sólo se piden los puntos nuevos."""
+        state = self._session(session_id, points)
+        return state["dist"], state["dur"]
+
+    def _session(self, session_id: str, points: pd.DataFrame) -> dict:
+        """Estado de la sesión con las matrices de points (ver matrix). Se devuelve el
+        dict en vez de releerlo del LRU: con muchas sesiones a la vez puede salir de él
+        antes de usarlo."""
+        keys = _coord_keys(points, 5)
+        state = self.sessions.get(session_id) or {"keys": [], "dist": np.empty((0, 0)),
+                                                  "dur": np.empty((0, 0)), "order": None}
+        pos = {k: i for i, k in enumerate(state["keys"])}
+        have = [i for i, k in enumerate(keys) if k in pos]
+        new = [i for i, k in enumerate(keys) if k not in pos]
+        n = len(keys)
+        dist, dur = np.zeros((n, n)), np.zeros((n, n))
+        old = [pos[keys[i]] for i in have]
+        dist[np.ix_(have, have)] = state["dist"][np.ix_(old, old)]
+        dur[np.ix_(have, have)] = state["dur"][np.ix_(old, old)]
+        if new:
+            d, t = self._table(points, sources=new)
+            dist[new, :], dur[new, :] = d, t
+            d, t = self._table(points, destinations=new)
+            dist[:, new], dur[:, new] = d, t
+        state = {**state, "keys": keys, "dist": dist, "dur": dur}
+        self.sessions[session_id] = state
+        return state
+
+    def _route_legs(self, points: pd.DataFrame, order: list[int]) -> list[dict]:
+        """{distance, duration, geometry} por tramo; con alguno fuera del caché se pide
+        toda la secuencia en una sola petición /route."""
+        keys = _coord_keys(points, 5)
+        pairs = list(zip(order[:-1], order[1:]))
+        legs = [self.legs.get((keys[a], keys[b])) for a, b in pairs]
+        if all(leg is not None for leg in legs):
+            return legs
+        fetched = None
+        if self.backend != "offline":
+            try:
+                fetched = osrm_route_legs(self.osrm_url, list(zip(points["lon"].iloc[order], points["lat"].iloc[order])))
+            except requests.RequestException:
+                if self.backend == "osrm":
+                    raise
+        if fetched is None:  # sin red: matriz y segmento recto
+            dist, dur = offline_table(points, self.profiles)
+            fetched = [{"distance": float(dist[a, b]), "duration": float(dur[a, b]),
+                        "geometry": polyline.encode([(points["lat"].iloc[i], points["lon"].iloc[i]) for i in (a, b)])}
+                       for a, b in pairs]
+        for (a, b), leg in zip(pairs, fetched):
+            self.legs[(keys[a], keys[b])] = leg
+        return fetched
+
+    def plan(self, session_id: str, points: pd.DataFrame, roundtrip: bool = True,
+             geometry: bool = True) -> dict:
+        """Orden de visita de points (fila 0 = inicio; sin roundtrip termina en la última
+        fila) con totales y tramos: {order, distance, duration, legs}."""
+        state = self._session(session_id, points)
+        dist, dur, keys = state["dist"], state["dur"], state["keys"]
+        start, end = 0, (0 if roundtrip else len(points) - 1)
+        initial = None
+        if state.get("order") and state.get("roundtrip") == roundtrip:
+            pos = {k: i for i, k in enumerate(keys)}
+            kept = [pos[k] for k in dict.fromkeys(state["order"]) if k in pos and pos[k] not in (start, end)]
+            new = [i for i in range(len(points)) if i not in (start, end) and i not in set(kept)]
+            initial = _insert([start] + kept + [end], new, dur)
+        limit = 500 if initial else min(2000, 300 + 10 * len(points))
+        order = order_stops(dur, start, end, initial, limit)
+        self.sessions[session_id] = {**state, "order": [keys[i] for i in order], "roundtrip": roundtrip}
+        legs = self._route_legs(points, order) if geometry else [
+            {"distance": float(dist[a, b]), "duration": float(dur[a, b]), "geometry": None}
+            for a, b in zip(order[:-1], order[1:])]
+        return {"order": order, "distance": sum(l["distance"] for l in legs),
+                "duration": sum(l["duration"] for l in legs), "legs": legs}
@@ -0,0 +1,92 @@
+# src/warm_start.py
+from __future__ import annotations
+import json, os
+import numpy as np, pandas as pd
+from src.tables import read_table
+
+def snapshot(routes: list[dict], points: pd.DataFrame, vehiculos: pd.DataFrame) -> dict:
+    """Plan con ids de centro y veh_id (estable aunque cambie el orden de las filas)."""
+    veh_ids = vehiculos["veh_id"].tolist() if "veh_id" in vehiculos.columns else None
+    return {"routes": [{
+        "vehicle": r["vehicle"],
+        "veh_id": veh_ids[r["vehicle"]] if veh_ids else None,
+        "ids": [str(points.iloc[i]["id"]) for i in r["order"]],
+    } for r in routes]}
+
+def save_snapshot(path: str, routes: list[dict], points: pd.DataFrame, vehiculos: pd.DataFrame):
+    """Plan en JSON (ver snapshot)."""
+    snap = snapshot(routes, points, vehiculos)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snap, f, ensure_ascii=False, indent=1)
+
+def load_plan(path: str, vehiculos: pd.DataFrame) -> dict[int, list[str]]:
+    """Plan previo -> {índice de vehículo actual: [ids visitados en orden]}.
+    Acepta outputs/plan_entregas.csv o .parquet (vehicle, seq, id) o el snapshot JSON."""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return plan_from_snapshot(json.load(f), vehiculos)
+    df = read_table(path, {"id": "str"}).sort_values(["vehicle", "seq"], kind="stable")
+    plan = {int(v): g["id"].tolist() for v, g in df.groupby("vehicle", sort=False)}
+    return {v: ids for v, ids in plan.items() if 0 <= v < len(vehiculos)}
+
+def plan_from_snapshot(snap: dict, vehiculos: pd.DataFrame) -> dict[int, list[str]]:
+    """Como load_plan, para un snapshot ya leído ({"routes": [{vehicle, veh_id, ids}]})."""
+    by_veh_id = {v: i for i, v in enumerate(vehiculos["veh_id"])} if "veh_id" in vehiculos.columns else {}
+    plan = {}
+    for r in snap["routes"]:
+        v = by_veh_id.get(r.get("veh_id"), r["vehicle"])
+        plan[int(v)] = [str(i) for i in r["ids"]]
+    return {v: ids for v, ids in plan.items() if 0 <= v < len(vehiculos)}
+
+def initial_orders(data: tuple, distances, plan: dict[int, list[str]]) -> list[list[int]]:
+    """Rutas iniciales (sin depósitos) a partir del plan previo: se conservan los centros
+    que siguen en el problema (y en un vehículo compatible con su cadena de frío) y los
+    nuevos se insertan donde menos distancia agregan, respetando capacidad."""
+    from src.solve_vrp_osrm_apu import capacity_ints  # OR-Tools sólo al resolver
+    (
+        points, dem_vol, dem_kg, service_sec, tw_start, tw_end,
+        cap_vol, cap_kg, veh_is_refrig, cold_centers,
+        fleet_start, fleet_end, veh_depot
+    ) = data
+    n_depots = max(veh_depot) + 1
+    dist = np.asarray(distances, dtype=float)
+    node_of = {str(c): i for i, c in enumerate(points["id"]) if i >= n_depots}
+    cold = [str(c) in {str(x) for x in cold_centers} for c in points["id"]]
+
+    orders = [[] for _ in veh_depot]
+    seen = set()
+    for v, ids in plan.items():
+        for c in ids:
+            node = node_of.get(str(c))
+            if node is None or node in seen or (cold[node] and not veh_is_refrig[v]):
+                continue  # centro retirado, repetido o en vehículo no refrigerado
+            orders[v].append(node); seen.add(node)
+
+    # cargas en la misma escala entera que el modelo, para que el plan inicial sea válido
+    dem_vol, cap_vol = capacity_ints(dem_vol, cap_vol)
+    dem_kg, cap_kg = capacity_ints(dem_kg, cap_kg)
+    load_vol = [sum(dem_vol[i] for i in o) for o in orders]
+    load_kg = [sum(dem_kg[i] for i in o) for o in orders]
+    for node in range(n_depots, len(points)):
+        if node in seen:
+            continue
+        best = None
+        for v, order in enumerate(orders):
+            if (cold[node] and not veh_is_refrig[v]) or load_vol[v] + dem_vol[node] > cap_vol[v] \
+                    or load_kg[v] + dem_kg[node] > cap_kg[v]:
+                continue
+            path = np.array([veh_depot[v], *order, veh_depot[v]])
+            delta = dist[path[:-1], node] + dist[node, path[1:]] - dist[path[:-1], path[1:]]
+            k = int(np.argmin(delta))
+            if best is None or delta[k] < best[0]:
+                best = (delta[k], v, k)
+        if best is None:
+            # sin vehículo con cupo: al compatible menos cargado (la búsqueda lo reubicará)
+            v = min((v for v in range(len(orders)) if veh_is_refrig[v] or not cold[node]),
+                    key=lambda v: load_vol[v], default=0)
+            best = (0.0, v, len(orders[v]))
+        _, v, k = best
+        orders[v].insert(k, node)
+        load_vol[v] += dem_vol[node]; load_kg[v] += dem_kg[node]
+    return orders
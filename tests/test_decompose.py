@@ -0,0 +1,68 @@
+# tests/test_decompose.py
+import numpy as np
+import pytest
+from bench.synthetic import synthetic_instance
+from src.decompose import assign_to_depots, solve_by_clusters, solve_by_depot, solve_parts
+from src.feasibility import round_trips
+from src.matrix import offline_table
+from src.solve_vrp_osrm_apu import HORIZON_SEC, build_data
+
+SLOW = 8 * 3600  # s por sentido: ida y vuelta de 16 h, fuera del horizonte de 14 h
+
+@pytest.fixture(scope="module")
+def instance():
+    """Dos depósitos; los centros más cercanos por distancia a D1 sólo se alcanzan desde
+    D2 dentro del horizonte (desde D1 y sus centros el camino es de SLOW s)."""
+    centros, demandas, vehiculos = synthetic_instance(16, n_depots=2, tw_tightness=0.0, cold_share=0.0,
+                                                      seed=3)
+    data = build_data(centros, demandas, vehiculos)
+    distances, durations = (np.asarray(m, dtype=float) for m in offline_table(data[0]))
+    near_d1 = 2 + np.flatnonzero(distances[0, 2:] + distances[2:, 0] < distances[1, 2:] + distances[2:, 1])
+    slow = near_d1[:2]
+    others = [j for j in range(len(distances)) if j != 1]
+    for i in slow:
+        durations[np.ix_(others, [i])] = SLOW
+        durations[np.ix_([i], others)] = SLOW
+        durations[i, i] = 0
+    return data, distances, durations, [int(i) for i in slow]
+
+def _visited(routes):
+    return sorted(n for r in routes for n in r["order"][1:-1])
+
+def test_instance_has_stops_out_of_horizon_from_nearest_depot(instance):
+    data, distances, durations, slow = instance
+    assert slow
+    trips = round_trips(durations, data[3], 2)
+    for i in slow:
+        assert distances[0, i] + distances[i, 0] < distances[1, i] + distances[i, 1]
+        assert trips[0, i] > HORIZON_SEC >= trips[1, i]
+
+def test_assign_to_depots_respects_horizon(instance):
+    data, distances, durations, slow = instance
+    assigned = assign_to_depots(data, distances, durations)
+    assert [assigned[i] for i in slow] == [1] * len(slow)
+
+def test_solve_by_depot_covers_all_stops(instance):
+    data, distances, durations, slow = instance
+    routes = solve_by_depot(data, distances, durations, time_limit=1, workers=2)
+    assert routes is not None
+    assert _visited(routes) == list(range(2, len(data[0])))
+
+def test_solve_by_clusters_covers_all_stops(instance):
+    data, distances, durations, slow = instance
+    routes = solve_by_clusters(data, distances, durations, time_limit=1, workers=2, cluster_size=4)
+    assert routes is not None
+    assert _visited(routes) == list(range(2, len(data[0])))
+    depot_of = data[-1]
+    assert all(depot_of[r["vehicle"]] == 1 for r in routes if set(r["order"]) & set(slow))
+
+def test_solve_parts_repairs_a_failed_part(instance):
+    # el centro lento en la parte de D1 no tiene solución: se une con la parte de D2
+    data, distances, durations, slow = instance
+    assigned = assign_to_depots(data, distances, durations)
+    assigned[slow[0]] = 0
+    parts = [([d] + [i for i in range(2, len(assigned)) if assigned[i] == d],
+              [v for v, vd in enumerate(data[-1]) if vd == d]) for d in range(2)]
+    routes = solve_parts(data, distances, durations, parts, time_limit=1, workers=2)
+    assert routes is not None
+    assert _visited(routes) == list(range(2, len(data[0])))